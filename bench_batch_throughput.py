@@ -0,0 +1,56 @@
+# Measure the throughput of MIDIProcThread in batch mode, in events/second, for
+# different maximum batch sizes.
+#
+# A sender thread floods the input queue with single-event messages like a
+# dense controller sweep, the main thread collects the processed events from
+# the output queue. Note the number of events actually waiting in the queue is
+# bounded by the queue's size limit (msgmnb, 16384 bytes by default, so 512
+# midimsgs).
+
+import midi_proc_jack
+import sysv_ipc as ipc
+import threading
+import time
+
+KEY_IN=0x6d72
+KEY_OUT=0x6d73
+NEVENTS=50000
+
+def sender(q,n):
+    mev=midi_proc_jack.MIDIEvent(0,'ControlChange',0,bytes([0,7,0]))
+    for i in range(n):
+        mev.tme_mon=i
+        mev.set_cc_val(i)
+        q.send(mev.to_bytes(),type=midi_proc_jack.MSGTYPE)
+
+def bench(batch_max):
+    th=midi_proc_jack.MIDIProcThread(KEY_IN,KEY_OUT,batch=True,
+            batch_max=batch_max)
+    q_in=ipc.MessageQueue(KEY_IN,ipc.IPC_CREAT)
+    q_out=ipc.MessageQueue(KEY_OUT,ipc.IPC_CREAT,
+            max_message_size=midi_proc_jack.MSGQ_MAX_MESSAGE_SIZE)
+    th.start()
+    snd=threading.Thread(target=sender,args=(q_in,NEVENTS))
+    t_start=time.perf_counter()
+    snd.start()
+    nrecvd=0
+    while nrecvd < NEVENTS:
+        msg=q_out.receive(type=midi_proc_jack.MSGTYPE)[0]
+        nrecvd+=len(msg)//midi_proc_jack.midimsg_struct.size
+    t_end=time.perf_counter()
+    snd.join()
+    th.stop()
+    th.join()
+    q_in.remove()
+    q_out.remove()
+    return NEVENTS/(t_end-t_start)
+
+def main():
+    print("%10s %14s" % ('batch_max','events/s'))
+    batch_max=1
+    while batch_max <= 1024:
+        print("%10d %14.0f" % (batch_max,bench(batch_max)))
+        batch_max*=2
+
+if __name__ == '__main__':
+    main()
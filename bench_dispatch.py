@@ -0,0 +1,43 @@
+# Measure the cost per event of finding and calling the callback for a
+# MIDIEvent. The old per-channel dict of callbacks keyed by event name is
+# rebuilt here for comparison with the status byte indexed midi_cbs table.
+
+import midi_proc_jack
+import timeit
+
+NEVENTS=10000
+
+def transpose(mev):
+    mev.set_pitch(mev.get_pitch()-7)
+    return [mev]
+
+def make_events():
+    return [midi_proc_jack.MIDIEvent(i,['NoteOn','NoteOff'][i%2],i%16,
+        bytes([0,60,100])) for i in range(NEVENTS)]
+
+def make_dict_cbs(cb):
+    names=midi_proc_jack.midi_code_table.keys()
+    return [{n:cb for n in names} for chan in range(16)]
+
+def dispatch_dict(mevs,cbs):
+    out=[]
+    for mev in mevs:
+        out+=cbs[mev.chan][mev.typ](mev)
+    return out
+
+def per_event_us(f):
+    return min(timeit.repeat(f,number=10,repeat=5))/(10*NEVENTS)*1e6
+
+def main():
+    mevs=make_events()
+    for name,cb in [('default',midi_proc_jack._midi_cb_default),
+            ('transpose',transpose)]:
+        dict_cbs=make_dict_cbs(cb)
+        midi_proc_jack.set_midi_cb(None,None,cb)
+        print("%-10s dict: %6.3f us/event table: %6.3f us/event" % (name,
+            per_event_us(lambda: dispatch_dict(mevs,dict_cbs)),
+            per_event_us(lambda: midi_proc_jack._midi_cbs_proc_batch(mevs))))
+    midi_proc_jack.reset_midi_cb(None,None)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+# Measure switching between a few dozen patterns, creating a Parser and
+# compiling the pattern on every switch as was needed before get_code, and
+# getting the compiled pattern from get_code.
+
+import domelang
+import contextlib
+import io
+import random
+import time
+
+NPATTERNS=32
+NSWITCHES=2000
+
+def make_patterns():
+    """
+    Patterns of a few dozen tokens transposing and scaling pitch vectors.
+    """
+    rng=random.Random(1)
+    pats=[]
+    for i in range(NPATTERNS):
+        ops=['%d %s' % (rng.randint(1,12),rng.choice('+-×'))
+                for j in range(rng.randint(8,24))]
+        pats.append(' '.join(ops))
+    return pats
+
+def compile_each_time(src):
+    # Parser used to print its commands when created
+    with contextlib.redirect_stdout(io.StringIO()):
+        parser=domelang.Parser()
+    return domelang.compile_prog(parser.parse(src))
+
+def time_switches(get,switches):
+    t=time.perf_counter()
+    for src in switches:
+        get(src)
+    return (time.perf_counter()-t)/len(switches)
+
+def main():
+    pats=make_patterns()
+    rng=random.Random(2)
+    switches=[rng.choice(pats) for i in range(NSWITCHES)]
+    t_compile=time_switches(compile_each_time,switches)
+    domelang.clear_code_cache()
+    t_cached=time_switches(domelang.get_code,switches)
+    print("%d patterns  compile on switch %8.2f us  get_code %6.2f us" % (
+        NPATTERNS,t_compile*1e6,t_cached*1e6))
+
+if __name__ == '__main__':
+    main()
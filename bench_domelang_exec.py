@@ -0,0 +1,51 @@
+# Measure the time to run each of the programs in dometests.py, interpreting
+# the (function, data) pairs from Parser.parse one by one as Executor.run used
+# to, and running them compiled by compile_prog.
+
+import domelang
+import dometests
+import copy
+import time
+
+NRUNS=20000
+
+def run_interpreted(executor,stack,prog):
+    """
+    How Executor.run worked before programs were compiled, with prog indexed
+    rather than called.
+    """
+    executor.pc = 0
+    while executor.pc < len(prog):
+        f,a = prog[executor.pc]
+        if f:
+            f(stack,a,executor)
+        executor.pc += 1
+
+def time_runs(f,stacks):
+    t=time.perf_counter()
+    for stack in stacks:
+        f(stack)
+    return (time.perf_counter()-t)/len(stacks)
+
+def main():
+    executor=domelang.Executor()
+    total=0
+    total_compiled=0
+    for c,a,s,t in dometests.tests:
+        prog=dometests.parser.parse(c)
+        code=domelang.compile_prog(prog)
+        # the programs change lists on the stack in place, so each run gets
+        # its own copy
+        stacks=[copy.deepcopy(s) for i in range(NRUNS)]
+        t_interp=time_runs(lambda st: run_interpreted(executor,st,prog),stacks)
+        stacks=[copy.deepcopy(s) for i in range(NRUNS)]
+        t_compiled=time_runs(lambda st: executor.run(st,code),stacks)
+        total+=t_interp
+        total_compiled+=t_compiled
+        print("%-30s interpreted %6.3f us compiled %6.3f us" % (repr(c),
+            t_interp*1e6,t_compiled*1e6))
+    print("%-30s interpreted %6.3f us compiled %6.3f us" % ('total',
+        total*1e6,total_compiled*1e6))
+
+if __name__ == '__main__':
+    main()
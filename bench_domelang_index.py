@@ -0,0 +1,83 @@
+# Measure domelang index set ([) on deeply nested values, with the
+# kind of each value found by looking at its items only (_typeclass) and as
+# before, by measuring the depth of the whole value at every level.
+
+import domelang
+import copy
+import time
+
+NRUNS=20
+
+def _list_depth(l,d):
+    if type(l) == list:
+        return max(map(lambda m: _list_depth(m,d+1),l))
+    else:
+        return d
+
+def _typecode_depth(x):
+    if type(x) == int or type(x) == float:
+        return 'n'
+    if type(x) == list:
+        if _list_depth(x,0) > 1:
+            return 'L'
+        else:
+            return 'l'
+    return '?'
+
+def _vindex_set_depth(l,m,r):
+    """
+    How _vindex_set chose what to do before _typeclass.
+    """
+    tc=''.join(map(_typecode_depth,[l,m,r]))
+    return getattr(domelang._vindex_set_ftable,tc)(l,m,r)
+
+def wide(depth,width,leaf):
+    """
+    Nested lists width items wide and depth deep with leaf(i) at the bottom.
+    """
+    if depth == 1:
+        return [leaf(i) for i in range(width)]
+    return [wide(depth-1,width,leaf) for i in range(width)]
+
+def deep(depth,leaf):
+    """
+    A list of numbers nested in depth-1 lists of one item.
+    """
+    if depth == 1:
+        return [leaf(i) for i in range(4)]
+    return [deep(depth-1,leaf)]
+
+def structures():
+    return [
+        ('wide 4^6',[wide(6,4,lambda i: i),wide(6,2,lambda i: i),
+            wide(6,3,lambda i: -i)]),
+        ('deep 50',[deep(50,lambda i: i),deep(50,lambda i: i),
+            deep(50,lambda i: -i)]),
+        ('deep 150',[deep(150,lambda i: i),deep(150,lambda i: i),
+            deep(150,lambda i: -i)]),
+    ]
+
+def time_runs(executor,code,s):
+    stacks=[copy.deepcopy(s) for i in range(NRUNS)]
+    t=time.perf_counter()
+    for stack in stacks:
+        executor.run(stack,code)
+    return (time.perf_counter()-t)/NRUNS,stacks[0]
+
+def main():
+    parser=domelang.Parser()
+    executor=domelang.Executor()
+    vindex_set=domelang._vindex_set
+    for c in ['[']:
+        code=domelang.compile_prog(parser.parse(c))
+        for name,s in structures():
+            t,res=time_runs(executor,code,s)
+            domelang._vindex_set=_vindex_set_depth
+            t_depth,res_depth=time_runs(executor,code,s)
+            domelang._vindex_set=vindex_set
+            assert res == res_depth
+            print("%s %-9s items only %9.1f us whole depth %9.1f us" % (c,
+                name,t*1e6,t_depth*1e6))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+# Measure domelang parse throughput for generated programs of 1k to 100k
+# tokens, comparing Parser.parse with the previous way of parsing that tried
+# each pattern in turn and re-sliced the source after every token.
+
+import domelang
+import random
+import time
+
+NTOKENS=[1000,10000,100000]
+WORDS=['1.5','-2.25e3','42','-7','+','×','÷','-',']','[','(',')','?']
+
+def make_program(ntokens):
+    """
+    Returns a program of ntokens tokens, words separated by spaces which are
+    tokens too.
+    """
+    rng=random.Random(1)
+    return ' '.join(rng.choice(WORDS) for i in range((ntokens+1)//2))
+
+def parse_reslice(parser,cmds):
+    """
+    How Parser.parse worked before the patterns were combined.
+    """
+    state=domelang.ParserState()
+    prog=[]
+    while cmds:
+        matched=False
+        for n,p,a,f in parser.cmd_parsers:
+            m=p.match(cmds)
+            if m:
+                aux=None
+                if a:
+                    aux=a(m.group(0),state)
+                prog.append((f,aux))
+                state.prog_counter += 1
+                cmds=cmds[m.end(0):]
+                matched=True
+                break
+        if not matched:
+            break
+    return prog
+
+def time_parse(f,cmds):
+    t=time.perf_counter()
+    prog=f(cmds)
+    return time.perf_counter()-t,prog
+
+def main():
+    parser=domelang.Parser()
+    for ntokens in NTOKENS:
+        cmds=make_program(ntokens)
+        t,prog=time_parse(parser.parse,cmds)
+        t_old,prog_old=time_parse(lambda c: parse_reslice(parser,c),cmds)
+        assert [f for f,a in prog_old] == [f for f,a in prog]
+        print("%6d tokens  parse %8.2f ms %6.3f us/token"
+                "  reslice %8.2f ms %6.3f us/token" % (len(prog),t*1e3,
+                    t*1e6/len(prog),t_old*1e3,t_old*1e6/len(prog)))
+
+if __name__ == '__main__':
+    main()
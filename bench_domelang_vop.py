@@ -0,0 +1,44 @@
+# Measure domelang arithmetic on pitch and velocity vectors of hundreds of
+# notes, with the vectors as lists and as numpy arrays (see to_arrays).
+
+import domelang
+import copy
+import time
+
+NNOTES=[16,128,1024]
+NRUNS=2000
+
+def programs(n):
+    pitches=[60+(i*7)%24 for i in range(n)]
+    velocities=[float(40+(i*13)%80) for i in range(n)]
+    return [
+        # transpose
+        ('12 +',[pitches]),
+        # add a chord shape cycled over the notes
+        ('+',[pitches,[0,4,7]]),
+        # accent pattern
+        ('×',[velocities,[1.0,0.5,0.75,0.5]]),
+        ('0.5 × 10 + 127 ÷',[velocities]),
+    ]
+
+def time_runs(executor,code,stacks):
+    t=time.perf_counter()
+    for stack in stacks:
+        executor.run(stack,code)
+    return (time.perf_counter()-t)/len(stacks)
+
+def main():
+    parser=domelang.Parser()
+    executor=domelang.Executor()
+    for n in NNOTES:
+        for c,s in programs(n):
+            code=domelang.compile_prog(parser.parse(c))
+            stacks=[copy.deepcopy(s) for i in range(NRUNS)]
+            t_list=time_runs(executor,code,stacks)
+            stacks=[[domelang.to_arrays(v) for v in s] for i in range(NRUNS)]
+            t_array=time_runs(executor,code,stacks)
+            print("%5d notes %-18s lists %8.2f us arrays %6.2f us" % (n,
+                repr(c),t_list*1e6,t_array*1e6))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+# Measure the ornament of test_midi_dome.py on batches of notes, run by the
+# Python callback once per event and by the domelang programs once per batch.
+
+import midi_dome
+import midi_proc_jack
+import test_midi_dome
+import time
+
+NEVENTS=[16,128,1024]
+NRUNS=200
+
+def run_python(b):
+    mevs=[]
+    for mev in midi_proc_jack.events_from_bytes(bytearray(b)):
+        mevs+=test_midi_dome.ornament(mev)
+    return midi_proc_jack.events_to_bytes(mevs)
+
+def main():
+    cb=midi_dome.DomeCallback(**test_midi_dome.dome_ornament)
+    run_dome=lambda b: cb(midi_proc_jack.EventBatch.from_bytes(b)).to_bytes()
+    for n in NEVENTS:
+        b=bytes(midi_proc_jack.events_to_bytes(test_midi_dome.make_events(n)))
+        ts=[]
+        for f in [run_python,run_dome]:
+            t=time.perf_counter()
+            for i in range(NRUNS):
+                f(b)
+            ts.append((time.perf_counter()-t)/NRUNS)
+        print("%5d events  python %8.1f us  domelang %8.1f us" % (n,
+            ts[0]*1e6,ts[1]*1e6))
+
+if __name__ == '__main__':
+    main()
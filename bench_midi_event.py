@@ -0,0 +1,40 @@
+# Measure the memory used per MIDIEvent and the time taken to construct
+# MIDIEvents, both directly and by decoding a batch of midimsgs as received
+# from the message queue.
+
+import midi_proc_jack
+import timeit
+import tracemalloc
+
+NEVENTS=10000
+
+def make_batch(n):
+    return bytes(midi_proc_jack.events_to_bytes([
+        midi_proc_jack.MIDIEvent(i,'NoteOn',i%16,bytes([0,i%128,100]))
+        for i in range(n)]))
+
+def mem_per_event(f):
+    """
+    f: function returning a list of NEVENTS MIDIEvents
+    Returns the bytes allocated per event that are still held by the list.
+    """
+    tracemalloc.start()
+    before=tracemalloc.get_traced_memory()[0]
+    mevs=f()
+    after=tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(mevs) == NEVENTS
+    return (after-before)/NEVENTS
+
+def main():
+    batch=make_batch(NEVENTS)
+    init=lambda: [midi_proc_jack.MIDIEvent(i,'NoteOn',0,b'\x00\x3c\x64')
+            for i in range(NEVENTS)]
+    decode=lambda: midi_proc_jack.events_from_bytes(batch)
+    for name,f in [('__init__',init),('events_from_bytes',decode)]:
+        t=min(timeit.repeat(f,number=10,repeat=5))/(10*NEVENTS)
+        print("%-18s %8.1f bytes/event %8.3f us/event" %
+                (name,mem_per_event(f),t*1e6))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+# Measure batches of events on 16 channels, several of which have a slow
+# callback, processed in this process and by WorkerPools of a few sizes.
+
+import midi_pool
+import midi_proc_jack
+import random
+import time
+
+NEVENTS=256
+NRUNS=20
+# channels with a slow callback and the CPU time it takes for each event
+SLOW_CHANS=[0,1,2,3]
+SLOW_S=100e-6
+NWORKERS=[2,4,8]
+
+def slow(mev):
+    t=time.perf_counter()+SLOW_S
+    while time.perf_counter() < t:
+        pass
+    return [mev]
+
+def setup(i):
+    midi_proc_jack.set_midi_cb(SLOW_CHANS,None,slow)
+
+def make_batch():
+    rng=random.Random(1)
+    return bytes(midi_proc_jack.events_to_bytes([midi_proc_jack.MIDIEvent(i,
+        'NoteOn',rng.randint(0,15),bytes([0,60,100]))
+        for i in range(NEVENTS)]))
+
+def run(f,b):
+    t=time.perf_counter()
+    for i in range(NRUNS):
+        f(b)
+    return (time.perf_counter()-t)/NRUNS
+
+def main():
+    b=make_batch()
+    setup(0)
+    print("%d events, callback of %g us on %d channels" % (NEVENTS,
+        SLOW_S*1e6,len(SLOW_CHANS)))
+    print("in process  %8.1f us" % (run(lambda b:
+        midi_proc_jack._cbs_proc_bytes(b),b)*1e6,))
+    midi_proc_jack.reset_midi_cb(None,None)
+    for n in NWORKERS:
+        with midi_pool.WorkerPool(n,setup) as pool:
+            print("%d workers   %8.1f us" % (n,run(pool.process,b)*1e6))
+
+if __name__ == '__main__':
+    main()
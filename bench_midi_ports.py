@@ -0,0 +1,80 @@
+# Measure how long events on 16 channels with a slow callback take to come back
+# when all handled by one MIDIProcThread process and when spread by channel over
+# the ports of PortProcesses, standing in for midi_proc_jack -n on keys of its
+# own.
+
+import midi_ports
+import midi_proc_jack
+import random
+import sysv_ipc as ipc
+import threading
+import time
+
+# out of the way of the keys of midi_proc_jack
+KEY_C_TO_PY=3124
+KEY_PY_TO_C=3123
+NEVENTS=2048
+NRUNS=5
+# CPU time the callback takes for each event
+SLOW_S=100e-6
+NPORTS=[1,2,4]
+
+def slow(mev):
+    t=time.perf_counter()+SLOW_S
+    while time.perf_counter() < t:
+        pass
+    return [mev]
+
+def setup(port):
+    midi_proc_jack.set_midi_cb(None,None,slow)
+
+def make_events():
+    rng=random.Random(1)
+    return [midi_proc_jack.MIDIEvent(i,'NoteOn',rng.randint(0,15),
+        bytes([0,60,100])) for i in range(NEVENTS)]
+
+def queues(port):
+    return [ipc.MessageQueue(midi_proc_jack.port_key(key,port),ipc.IPC_CREAT,
+        max_message_size=midi_proc_jack.MSGQ_MAX_MESSAGE_SIZE)
+        for key in [KEY_C_TO_PY,KEY_PY_TO_C]]
+
+def send(qs,msgs):
+    for (q_to_py,q_to_c),ms in zip(qs,msgs):
+        for m in ms:
+            q_to_py.send(m,type=midi_proc_jack.MSGTYPE)
+
+def run(nports,mevs):
+    qs=[queues(port) for port in range(nports)]
+    # the messages sent to each port, split by channel
+    msgs=[[] for port in range(nports)]
+    for port in range(nports):
+        evs=[m for m in mevs if m.chan%nports == port]
+        for off in range(0,len(evs),midi_proc_jack.MSGQ_BATCH_NMSGS):
+            msgs[port].append(bytes(midi_proc_jack.events_to_bytes(
+                evs[off:off+midi_proc_jack.MSGQ_BATCH_NMSGS])))
+    with midi_ports.PortProcesses(nports,setup,key_in=KEY_C_TO_PY,
+            key_out=KEY_PY_TO_C,batch=True):
+        t=time.perf_counter()
+        for i in range(NRUNS):
+            # sent from another thread as the queues only hold a few messages
+            # and the ports block sending back until they are read
+            th=threading.Thread(target=send,args=(qs,msgs))
+            th.start()
+            n=0
+            while n < NEVENTS:
+                for q_to_py,q_to_c in qs:
+                    while q_to_c.current_messages > 0:
+                        n+=len(q_to_c.receive(type=midi_proc_jack.MSGTYPE)[0]
+                                )//midi_proc_jack.midimsg_struct.size
+                time.sleep(0.0001)
+            th.join()
+        return (time.perf_counter()-t)/NRUNS
+
+def main():
+    mevs=make_events()
+    print("%d events, callback of %g us" % (NEVENTS,SLOW_S*1e6))
+    for nports in NPORTS:
+        print("%d ports   %8.1f ms" % (nports,run(nports,mevs)*1e3))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+# Measure with tracemalloc the memory allocated for each event sent by
+# MIDIProcThread, packing the events into its preallocated buffers and packing
+# them into new bytearrays as before. The ornament of run_midi_proc_jack.py is
+# the callback, so each event received gives six to send.
+#
+# Measured one event at a time, preallocated packing still shows the ints
+# Python makes for offsets into the buffers above 256 and for the float times
+# of the ornament, each freed right after it is used.
+
+import midi_proc_jack
+import test_midi_dome
+import time
+import tracemalloc
+
+KEY_IN=0x6d74
+KEY_OUT=0x6d75
+NEVENTS=[1,16,128,1024]
+NRUNS=200
+
+def to_bytes_alloc(m):
+    """
+    How MIDIEvent.to_bytes worked before pack_into.
+    """
+    ret=bytearray(midi_proc_jack.BUFLEN+midi_proc_jack.tail_struct.size)
+    ret[:m.size]=m.buf[m.off:m.off+m.size]
+    ret[-midi_proc_jack.tail_struct.size:]=midi_proc_jack.tail_struct.pack(
+            m.size,int(m.tme_mon))
+    return ret
+
+def events_to_bytes_alloc(mevs):
+    """
+    How events_to_bytes worked before events_pack_into.
+    """
+    ret=bytearray(len(mevs)*midi_proc_jack.midimsg_struct.size)
+    off=0
+    for m in mevs:
+        ret[off:off+m.size]=m.buf[m.off:m.off+m.size]
+        midi_proc_jack.tail_struct.pack_into(ret,off+midi_proc_jack.BUFLEN,
+                m.size,int(m.tme_mon))
+        off+=midi_proc_jack.midimsg_struct.size
+    return ret
+
+def pack_msgs_alloc(th,mevs):
+    # what _proc_msg sent for each event
+    for m in mevs:
+        to_bytes_alloc(m)
+
+def pack_msgs(th,mevs):
+    for m in mevs:
+        m.pack_into(th.out_msg,0)
+
+def loop_only(th,mevs):
+    # what the loops over the events allocate themselves
+    for m in mevs:
+        pass
+
+def pack_batch_alloc(th,mevs):
+    # _proc_bytes appended the bytes from the batch callbacks
+    return events_to_bytes_alloc(mevs)+b''
+
+def pack_batch(th,mevs):
+    n=len(mevs)*midi_proc_jack.midimsg_struct.size
+    if n > len(th.out_buf):
+        th.out_buf=bytearray(2*n)
+    midi_proc_jack.events_pack_into(mevs,th.out_buf,0)
+    return memoryview(th.out_buf)[:n]
+
+def warm_up(f,th,mevs_list):
+    # the interpreter allocates memory when it optimizes code that has run a
+    # few times, which would be counted by the first measurements
+    for i in range(100):
+        f(th,mevs_list[i%len(mevs_list)])
+
+def alloc_per_event(f,th,mevs):
+    """
+    Bytes allocated at most while f sends the events mevs, per event.
+    """
+    warm_up(f,th,[mevs])
+    # the events of a MIDIProcThread are processed then sent, so the peak
+    # only counts what sending allocates
+    cur=tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    f(th,mevs)
+    peak=tracemalloc.get_traced_memory()[1]
+    return (peak-cur)/len(mevs)
+
+def alloc_per_msg(f,th,mevs):
+    """
+    Bytes allocated at most while f sends each event on its own, averaged over
+    the events mevs. Memory freed after each event doesn't lower the peak of
+    a whole run, so the peak is measured for each event.
+    """
+    total=0
+    single=[[m] for m in mevs]
+    warm_up(f,th,single)
+    for s in single:
+        cur=tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        f(th,s)
+        total+=tracemalloc.get_traced_memory()[1]-cur
+    return total/len(mevs)
+
+def time_per_event(f,th,mevs):
+    t=time.perf_counter()
+    for i in range(NRUNS):
+        f(th,mevs)
+    return (time.perf_counter()-t)/(NRUNS*len(mevs))
+
+def main():
+    th=midi_proc_jack.MIDIProcThread(KEY_IN,KEY_OUT)
+    try:
+        for n in NEVENTS:
+            mevs=[]
+            for mev in test_midi_dome.make_events(n):
+                mevs+=test_midi_dome.ornament(mev)
+            for name,f_alloc,f,measure in [
+                    ('per message',pack_msgs_alloc,pack_msgs,alloc_per_msg),
+                    ('batch',pack_batch_alloc,pack_batch,alloc_per_event)]:
+                t_alloc=time_per_event(f_alloc,th,mevs)
+                t=time_per_event(f,th,mevs)
+                tracemalloc.start()
+                base=measure(loop_only,th,mevs)
+                a_alloc=measure(f_alloc,th,mevs)-base
+                a=measure(f,th,mevs)-base
+                tracemalloc.stop()
+                print("%5d events %-11s  new bytearrays %6.1f B/event %5.0f ns"
+                    "  preallocated %6.1f B/event %5.0f ns" % (len(mevs),name,
+                        a_alloc,t_alloc*1e9,a,t*1e9))
+    finally:
+        th.q_in.remove()
+        th.q_out.remove()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# Compare the receive latency of MIDIProcThread in polling and blocking mode.
+#
+# Events are sent to the thread's input queue with the send time (in ns) stored
+# in tme_mon. The default callback passes them through unchanged, so the time
+# from send to receipt on the output queue is the latency added by the thread.
+# Events are spaced out like playing on a keyboard, which is where the polling
+# loop adds its jitter. Also reports the CPU used while the thread is idle.
+
+import midi_proc_jack
+import sysv_ipc as ipc
+import contextlib
+import os
+import random
+import time
+
+KEY_IN=0x6d70
+KEY_OUT=0x6d71
+NEVENTS=2000
+IDLE_TIME=1.0
+
+def histogram(lat_us):
+    """
+    Print a histogram of latencies with buckets that double in size.
+    """
+    buckets={}
+    for l in lat_us:
+        b=1
+        while b < l:
+            b*=2
+        buckets[b]=buckets.get(b,0)+1
+    lo=0
+    for b in sorted(buckets.keys()):
+        n=buckets[b]
+        print("%6d - %6d us: %6d %s" % (lo,b,n,'#'*((60*n)//len(lat_us))))
+        lo=b
+
+def bench(block):
+    th=midi_proc_jack.MIDIProcThread(KEY_IN,KEY_OUT,block=block)
+    q_in=ipc.MessageQueue(KEY_IN,ipc.IPC_CREAT)
+    q_out=ipc.MessageQueue(KEY_OUT,ipc.IPC_CREAT)
+    th.start()
+    cpu_start=time.process_time()
+    time.sleep(IDLE_TIME)
+    idle_cpu=time.process_time()-cpu_start
+    lat_us=[]
+    rng=random.Random(1)
+    for i in range(NEVENTS):
+        mev=midi_proc_jack.MIDIEvent(time.perf_counter_ns(),'NoteOn',0,
+                bytes([0,60+(i%12),100]))
+        q_in.send(mev.to_bytes(),type=midi_proc_jack.MSGTYPE)
+        msg=q_out.receive(type=midi_proc_jack.MSGTYPE)[0]
+        mev=midi_proc_jack.MIDIEvent.from_bytes(msg)
+        lat_us.append((time.perf_counter_ns()-mev.tme_mon)/1000.)
+        time.sleep(rng.uniform(0,0.002))
+    th.stop()
+    th.join()
+    q_in.remove()
+    q_out.remove()
+    lat_us.sort()
+    return lat_us,idle_cpu
+
+def main():
+    results=[]
+    for block in [False,True]:
+        with open(os.devnull,'w') as devnull:
+            with contextlib.redirect_stdout(devnull):
+                results.append((block,bench(block)))
+    for block,(lat_us,idle_cpu) in results:
+        n=len(lat_us)
+        print("mode: %s" % ('block' if block else 'poll',))
+        print("idle cpu: %.1f%%" % (100*idle_cpu/IDLE_TIME,))
+        print("latency us: min %.1f median %.1f p99 %.1f max %.1f" %
+                (lat_us[0],lat_us[n//2],lat_us[(99*n)//100],lat_us[-1]))
+        histogram(lat_us)
+        print()
+
+if __name__ == '__main__':
+    main()
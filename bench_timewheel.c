@@ -0,0 +1,116 @@
+/* Compare scheduling events with the binary Heap and the timewheel as done by
+   midi_proc_jack: N events are scheduled at random times up to 10 seconds
+   ahead, then the events due are taken out period by period. Also checks that
+   both give the events in time order and that none are lost. */
+#include "heap.h"
+#include "timewheel.h"
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <time.h>
+
+#define PERIOD 1024
+#define HORIZON (48000*10)
+
+typedef struct {
+    timewheel_node node;
+    uint64_t tme_mon;
+} event;
+
+static int
+event_cmp(void *_a, void *_b)
+{
+    event *a = _a, *b = _b;
+    return a->tme_mon >= b->tme_mon;
+}
+
+static void
+set_idx_ignore(void *a, size_t idx)
+{
+    return;
+}
+
+static double
+now_ns(void)
+{
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC,&ts);
+    return ts.tv_sec*1e9 + ts.tv_nsec;
+}
+
+static void
+bench_heap(event *evs, size_t n)
+{
+    Heap *h = Heap_new(n,event_cmp,set_idx_ignore);
+    size_t i, nout = 0;
+    uint64_t last = 0, end;
+    double t, worst = 0, t_insert, t_total = 0;
+    t = now_ns();
+    for (i = 0; i < n; i++) { Heap_push(h,&evs[i]); }
+    t_insert = now_ns() - t;
+    for (end = PERIOD; nout < n; end += PERIOD) {
+        event *e;
+        t = now_ns();
+        while ((Heap_top(h,(void**)&e) == HEAP_ENONE) && (e->tme_mon < end)) {
+            Heap_pop(h,(void**)&e);
+            if (e->tme_mon < last) { fprintf(stderr,"heap: out of order\n"); }
+            last = e->tme_mon;
+            nout++;
+        }
+        t = now_ns() - t;
+        t_total += t;
+        if (t > worst) { worst = t; }
+    }
+    printf("heap      %7zu events: insert %6.1f ns/event, take %6.1f ns/event,"
+            " worst period %9.0f ns\n",n,t_insert/n,t_total/n,worst);
+    Heap_free(h);
+}
+
+static void
+bench_timewheel(event *evs, size_t n)
+{
+    timewheel_t *tw = timewheel_new(PERIOD,0);
+    size_t i, nout = 0;
+    uint64_t last = 0, end;
+    double t, worst = 0, t_insert, t_total = 0;
+    t = now_ns();
+    for (i = 0; i < n; i++) {
+        evs[i].node.time = evs[i].tme_mon;
+        timewheel_insert(tw,&evs[i].node);
+    }
+    t_insert = now_ns() - t;
+    for (end = PERIOD; nout < n; end += PERIOD) {
+        timewheel_node *node;
+        t = now_ns();
+        for (node = timewheel_advance(tw,end); node; node = node->next) {
+            event *e = (event*)node;
+            if (e->tme_mon < last) { fprintf(stderr,"timewheel: out of order\n"); }
+            if (e->tme_mon >= end) { fprintf(stderr,"timewheel: not due\n"); }
+            last = e->tme_mon;
+            nout++;
+        }
+        t = now_ns() - t;
+        t_total += t;
+        if (t > worst) { worst = t; }
+    }
+    if (timewheel_size(tw) != 0) { fprintf(stderr,"timewheel: events left\n"); }
+    printf("timewheel %7zu events: insert %6.1f ns/event, take %6.1f ns/event,"
+            " worst period %9.0f ns\n",n,t_insert/n,t_total/n,worst);
+    timewheel_free(tw);
+}
+
+int main (void)
+{
+    size_t sizes[] = {1000, 10000, 100000};
+    size_t i, j;
+    srand(1);
+    for (i = 0; i < sizeof(sizes)/sizeof(sizes[0]); i++) {
+        size_t n = sizes[i];
+        event *evs = calloc(n,sizeof(event));
+        for (j = 0; j < n; j++) { evs[j].tme_mon = rand() % HORIZON; }
+        bench_heap(evs,n);
+        bench_timewheel(evs,n);
+        free(evs);
+    }
+    return 0;
+}
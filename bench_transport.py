@@ -0,0 +1,97 @@
+# Compare the message queue and shared memory ring transports between
+# midi_proc_jack and MIDIProcThread for round-trip latency and throughput.
+#
+# A MIDIProcThread with the default callbacks runs in a child process, this
+# process takes the place of midi_proc_jack, sending events and receiving them
+# back through the transport under test.
+
+import midi_proc_jack
+import shmring
+import sysv_ipc as ipc
+import multiprocessing
+import time
+
+KEY_IN=0x6d74
+KEY_OUT=0x6d75
+NLATENCY=2000
+NTHROUGHPUT=100000
+# events sent at once in the throughput test, like a dense burst from JACK
+BURST=64
+
+class MsgqPeer:
+    def __init__(self):
+        self.q_out=ipc.MessageQueue(KEY_IN,ipc.IPC_CREAT,
+                max_message_size=midi_proc_jack.MSGQ_MAX_MESSAGE_SIZE)
+        self.q_in=ipc.MessageQueue(KEY_OUT,ipc.IPC_CREAT,
+                max_message_size=midi_proc_jack.MSGQ_MAX_MESSAGE_SIZE)
+    def send(self,b):
+        self.q_out.send(b,type=midi_proc_jack.MSGTYPE)
+    def receive(self):
+        return self.q_in.receive(type=midi_proc_jack.MSGTYPE)[0]
+    def remove(self):
+        self.q_out.remove()
+        self.q_in.remove()
+
+class ShmPeer:
+    def __init__(self):
+        self.ring_out=shmring.ShmRing(KEY_IN,midi_proc_jack.SHMRING_NMSGS,
+                midi_proc_jack.midimsg_struct.size)
+        self.ring_in=shmring.ShmRing(KEY_OUT,midi_proc_jack.SHMRING_NMSGS,
+                midi_proc_jack.midimsg_struct.size)
+    def send(self,b):
+        self.ring_out.write(b)
+        self.ring_out.notify()
+    def receive(self):
+        while True:
+            b=self.ring_in.read()
+            if b:
+                return b
+            self.ring_in.wait()
+    def remove(self):
+        self.ring_out.remove()
+        self.ring_in.remove()
+
+def proc_main(transport):
+    th=midi_proc_jack.MIDIProcThread(KEY_IN,KEY_OUT,batch=True,
+            transport=transport)
+    th.run()
+
+def bench(transport):
+    peer=MsgqPeer() if transport == 'msgq' else ShmPeer()
+    proc=multiprocessing.Process(target=proc_main,args=(transport,))
+    proc.start()
+    mev=midi_proc_jack.MIDIEvent(0,'NoteOn',0,bytes([0,60,100]))
+    lat_us=[]
+    for i in range(NLATENCY):
+        t=time.perf_counter_ns()
+        peer.send(mev.to_bytes())
+        peer.receive()
+        lat_us.append((time.perf_counter_ns()-t)/1000.)
+    lat_us.sort()
+    burst=midi_proc_jack.events_to_bytes([mev]*BURST)
+    nsent=0
+    nrecvd=0
+    t_start=time.perf_counter()
+    while nrecvd < NTHROUGHPUT:
+        # keep at most 4 bursts in flight so neither side overflows
+        if nsent-nrecvd < 4*BURST and nsent < NTHROUGHPUT:
+            peer.send(burst)
+            nsent+=BURST
+            continue
+        nrecvd+=len(peer.receive())//midi_proc_jack.midimsg_struct.size
+    evs_per_s=nrecvd/(time.perf_counter()-t_start)
+    proc.terminate()
+    proc.join()
+    peer.remove()
+    return lat_us,evs_per_s
+
+def main():
+    for transport in ['msgq','shm']:
+        lat_us,evs_per_s=bench(transport)
+        n=len(lat_us)
+        print("%-5s round trip us: median %6.1f p99 %6.1f max %7.1f"
+                "  throughput: %8.0f events/s" % (transport,lat_us[n//2],
+                    lat_us[(99*n)//100],lat_us[-1],evs_per_s))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+/* Keys of the events merged by midi_proc_jack -c */
+#include "coalesce.h"
+
+/* Whether ControlChange events of controller cc can be merged */
+static int
+coalesce_cc(unsigned char cc)
+{
+    switch (cc) {
+        /* bank select MSB and LSB, the program change following them
+           depends on both */
+        case 0: case 32:
+        /* data entry MSB and LSB, each applies to the parameter selected
+           when it is sent */
+        case 6: case 38:
+        /* data increment and decrement, NRPN and RPN selection */
+        case 96: case 97: case 98: case 99: case 100: case 101:
+            return 0;
+        default:
+            /* 120-127 are channel mode messages */
+            return cc < 120;
+    }
+}
+
+int
+coalesce_key(const unsigned char *buf, size_t size)
+{
+    if (size < 3) { return -1; }
+    switch (buf[0] & 0xf0) {
+        case 0xb0:
+            if (!coalesce_cc(buf[1] & 0x7f)) { return -1; }
+            return (buf[0] & 0x0f) * 128 + (buf[1] & 0x7f);
+        case 0xe0: return COALESCE_NCHANS * 128 + (buf[0] & 0x0f);
+        default: return -1;
+    }
+}
@@ -0,0 +1,20 @@
+#ifndef COALESCE_H
+#define COALESCE_H
+
+/* Keys of the ControlChange and PitchBend events midi_proc_jack -c merges in
+   each period, keeping only the last event with each key. */
+#include <stddef.h>
+
+/* A ControlChange key for each channel and controller, then a PitchBend key
+   for each channel */
+#define COALESCE_NCHANS 16
+#define COALESCE_NKEYS (COALESCE_NCHANS * 128 + COALESCE_NCHANS)
+
+/* Returns the coalescing key of the MIDI event in buf, -1 if it mustn't be
+   merged. Only controllers that hold a continuous value are merged: bank
+   select, RPN/NRPN selection and data entry, and channel mode messages are
+   steps of a sequence or commands, and keep their order like notes. */
+int
+coalesce_key(const unsigned char *buf, size_t size);
+
+#endif /* COALESCE_H */
@@ -1,9 +1,24 @@
 # bunk dank dome
 
+import os
 import re
+import threading
+from collections import OrderedDict
 from functools import reduce
 from itertools import cycle
 
+# Values can also be 1 dimensional numpy arrays of numbers if numpy is
+# installed, see to_arrays
+try:
+    import numpy as np
+    _ndarray=np.ndarray
+    _npnumber=np.number
+except ImportError:
+    np=None
+    class _ndarray:
+        pass
+    _npnumber=_ndarray
+
 # Mode when waiting for operation
 # for example, if we are in this mode and we encounter =, we expect a character
 # or a string. If either of those is encountered, we start a function definition
@@ -13,11 +28,33 @@ DOME_MODE_INTERPRET=3
 
 DEBUG=False
 
-def _list_depth(l,d):
-    if type(l) == list:
-        return max(map(lambda m: _list_depth(m,d+1),l))
-    else:
-        return d
+def _is_seq(x):
+    return type(x) == list or type(x) == _ndarray
+
+# Kinds of value, see _typeclass
+TYPE_NUMBER=0
+TYPE_LIST=1
+TYPE_NESTED=2
+TYPE_UNKNOWN=3
+
+def _typeclass(x):
+    """
+    TYPE_NUMBER if x is a number, TYPE_LIST if a list of depth 1, TYPE_NESTED
+    if a list of depth > 1, TYPE_UNKNOWN otherwise.
+    A list is nested as soon as one of its items is a list, so only the items
+    of x are looked at and never what is below them.
+    """
+    t=type(x)
+    if t == list:
+        for v in x:
+            if type(v) == list or type(v) == _ndarray:
+                return TYPE_NESTED
+        return TYPE_LIST
+    if t == _ndarray:
+        return TYPE_LIST
+    if t == int or t == float or isinstance(x,_npnumber):
+        return TYPE_NUMBER
+    return TYPE_UNKNOWN
 
 def _typecode(x):
     """
@@ -26,14 +63,7 @@ def _typecode(x):
     If list of depth > 1, output L,
     Otherwise output ? for unknown.
     """
-    if type(x) == int or type(x) == float:
-        return 'n'
-    if type(x) == list:
-        if _list_depth(x,0) > 1:
-            return 'L'
-        else:
-            return 'l'
-    return '?'
+    return 'nlL?'[_typeclass(x)]
 
 def _op_plus(x,y):
     return x+y
@@ -47,7 +77,7 @@ def _op_subtract(x,y):
 def _vop(x,y,op):
     if type(x) == list:
         lx = len(x)
-        if type(y) == list:
+        if _is_seq(y):
             ly = len(y)
             for i in range(lx):
                 x[i] = _vop(x[i],y[i%ly],op)
@@ -55,12 +85,53 @@ def _vop(x,y,op):
             for i in range(lx):
                 x[i] = _vop(x[i],y,op)
         return x
+    elif type(x) == _ndarray:
+        return _vop_array(x,y,op)
     else:
-        if type(y) == list:
+        if _is_seq(y):
             return op(x,y[0])
         else:
             return op(x,y)
 
+def _vop_array(x,y,op):
+    """
+    _vop for x a numpy array, with the same result as going through it item by
+    item but done by one numpy operation. Returns a new array.
+    """
+    if type(y) == list:
+        # each number in x meets the first number of its item in y
+        y=np.array([v[0] if _is_seq(v) else v for v in y])
+    if type(y) == _ndarray and len(y) != len(x):
+        # cycle y to the length of x (np.resize does this too but is a lot
+        # slower)
+        y=np.tile(y,-(-len(x)//len(y)))[:len(x)]
+    return op(x,y)
+
+def to_arrays(x):
+    """
+    Returns x with each list of numbers in it replaced by a numpy array, so
+    that arithmetic on them is done by numpy. Lists containing lists stay
+    lists, so values nested unevenly become lists of arrays.
+    """
+    if type(x) != list or len(x) == 0:
+        return x
+    if _typeclass(x) == TYPE_LIST:
+        return np.array(x)
+    return [to_arrays(v) for v in x]
+
+def from_arrays(x):
+    """
+    Returns x with the numpy arrays in it replaced by lists.
+    """
+    if type(x) == _ndarray:
+        return x.tolist()
+    if type(x) == list:
+        return [from_arrays(v) for v in x]
+    return x
+
+def _push_op(s,a,state=None):
+    s.append(a)
+
 def _bin_op(s,a,state=None):
     op=a
     x=s.pop()
@@ -73,27 +144,30 @@ def _vindex_get(lhs,rhs):
     Vectorized indexing, get method
     """
     ret=[]
-    ld_rhs=_list_depth(rhs,0)
-    if ld_rhs == 1:
+    tc_rhs=_typeclass(rhs)
+    if tc_rhs == TYPE_LIST:
+        if type(lhs) == _ndarray:
+            # all at once
+            return lhs[np.asarray(rhs)%len(lhs)]
         for r in rhs:
-            if type(lhs) != list:
+            if not _is_seq(lhs):
                 ret.append(lhs)
             else:
                 ret.append(lhs[r%len(lhs)])
-    elif ld_rhs == 0:
-        # rhs is not a list
-        r = rhs
-        if type(lhs) != list:
-            ret = lhs
-        else:
-            ret = lhs[r%len(lhs)]
-    else:
-        if type(lhs) != list:
+    elif tc_rhs == TYPE_NESTED:
+        if not _is_seq(lhs):
             for r in rhs:
                 ret.append(_vindex_get(lhs,r))
         else:
             for i,l in enumerate(lhs):
                 ret.append(_vindex_get(l,rhs[i%len(rhs)]))
+    else:
+        # rhs is not a list
+        r = rhs
+        if not _is_seq(lhs):
+            ret = lhs
+        else:
+            ret = lhs[r%len(lhs)]
     return ret
 
 def _vindex_get_op(s,a,state=None):
@@ -187,9 +261,21 @@ class _vindex_set_ftable:
             l[i%len(l)]=_vindex_set(a,b,c)
         return l
 
+def _vindex_set_unknown(l,m,r):
+    raise TypeError('cannot index set %s' % (''.join(map(_typecode,[l,m,r])),))
+
+# _vindex_set_ftable by the _typeclass of l, m and r: 16*l + 4*m + r
+_vindex_set_table=[_vindex_set_unknown]*64
+for _l,_tl in enumerate('nlL'):
+    for _m,_tm in enumerate('nlL'):
+        for _r,_tr in enumerate('nlL'):
+            _vindex_set_table[16*_l+4*_m+_r]=getattr(_vindex_set_ftable,
+                    _tl+_tm+_tr,_vindex_set_unknown)
+del _l,_tl,_m,_tm,_r,_tr
+
 def _vindex_set(l,m,r):
-    tc=''.join(map(_typecode,[l,m,r]))
-    return getattr(_vindex_set_ftable,tc)(l,m,r)
+    return _vindex_set_table[16*_typeclass(l)+4*_typeclass(m)
+            +_typeclass(r)](l,m,r)
 
 def _vindex_set_op(s,a,state=None):
     r=s.pop()
@@ -213,6 +299,9 @@ def _vappend_op(s,a,state=None):
         s.append([x])
         return
     y=s.pop()
+    if (type(y) == _ndarray) and not _is_seq(x):
+        s.append(np.append(y,x))
+        return
     if (type(y) != list):
         y=[y]
     s.append(_vappend(y,x))
@@ -223,7 +312,7 @@ def _vpop_op(s,a,state=None):
     and after that puts the item popped off.
     """
     x=s.pop()
-    if (type(x) != list):
+    if not _is_seq(x):
         s.append(x)
         return
     s.append(x[:-1])
@@ -250,6 +339,17 @@ def _endif_aux(x,state):
         return None
     return None #EndIf(state.ifs[-1])
 
+def _is_true(x):
+    """
+    A number is true if it isn't 0, a list if it isn't empty and all its items
+    are true.
+    """
+    if type(x) == list:
+        return len(x) > 0 and all(map(_is_true,x))
+    if type(x) == _ndarray:
+        return len(x) > 0 and bool(np.all(x != 0))
+    return x != 0
+
 def _if_op(s,a,t):
     # a is If object, t is program state
     x=s.pop()
@@ -279,13 +379,13 @@ cmd_parsers=[
             'FLOAT',
             '[-+]?\d+\.\d*([eE][-+]?\d+|)',
             lambda x,s: float(x),
-            lambda s,a,t: s.append(a)
+            _push_op
         ),
         (
             'INT',
             '[-+]?\d+',
             lambda x,s: int(x),
-            lambda s,a,t: s.append(a)
+            _push_op
         ),
         (
             'PLUS',
@@ -387,6 +487,9 @@ class ParserState:
         # the program counter can be considered as the current length of the
         # program
         self.prog_counter=0
+        # position in the source where parsing stopped if part of it didn't
+        # match any command
+        self.error=None
 
 class Parser:
     def __init__(self):
@@ -394,8 +497,18 @@ class Parser:
         self.cmd_parsers=[]
         for n,p,a,f in cmd_parsers:
             self.cmd_parsers.append((n,re.compile(p),a,f))
-        for t in cmd_parsers:
-            print(t)
+        # All the patterns combined into one, tried in the same order as
+        # cmd_parsers. Each pattern is wrapped in a group and the index of the
+        # group that matched (m.lastindex) looks up its command in
+        # self.cmd_by_group. Groups inside a pattern close before the one
+        # wrapping it so never end up as m.lastindex.
+        self.cmd_by_group=[None]
+        pats=[]
+        for n,p,a,f in cmd_parsers:
+            pats.append('(%s)' % (p,))
+            self.cmd_by_group.append((n,a,f))
+            self.cmd_by_group+=[None]*re.compile(p).groups
+        self.scanner=re.compile('|'.join(pats))
         # Eventually we will use this to pass information to operators
         # This is the state of the parser which affects how symbols are
         # converted into instructions and data
@@ -406,32 +519,113 @@ class Parser:
         Parse the commands in string cmds and return a list of instructions and
         data that can be executed by an executer.
         """
+        self.state=ParserState()
         prog=[]
-        while cmds:
-            matched=False
-            for n,p,a,f in self.cmd_parsers:
-                m=p.match(cmds)
-                if m:
-                    aux=None
-                    if a:
-                        # self.state is parser state
-                        aux=a(m.group(0),self.state)
-                    if (DEBUG):
-                        print('command: %s' % (n,))
-                        print('stack: ',end='')
-                        print(stack)
-                    prog.append((f,aux))
-                    self.state.prog_counter += 1
-                    if (DEBUG and not f):
-                        print("Warning, no function")
-                    cmds=cmds[m.end(0):]
-                    matched=True
-                    break
-            if not matched:
-                print("Error: no match for %s" % (cmds,))
+        match=self.scanner.match
+        cmd_by_group=self.cmd_by_group
+        state=self.state
+        pos=0
+        end=len(cmds)
+        while pos < end:
+            m=match(cmds,pos)
+            if not m:
+                print("Error: no match at column %d: %s" % (pos+1,cmds[pos:]))
+                state.error=pos
                 break
+            n,a,f=cmd_by_group[m.lastindex]
+            aux=None
+            if a:
+                # state is parser state
+                aux=a(m.group(),state)
+            if (DEBUG):
+                print('command: %s' % (n,))
+            prog.append((f,aux))
+            state.prog_counter += 1
+            if (DEBUG and not f):
+                print("Warning, no function")
+            pos=m.end()
         return prog
 
+# Instructions of compiled programs, see compile_prog
+OP_PUSH=0
+OP_BINOP=1
+# OP_PUSH followed by OP_BINOP
+OP_PUSH_BINOP=2
+OP_CALL=3
+OP_JUMP_IF_FALSE=4
+
+class Code:
+    """
+    A program compiled by compile_prog. ops is a list of (opcode, data) pairs.
+    """
+    __slots__=('ops',)
+    def __init__(self,ops):
+        self.ops=ops
+
+def _fuse_push_binop(ops):
+    """
+    Replace each OP_PUSH followed by OP_BINOP with one OP_PUSH_BINOP, unless
+    something jumps to the OP_BINOP. Jump targets are updated.
+    """
+    targets=set(a for op,a in ops if op == OP_JUMP_IF_FALSE)
+    fused=[]
+    # index in fused of each instruction in ops
+    new_pc=[]
+    i=0
+    while i < len(ops):
+        op,a=ops[i]
+        new_pc.append(len(fused))
+        if ((op == OP_PUSH) and (i+1 < len(ops)) and (ops[i+1][0] == OP_BINOP)
+                and ((i+1) not in targets)):
+            new_pc.append(len(fused))
+            fused.append((OP_PUSH_BINOP,(a,ops[i+1][1])))
+            i+=2
+            continue
+        fused.append((op,a))
+        i+=1
+    new_pc.append(len(fused))
+    return [(op,new_pc[a]) if op == OP_JUMP_IF_FALSE else (op,a)
+            for op,a in fused]
+
+def compile_prog(prog):
+    """
+    Compile prog, a list of (function, data) pairs from Parser.parse, into a
+    Code that Executor.run can run without calling the function of each
+    instruction. Instructions without a function are left out, If statements
+    become jumps to where the program continues when the condition is false
+    and a number followed by a binary operation becomes one instruction.
+    """
+    ops=[]
+    # index in ops of the first instruction at or after each one in prog
+    new_pc=[]
+    for f,a in prog:
+        new_pc.append(len(ops))
+        if not f:
+            continue
+        if f == _push_op:
+            ops.append((OP_PUSH,a))
+        elif f == _bin_op:
+            ops.append((OP_BINOP,a))
+        elif f == _if_op:
+            # resolved below once the whole program is known
+            ops.append((OP_JUMP_IF_FALSE,a))
+        else:
+            ops.append((OP_CALL,(f,a)))
+    new_pc.append(len(ops))
+    for i,(op,a) in enumerate(ops):
+        if op != OP_JUMP_IF_FALSE:
+            continue
+        # continue after the else or endif, or if there is none, the if
+        # statement lasts until the end of the program
+        if a.else_pc_pos is not None:
+            target=new_pc[a.else_pc_pos+1]
+        elif a.endif_pc_pos is not None:
+            target=new_pc[a.endif_pc_pos+1]
+        else:
+            target=len(ops)
+        ops[i]=(OP_JUMP_IF_FALSE,target)
+    return Code(_fuse_push_binop(ops))
+
 class Executor:
 
     def __init__(self):
@@ -442,12 +636,164 @@ class Executor:
 
     def run(self,stack,prog):
         """
-        Run a program prog, which is a list of (function, data) pairs. These
-        instructions affect the stack.
+        Run a program prog, which is a Code from compile_prog or a list of
+        (function, data) pairs, which is compiled first. These instructions
+        affect the stack.
         """
-        self.pc = 0
-        while self.pc < len(prog):
-            f,a = prog(self.pc)
-            if f:
-                f(stack,a,self)
-            self.pc += 1
+        if type(prog) != Code:
+            prog=compile_prog(prog)
+        ops=prog.ops
+        n=len(ops)
+        pc=0
+        # most frequent instructions first, the opcodes are written as numbers
+        # as looking up the OP_ globals on every instruction is noticeably
+        # slower
+        while pc < n:
+            op,a=ops[pc]
+            pc+=1
+            if op == 2:
+                # OP_PUSH_BINOP
+                c,f=a
+                y=stack[-1]
+                if type(y) == list:
+                    stack[-1]=_vop(y,c,f)
+                else:
+                    stack[-1]=f(y,c)
+            elif op == 0:
+                # OP_PUSH
+                stack.append(a)
+            elif op == 1:
+                # OP_BINOP
+                x=stack.pop()
+                stack[-1]=_vop(stack[-1],x,a)
+            elif op == 3:
+                # OP_CALL
+                a[0](stack,a[1],self)
+            elif op == 4:
+                # OP_JUMP_IF_FALSE
+                if not _is_true(stack.pop()):
+                    pc=a
+        self.pc=pc
+
+# Maximum number of programs kept compiled by get_code
+CODE_CACHE_SIZE=64
+# Compiled programs by their source, the least recently used first
+_code_cache=OrderedDict()
+_code_cache_lock=threading.Lock()
+# Parser used by compile_source in each thread, as parsing changes its state
+_parsers=threading.local()
+
+def compile_source(src):
+    """
+    Parse the program in string src and compile it with compile_prog. Raises
+    ValueError if part of src doesn't parse.
+    """
+    parser=getattr(_parsers,'parser',None)
+    if parser is None:
+        parser=_parsers.parser=Parser()
+    prog=parser.parse(src)
+    pos=parser.state.error
+    if pos is not None:
+        raise ValueError('no match at column %d: %s' % (pos+1,src[pos:]))
+    return compile_prog(prog)
+
+def _trim_code_cache():
+    while len(_code_cache) > CODE_CACHE_SIZE:
+        _code_cache.popitem(last=False)
+
+def get_code(src):
+    """
+    The program in string src compiled by compile_source, which is only called
+    if it is not among the last CODE_CACHE_SIZE programs asked for. Can be
+    called from any thread.
+    """
+    with _code_cache_lock:
+        code=_code_cache.get(src)
+        if code is not None:
+            _code_cache.move_to_end(src)
+            return code
+    # compiled without holding the lock so other threads can get cached
+    # programs meanwhile
+    code=compile_source(src)
+    with _code_cache_lock:
+        _code_cache[src]=code
+        _code_cache.move_to_end(src)
+        _trim_code_cache()
+    return code
+
+def set_code_cache_size(n):
+    """
+    Keep at most n programs in the cache of get_code, dropping the least
+    recently used ones now if there are more.
+    """
+    global CODE_CACHE_SIZE
+    with _code_cache_lock:
+        CODE_CACHE_SIZE=n
+        _trim_code_cache()
+
+def clear_code_cache():
+    with _code_cache_lock:
+        _code_cache.clear()
+
+class PatternFile:
+    """
+    A program read from the file at path, which can be compiled again when the
+    file changes by calling reload or by watch. The program is swapped by
+    assigning code, so a thread running the pattern (see run) while it is
+    reloaded runs either the whole old program or the whole new one and never
+    waits for the compilation.
+    """
+    def __init__(self,path):
+        self.path=path
+        self.mtime=os.stat(path).st_mtime_ns
+        self.code=get_code(self._read())
+        self._stop=None
+
+    def _read(self):
+        with open(self.path) as f:
+            return f.read()
+
+    def reload(self):
+        """
+        Compile the file again if it changed since it was last read. Returns
+        True if the program was replaced. If the file can't be read or doesn't
+        parse the old program is kept.
+        """
+        try:
+            mtime=os.stat(self.path).st_mtime_ns
+            if mtime == self.mtime:
+                return False
+            src=self._read()
+        except OSError as e:
+            print("Error: can't reload %s: %s" % (self.path,e))
+            return False
+        self.mtime=mtime
+        try:
+            code=get_code(src)
+        except ValueError as e:
+            print("Error: not reloading %s: %s" % (self.path,e))
+            return False
+        self.code=code
+        return True
+
+    def run(self,stack,executor):
+        executor.run(stack,self.code)
+
+    def watch(self,interval=0.5):
+        """
+        Check whether the file changed every interval seconds in a thread of
+        its own until stop is called.
+        """
+        if self._stop is not None:
+            return
+        self._stop=threading.Event()
+        stop=self._stop
+        def watcher():
+            while not stop.wait(interval):
+                self.reload()
+        threading.Thread(target=watcher,daemon=True).start()
+
+    def stop(self):
+        if self._stop is not None:
+            self._stop.set()
+            self._stop=None
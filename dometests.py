@@ -1,4 +1,7 @@
 import domelang
+import copy
+import os
+import tempfile
 
 eps=1.0e-6
 
@@ -187,9 +190,149 @@ tests = [
         ),
 ]
 
-for c,a,s,t in tests:
-    prog = parser.parse(c)
-    executor = domelang.Executor()
-    executor.run(s,prog)
-    t(s[-1],a)
-    print(s[-1])
+def run_tests(to_value):
+    """
+    Run the tests with each value on the initial stacks passed through
+    to_value first.
+    """
+    for c,a,s,t in tests:
+        s = [to_value(v) for v in copy.deepcopy(s)]
+        prog = parser.parse(c)
+        executor = domelang.Executor()
+        executor.run(s,prog)
+        t(domelang.from_arrays(s[-1]),a)
+        print(s[-1])
+
+def run_uncompiled(stack,prog):
+    """
+    Run prog, a list of (function, data) pairs, by calling the function of
+    each instruction like Executor.run did before programs were compiled.
+    """
+    t=domelang.Executor()
+    while t.pc < len(prog):
+        f,a=prog[t.pc]
+        if f:
+            f(stack,a,t)
+        if t.pc is None:
+            # an if statement without else or endif lasts until the end
+            break
+        t.pc+=1
+
+def make_if(prog,else_pc_pos=None,endif_pc_pos=None):
+    newif=domelang.If(len(prog))
+    newif.else_pc_pos=else_pc_pos
+    newif.endif_pc_pos=endif_pc_pos
+    prog.append((domelang._if_op,newif))
+
+def push(x):
+    return (domelang._push_op,x)
+
+def binop(f):
+    return (domelang._bin_op,f)
+
+# no function, like the else and endif markers
+MARK=(None,None)
+
+def branch_progs(c):
+    """
+    Programs with condition c, with the stacks they start from, whose if
+    statements jump to a number followed by a binary operation, which
+    compile_prog fuses, or to the operation of such a pair, which it must not.
+    """
+    progs=[]
+    # continues after the endif at the fused 3 *
+    p=[push(5),push(c)]
+    make_if(p,endif_pc_pos=5)
+    p+=[push(2),binop(domelang._op_plus),MARK,push(3),
+            binop(domelang._op_times)]
+    progs.append(([],p))
+    # continues after the else at the fused 10 *
+    p=[push(c)]
+    make_if(p,else_pc_pos=4,endif_pc_pos=7)
+    p+=[push(2),binop(domelang._op_plus),MARK,push(10),
+            binop(domelang._op_times),MARK,push(1),
+            binop(domelang._op_subtract)]
+    progs.append(([[5,6]],p))
+    # continues at the +, so 2 + isn't fused
+    p=[push(5),push(4),push(c)]
+    make_if(p,endif_pc_pos=4)
+    p+=[push(2),MARK,binop(domelang._op_plus)]
+    progs.append(([],p))
+    return progs
+
+def test_compiled_branches():
+    for c in [1,0]:
+        for s,prog in branch_progs(c):
+            observed=copy.deepcopy(s)
+            domelang.Executor().run(observed,prog)
+            desired=copy.deepcopy(s)
+            run_uncompiled(desired,prog)
+            test_result_exact(observed,desired)
+    # the if statement lasts until the end, after the fused 2 + and 3 *
+    for c,desired in [(1,[21]),(0,[5])]:
+        s=[]
+        domelang.Executor().run(s,parser.parse('5 %d ? 2 + 3 ×' % (c,)))
+        test_result_exact(s,desired)
+        s=[]
+        run_uncompiled(s,parser.parse('5 %d ? 2 + 3 ×' % (c,)))
+        test_result_exact(s,desired)
+    # a list condition is true if all its items are
+    for c,desired in [([1,2],[[21,24]]),([1,0],[[5,6]])]:
+        s=[[5,6],c]
+        domelang.Executor().run(s,parser.parse('? 2 + 3 ×'))
+        test_result_exact(s,desired)
+
+def test_code_cache():
+    domelang.clear_code_cache()
+    size=domelang.CODE_CACHE_SIZE
+    domelang.set_code_cache_size(2)
+    try:
+        a=domelang.get_code('1 2 +')
+        test_result_exact(domelang.get_code('1 2 +') is a,True)
+        domelang.get_code('3 4 +')
+        # '1 2 +' was used more recently than '3 4 +' so this drops '3 4 +'
+        domelang.get_code('1 2 +')
+        domelang.get_code('5 6 +')
+        test_result_exact(list(domelang._code_cache.keys()),['1 2 +','5 6 +'])
+        try:
+            domelang.get_code('1 2 @')
+            test_result_exact('no error','ValueError')
+        except ValueError:
+            test_result_exact(len(domelang._code_cache),2)
+    finally:
+        domelang.set_code_cache_size(size)
+
+def test_pattern_file():
+    with tempfile.TemporaryDirectory() as d:
+        path=os.path.join(d,'pattern')
+        with open(path,'w') as f:
+            f.write('1 +')
+        pat=domelang.PatternFile(path)
+        executor=domelang.Executor()
+        s=[[1,2]]
+        pat.run(s,executor)
+        test_result_exact(s[-1],[2,3])
+        test_result_exact(pat.reload(),False)
+        with open(path,'w') as f:
+            f.write('10 +')
+        # so the change is seen even if the clock is coarse
+        os.utime(path,ns=(0,pat.mtime+1))
+        test_result_exact(pat.reload(),True)
+        pat.run(s,executor)
+        test_result_exact(s[-1],[12,13])
+        # a program that doesn't parse leaves the old one in place
+        with open(path,'w') as f:
+            f.write('10 @')
+        os.utime(path,ns=(0,pat.mtime+1))
+        test_result_exact(pat.reload(),False)
+        pat.run(s,executor)
+        test_result_exact(s[-1],[22,23])
+
+if __name__ == '__main__':
+    run_tests(lambda v: v)
+    if domelang.np is not None:
+        # the same with the lists of numbers as numpy arrays
+        run_tests(domelang.to_arrays)
+    test_compiled_branches()
+    test_code_cache()
+    test_pattern_file()
@@ -5,12 +5,27 @@
 #include <stdio.h>
 #include <string.h>
 
+/* A free object, the free objects are linked through their own memory */
+typedef struct fastcache_obj {
+    struct fastcache_obj *next;
+} fastcache_obj;
+
+/* Start of each block of memory holding objects, so they can be freed */
+typedef struct fastcache_chunk {
+    struct fastcache_chunk *next;
+} fastcache_chunk;
+
 struct fastcache_t {
-    uint32_t cache_nblocks;
-    /* Mask indicating which items are available. There are up to cache_size items. */
-    uint32_t *cache_mask;
-    /* Address of beginning of cache */
-    char *cache_begin;
+    /* Free objects, only touched by the thread allocating and freeing */
+    fastcache_obj *free_list;
+    /* Objects added by fastcache_grow that the allocating thread has not
+       taken yet */
+    fastcache_obj *pending;
+    fastcache_chunk *chunks;
+    /* Total number of objects */
+    size_t nobjs;
+    /* Number of objects currently allocated */
+    size_t nallocated;
     /* Size of 1 item of cache as power of 2 */
     size_t cache_item_size;
 };
@@ -18,73 +33,123 @@ struct fastcache_t {
 void
 fastcache_fprint(fastcache_t *fc, FILE *f)
 {
-    fprintf(f,
-            "nblocks: %u\n", fc->cache_nblocks);
-    fprintf(f,
-            "mask: ");
-    int i;
-    for (i = 0; i < fc->cache_nblocks; i++) { 
-        fprintf(f,"%#x ",fc->cache_mask[i]); 
-    }
-    fprintf(f,"\n");
-    fprintf(f,"beg: %p\n",fc->cache_begin);
+    fprintf(f,"nobjs: %zu\n",fc->nobjs);
+    fprintf(f,"nallocated: %zu\n",fc->nallocated);
+    fprintf(f,"free_list: %p\n",(void*)fc->free_list);
+    fprintf(f,"pending: %p\n",(void*)fc->pending);
     fprintf(f,"itemsize: %zu\n",fc->cache_item_size);
 }
 
 void *
 fastcache_alloc(fastcache_t *fc)
 {
-    uint32_t cache_idx = 0;
-    uint32_t cache_block = 0;
-    uint32_t *cbptr = fc->cache_mask;
-    while ((cache_block < fc->cache_nblocks) && ((1 << cache_idx) & *cbptr) == 0) {
-        cache_idx = (cache_idx + 1) & 0x1f;
-        if (cache_idx == 0) {
-            cache_block++;
-            cbptr++;
+    fastcache_obj *obj = fc->free_list;
+    if (!obj) {
+        /* take all the objects added by fastcache_grow since last time */
+        obj = __atomic_exchange_n(&fc->pending,NULL,__ATOMIC_ACQUIRE);
+        if (!obj) {
+            return NULL;
         }
     }
-    /*
-    fastcache_fprint(fc,stderr);
-    fprintf(stderr,"cache_block: %u\n",cache_block);
-    */
-    if (cache_block >= fc->cache_nblocks) {
-        return NULL;
-    }
-    *cbptr &= ~(1 << cache_idx);
-    return (void*)(fc->cache_begin +
-        ((cache_idx + (cache_block << 5)) << fc->cache_item_size));
+    fc->free_list = obj->next;
+    __atomic_store_n(&fc->nallocated,fc->nallocated + 1,__ATOMIC_RELAXED);
+    return (void*)obj;
 }
 
 void
 fastcache_free(fastcache_t *fc, void *ptr)
 {
-    uint32_t obj_idx = (((char*)ptr - fc->cache_begin) >> fc->cache_item_size);
-    uint32_t cache_idx = obj_idx & 0x1f;
-    uint32_t cache_block = obj_idx >> 5; 
-    fc->cache_mask[cache_block] |= (1 << cache_idx);
+    fastcache_obj *obj = ptr;
+    obj->next = fc->free_list;
+    fc->free_list = obj;
+    __atomic_store_n(&fc->nallocated,fc->nallocated - 1,__ATOMIC_RELAXED);
+}
+
+/* Allocate a chunk of nobjs objects and link them, the first and last objects
+   are put in first and last. */
+static fastcache_chunk *
+_chunk_new(fastcache_t *fc, size_t nobjs,
+        fastcache_obj **first, fastcache_obj **last)
+{
+    size_t item_size = (size_t)1 << fc->cache_item_size;
+    /* keep the objects aligned to their size, up to malloc's alignment */
+    size_t header_size = item_size > sizeof(fastcache_chunk) ?
+        item_size : sizeof(fastcache_chunk);
+    fastcache_chunk *chunk = malloc(header_size + item_size*nobjs);
+    if (!chunk) { return NULL; }
+    char *items = (char*)chunk + header_size;
+    size_t i;
+    /* this also touches every object so the thread allocating doesn't page
+       fault on them */
+    for (i = 0; i < nobjs; i++) {
+        ((fastcache_obj*)(items + i*item_size))->next =
+            (fastcache_obj*)(items + (i+1)*item_size);
+    }
+    *first = (fastcache_obj*)items;
+    *last = (fastcache_obj*)(items + (nobjs-1)*item_size);
+    (*last)->next = NULL;
+    return chunk;
+}
+
+int
+fastcache_grow(fastcache_t *fc, size_t nobjs)
+{
+    fastcache_obj *first, *last, *pending;
+    if (nobjs == 0) { return 0; }
+    fastcache_chunk *chunk = _chunk_new(fc,nobjs,&first,&last);
+    if (!chunk) { return -1; }
+    chunk->next = __atomic_load_n(&fc->chunks,__ATOMIC_RELAXED);
+    while (!__atomic_compare_exchange_n(&fc->chunks,&chunk->next,chunk,
+                1,__ATOMIC_RELAXED,__ATOMIC_RELAXED));
+    pending = __atomic_load_n(&fc->pending,__ATOMIC_RELAXED);
+    do {
+        last->next = pending;
+    } while (!__atomic_compare_exchange_n(&fc->pending,&pending,first,
+                1,__ATOMIC_RELEASE,__ATOMIC_RELAXED));
+    __atomic_add_fetch(&fc->nobjs,nobjs,__ATOMIC_RELAXED);
+    return 0;
+}
+
+size_t
+fastcache_nfree(fastcache_t *fc)
+{
+    size_t nallocated = __atomic_load_n(&fc->nallocated,__ATOMIC_RELAXED);
+    size_t nobjs = __atomic_load_n(&fc->nobjs,__ATOMIC_RELAXED);
+    return nobjs > nallocated ? nobjs - nallocated : 0;
 }
 
-/* 
+/*
    obj_size is size of object, this will be rounded up to next power of 2
-   nobjs is number of objects, this will be rounded up to multiple of 32
+   nobjs is number of objects
 */
 fastcache_t *
 fastcache_new(size_t obj_size, size_t nobjs)
 {
     if (obj_size == 0 || nobjs == 0) { return NULL; }
+    if (obj_size < sizeof(fastcache_obj)) { obj_size = sizeof(fastcache_obj); }
     size_t cache_item_size = 1;
-    while ((1 << cache_item_size) < obj_size) { cache_item_size++; }
-    nobjs = (nobjs + 31) & ~0x1f;
-    fastcache_t *ret = calloc(sizeof(fastcache_t)
-            +sizeof(uint32_t)*(nobjs >> 5) /* space for cache mask */
-            +(1 << cache_item_size)*nobjs, /* space for cache items */
-            1); 
+    while (((size_t)1 << cache_item_size) < obj_size) { cache_item_size++; }
+    fastcache_t *ret = calloc(1,sizeof(fastcache_t));
     if (!ret) { return ret; }
-    ret->cache_mask = (uint32_t*)(ret+1);
-    ret->cache_begin = (char*)(ret->cache_mask + sizeof(uint32_t)*(nobjs >> 5));
-    ret->cache_nblocks = (nobjs >> 5);
     ret->cache_item_size = cache_item_size;
-    memset(ret->cache_mask,0xff,sizeof(uint32_t)*(nobjs >> 5));
+    fastcache_obj *last;
+    if (!(ret->chunks = _chunk_new(ret,nobjs,&ret->free_list,&last))) {
+        free(ret);
+        return NULL;
+    }
+    ret->chunks->next = NULL;
+    ret->nobjs = nobjs;
     return ret;
 }
+
+void
+fastcache_destroy(fastcache_t *fc)
+{
+    fastcache_chunk *chunk = fc->chunks;
+    while (chunk) {
+        fastcache_chunk *next = chunk->next;
+        free(chunk);
+        chunk = next;
+    }
+    free(fc);
+}
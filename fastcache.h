@@ -1,11 +1,15 @@
 #ifndef FASTCACHE_H
-#define FASTCACHE_H 
+#define FASTCACHE_H
 
-/* Functions for allocating / deallocating constant sized objects for use in realtime context */
+/* Functions for allocating / deallocating constant sized objects for use in realtime context.
+   fastcache_alloc and fastcache_free are O(1) and must be called from the
+   same thread (e.g., the JACK process callback). fastcache_grow can be called
+   from other threads while that thread allocates. */
 #include <stddef.h>
 
 typedef struct fastcache_t fastcache_t;
 
+/* Returns NULL if there are no free objects */
 void *
 fastcache_alloc(fastcache_t *fc);
 
@@ -13,12 +17,25 @@ fastcache_alloc(fastcache_t *fc);
 void
 fastcache_free(fastcache_t *fc, void *ptr);
 
+/* Add nobjs objects to the cache. Allocates memory so don't call from a
+   realtime thread. Returns 0 on success, -1 if no memory. */
+int
+fastcache_grow(fastcache_t *fc, size_t nobjs);
 
-/* 
+/* Number of objects not allocated, including those added by fastcache_grow.
+   From another thread than the allocating one this is approximate. */
+size_t
+fastcache_nfree(fastcache_t *fc);
+
+/*
    obj_size is size of object, this will be rounded up to next power of 2
-   nobjs is number of objects, this will be rounded up to multiple of 32
+   nobjs is number of objects
 */
 fastcache_t *
 fastcache_new(size_t obj_size, size_t nobjs);
 
+/* Free the cache and all its objects */
+void
+fastcache_destroy(fastcache_t *fc);
+
 #endif /* FASTCACHE_H */
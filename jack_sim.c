@@ -0,0 +1,436 @@
+/* JACK API without a JACK server, see jack_sim.h */
+#include "jack_sim.h"
+#include <errno.h>
+#include <inttypes.h>
+#include <pthread.h>
+#include <signal.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+#include <unistd.h>
+
+/* Most events in one port buffer per period */
+#define SIM_PORT_NEVENTS 1024
+/* Most input ports */
+#define SIM_MAX_IN_PORTS 16
+#define SIM_EVENT_MAXSIZE 16
+
+#ifndef MAX
+#define MAX(a,b) ( (a) < (b) ? (b) : (a) )
+#endif
+
+typedef struct {
+    jack_nframes_t time;
+    size_t size;
+    jack_midi_data_t data[SIM_EVENT_MAXSIZE];
+} sim_event;
+
+/* A port buffer, the port is the buffer */
+struct jack_port_t {
+    uint32_t nevents;
+    sim_event events[SIM_PORT_NEVENTS];
+};
+
+/* An input port and the file its events are read from */
+typedef struct {
+    jack_port_t *port;
+    FILE *in;
+    /* the next input event, read ahead, valid if have_next */
+    sim_event next;
+    uint64_t next_frame;
+    int have_next;
+} sim_input;
+
+struct jack_client_t {
+    JackProcessCallback process;
+    void *process_arg;
+    sim_input inputs[SIM_MAX_IN_PORTS];
+    /* number of input ports registered */
+    int nin;
+    jack_port_t *out_port;
+    jack_nframes_t nframes;
+    jack_nframes_t rate;
+    double speed;
+    uint64_t tail;
+    FILE *out;
+    pthread_t thread;
+    volatile int running;
+};
+
+static unsigned long
+env_ulong(const char *name, unsigned long dflt)
+{
+    const char *s = getenv(name);
+    return s ? strtoul(s,NULL,10) : dflt;
+}
+
+static void
+close_inputs(jack_client_t *c)
+{
+    int i;
+    for (i = 0; i < SIM_MAX_IN_PORTS; i++) {
+        if (c->inputs[i].in) { fclose(c->inputs[i].in); }
+    }
+}
+
+/* Open the files in the colon separated list in for the input ports in
+   order. Returns -1 if one can't be opened. */
+static int
+open_inputs(jack_client_t *c, const char *in)
+{
+    char path[4096];
+    int i = 0;
+    while (in && (i < SIM_MAX_IN_PORTS)) {
+        const char *end = strchr(in,':');
+        size_t len = end ? (size_t)(end - in) : strlen(in);
+        if (len >= sizeof(path)) { len = sizeof(path) - 1; }
+        memcpy(path,in,len);
+        path[len] = 0;
+        /* an empty path leaves the port without input */
+        if (len && !(c->inputs[i].in = fopen(path,"r"))) {
+            perror(path);
+            return -1;
+        }
+        i++;
+        in = end ? end + 1 : NULL;
+    }
+    return 0;
+}
+
+jack_client_t *
+jack_client_open(const char *client_name, int options, jack_status_t *status,
+        ...)
+{
+    jack_client_t *c = calloc(1,sizeof(jack_client_t));
+    const char *in = getenv("MIDI_PROC_SIM_IN"),
+               *out = getenv("MIDI_PROC_SIM_OUT"),
+               *speed = getenv("MIDI_PROC_SIM_SPEED");
+    if (!c) { return NULL; }
+    c->nframes = env_ulong("MIDI_PROC_SIM_NFRAMES",256);
+    c->rate = env_ulong("MIDI_PROC_SIM_RATE",48000);
+    c->tail = env_ulong("MIDI_PROC_SIM_TAIL",c->rate);
+    c->speed = speed ? atof(speed) : 1.;
+    if ((c->nframes == 0) || (c->rate == 0) || !(c->speed > 0)) {
+        fprintf(stderr,"jack_sim: bad period size, rate or speed\n");
+        free(c);
+        return NULL;
+    }
+    if (open_inputs(c,in)) {
+        close_inputs(c);
+        free(c);
+        return NULL;
+    }
+    c->out = stdout;
+    if (out && !(c->out = fopen(out,"w"))) {
+        perror(out);
+        close_inputs(c);
+        free(c);
+        return NULL;
+    }
+    return c;
+}
+
+int
+jack_client_close(jack_client_t *client)
+{
+    int i;
+    close_inputs(client);
+    if (client->out != stdout) { fclose(client->out); }
+    for (i = 0; i < client->nin; i++) { free(client->inputs[i].port); }
+    free(client->out_port);
+    free(client);
+    return 0;
+}
+
+int
+jack_set_process_callback(jack_client_t *client, JackProcessCallback cb,
+        void *arg)
+{
+    client->process = cb;
+    client->process_arg = arg;
+    return 0;
+}
+
+jack_nframes_t
+jack_get_buffer_size(jack_client_t *client)
+{
+    return client->nframes;
+}
+
+jack_nframes_t
+jack_get_sample_rate(jack_client_t *client)
+{
+    return client->rate;
+}
+
+jack_port_t *
+jack_port_register(jack_client_t *client, const char *port_name,
+        const char *port_type, unsigned long flags, unsigned long buffer_size)
+{
+    jack_port_t **p = &client->out_port;
+    if (flags & JackPortIsInput) {
+        if (client->nin == SIM_MAX_IN_PORTS) { return NULL; }
+        p = &client->inputs[client->nin].port;
+    }
+    if (*p) { return NULL; }
+    if ((*p = calloc(1,sizeof(jack_port_t))) && (flags & JackPortIsInput)) {
+        client->nin++;
+    }
+    return *p;
+}
+
+void *
+jack_port_get_buffer(jack_port_t *port, jack_nframes_t nframes)
+{
+    return port;
+}
+
+uint32_t
+jack_midi_get_event_count(void *port_buffer)
+{
+    return ((jack_port_t*)port_buffer)->nevents;
+}
+
+int
+jack_midi_event_get(jack_midi_event_t *event, void *port_buffer,
+        uint32_t event_index)
+{
+    jack_port_t *port = port_buffer;
+    if (event_index >= port->nevents) { return ENODATA; }
+    event->time = port->events[event_index].time;
+    event->size = port->events[event_index].size;
+    event->buffer = port->events[event_index].data;
+    return 0;
+}
+
+void
+jack_midi_clear_buffer(void *port_buffer)
+{
+    ((jack_port_t*)port_buffer)->nevents = 0;
+}
+
+jack_midi_data_t *
+jack_midi_event_reserve(void *port_buffer, jack_nframes_t time,
+        size_t data_size)
+{
+    jack_port_t *port = port_buffer;
+    sim_event *ev;
+    if ((port->nevents == SIM_PORT_NEVENTS)
+            || (data_size > SIM_EVENT_MAXSIZE)) {
+        return NULL;
+    }
+    ev = &port->events[port->nevents++];
+    ev->time = time;
+    ev->size = data_size;
+    return ev->data;
+}
+
+/* Read the next input event into c->next, clearing have_next at the end of
+   the file. Lines that aren't events are skipped. */
+static void
+read_next(sim_input *c)
+{
+    char line[256];
+    c->have_next = 0;
+    while (c->in && fgets(line,sizeof(line),c->in)) {
+        unsigned int d[3];
+        uint64_t frame;
+        int n = sscanf(line,"%" SCNu64 " %u %u %u",&frame,&d[0],&d[1],&d[2]);
+        if (n < 3) { continue; }
+        c->next.size = n - 1;
+        for (n = 0; n < c->next.size; n++) { c->next.data[n] = d[n]; }
+        c->next_frame = frame;
+        c->have_next = 1;
+        return;
+    }
+}
+
+/* Put the input events of the period starting at frame into the input port */
+static void
+fill_input(sim_input *c, uint64_t frame, jack_nframes_t nframes)
+{
+    jack_port_t *port = c->port;
+    port->nevents = 0;
+    while (c->have_next && (c->next_frame < frame + nframes)) {
+        if (port->nevents < SIM_PORT_NEVENTS) {
+            sim_event *ev = &port->events[port->nevents++];
+            *ev = c->next;
+            /* events late in the file are delivered straight away */
+            ev->time = c->next_frame > frame ? c->next_frame - frame : 0;
+        } else {
+            fprintf(stderr,"jack_sim: input port full, event dropped\n");
+        }
+        read_next(c);
+    }
+}
+
+static void
+write_output(jack_client_t *c, uint64_t frame)
+{
+    jack_port_t *port = c->out_port;
+    uint32_t i;
+    size_t j;
+    for (i = 0; i < port->nevents; i++) {
+        fprintf(c->out,"%" PRIu64,frame + port->events[i].time);
+        for (j = 0; j < port->events[i].size; j++) {
+            fprintf(c->out," %u",port->events[i].data[j]);
+        }
+        fprintf(c->out,"\n");
+    }
+}
+
+static void
+timespec_add_ns(struct timespec *ts, uint64_t ns)
+{
+    ns += ts->tv_nsec;
+    ts->tv_sec += ns / 1000000000;
+    ts->tv_nsec = ns % 1000000000;
+}
+
+static void *
+process_thread(void *aux)
+{
+    jack_client_t *c = aux;
+    uint64_t frame = 0, end = 0;
+    uint64_t period_ns = 1e9*c->nframes/c->rate/c->speed;
+    struct timespec deadline;
+    int i;
+    clock_gettime(CLOCK_MONOTONIC,&deadline);
+    for (i = 0; i < c->nin; i++) { read_next(&c->inputs[i]); }
+    while (c->running) {
+        int have_next = 0;
+        for (i = 0; i < c->nin; i++) {
+            if (c->inputs[i].have_next) {
+                have_next = 1;
+                end = MAX(end,c->inputs[i].next_frame + c->tail);
+            }
+        }
+        if (!have_next && (frame >= end)) { break; }
+        for (i = 0; i < c->nin; i++) {
+            fill_input(&c->inputs[i],frame,c->nframes);
+        }
+        c->process(c->nframes,c->process_arg);
+        write_output(c,frame);
+        frame += c->nframes;
+        timespec_add_ns(&deadline,period_ns);
+        while (clock_nanosleep(CLOCK_MONOTONIC,TIMER_ABSTIME,&deadline,
+                    NULL) == EINTR);
+    }
+    fflush(c->out);
+    if (c->running) {
+        /* ran to the end, stop the program */
+        kill(getpid(),SIGINT);
+    }
+    return NULL;
+}
+
+int
+jack_activate(jack_client_t *client)
+{
+    if (!client->process || !client->nin || !client->out_port) {
+        return -1;
+    }
+    client->running = 1;
+    if (pthread_create(&client->thread,NULL,process_thread,client)) {
+        client->running = 0;
+        return -1;
+    }
+    return 0;
+}
+
+int
+jack_deactivate(jack_client_t *client)
+{
+    if (client->running) {
+        client->running = 0;
+        pthread_join(client->thread,NULL);
+    }
+    return 0;
+}
+
+struct jack_ringbuffer_t {
+    char *buf;
+    /* kept modulo size, one byte is always left free to tell a full ring from
+       an empty one */
+    size_t write_ptr;
+    size_t read_ptr;
+    size_t size_mask;
+};
+
+jack_ringbuffer_t *
+jack_ringbuffer_create(size_t sz)
+{
+    jack_ringbuffer_t *rb = calloc(1,sizeof(jack_ringbuffer_t));
+    size_t size = 1;
+    if (!rb) { return NULL; }
+    while (size < sz) { size <<= 1; }
+    if (!(rb->buf = malloc(size))) {
+        free(rb);
+        return NULL;
+    }
+    rb->size_mask = size - 1;
+    return rb;
+}
+
+void
+jack_ringbuffer_free(jack_ringbuffer_t *rb)
+{
+    free(rb->buf);
+    free(rb);
+}
+
+size_t
+jack_ringbuffer_read_space(const jack_ringbuffer_t *rb)
+{
+    size_t w = __atomic_load_n(&rb->write_ptr,__ATOMIC_ACQUIRE);
+    return (w - rb->read_ptr) & rb->size_mask;
+}
+
+size_t
+jack_ringbuffer_write_space(const jack_ringbuffer_t *rb)
+{
+    size_t r = __atomic_load_n(&rb->read_ptr,__ATOMIC_ACQUIRE);
+    return (r - rb->write_ptr - 1) & rb->size_mask;
+}
+
+size_t
+jack_ringbuffer_peek(jack_ringbuffer_t *rb, char *dest, size_t cnt)
+{
+    size_t avail = jack_ringbuffer_read_space(rb), idx = rb->read_ptr, n1;
+    if (cnt > avail) { cnt = avail; }
+    n1 = rb->size_mask + 1 - idx;
+    if (n1 > cnt) { n1 = cnt; }
+    memcpy(dest,rb->buf + idx,n1);
+    memcpy(dest + n1,rb->buf,cnt - n1);
+    return cnt;
+}
+
+void
+jack_ringbuffer_read_advance(jack_ringbuffer_t *rb, size_t cnt)
+{
+    __atomic_store_n(&rb->read_ptr,(rb->read_ptr + cnt) & rb->size_mask,
+            __ATOMIC_RELEASE);
+}
+
+size_t
+jack_ringbuffer_read(jack_ringbuffer_t *rb, char *dest, size_t cnt)
+{
+    cnt = jack_ringbuffer_peek(rb,dest,cnt);
+    jack_ringbuffer_read_advance(rb,cnt);
+    return cnt;
+}
+
+size_t
+jack_ringbuffer_write(jack_ringbuffer_t *rb, const char *src, size_t cnt)
+{
+    size_t avail = jack_ringbuffer_write_space(rb), idx = rb->write_ptr, n1;
+    if (cnt > avail) { cnt = avail; }
+    n1 = rb->size_mask + 1 - idx;
+    if (n1 > cnt) { n1 = cnt; }
+    memcpy(rb->buf + idx,src,n1);
+    memcpy(rb->buf,src + n1,cnt - n1);
+    __atomic_store_n(&rb->write_ptr,(rb->write_ptr + cnt) & rb->size_mask,
+            __ATOMIC_RELEASE);
+    return cnt;
+}
@@ -0,0 +1,121 @@
+#ifndef JACK_SIM_H
+#define JACK_SIM_H
+
+/* The parts of the JACK API used by midi_proc_jack.c, implemented without a
+   JACK server so it can be built as midi_proc_sim (see the Makefile). Once
+   activated, a thread calls the process callback once per period of a
+   synthetic clock, giving it the MIDI events read from a file and writing the
+   events it outputs to another. It is configured through the environment:
+
+     MIDI_PROC_SIM_IN       file of input events, one per line:
+                            frame status data1 [data2], all decimal. With
+                            several input ports, a colon separated list of
+                            files for the ports in the order registered.
+     MIDI_PROC_SIM_OUT      file the output events are written to in the same
+                            format, stdout if not set
+     MIDI_PROC_SIM_NFRAMES  frames per period, 256 by default
+     MIDI_PROC_SIM_RATE     sample rate, 48000 by default
+     MIDI_PROC_SIM_SPEED    how many times faster than real time the periods
+                            are run, 1 by default
+     MIDI_PROC_SIM_TAIL     frames to keep running after the last input event,
+                            one second's worth by default
+
+   When it has run to the end the simulation sends SIGINT to the process.
+
+   The ringbuffer is a single-producer / single-consumer byte ring like
+   JACK's. */
+#include <stddef.h>
+#include <stdint.h>
+
+typedef uint32_t jack_nframes_t;
+typedef unsigned char jack_midi_data_t;
+typedef int jack_status_t;
+typedef struct jack_client_t jack_client_t;
+typedef struct jack_port_t jack_port_t;
+typedef int (*JackProcessCallback)(jack_nframes_t nframes, void *arg);
+
+#define JackNullOption 0
+#define JackPortIsInput 0x1
+#define JackPortIsOutput 0x2
+#define JACK_DEFAULT_MIDI_TYPE "8 bit raw midi"
+
+typedef struct {
+    /* offset in the period */
+    jack_nframes_t time;
+    size_t size;
+    jack_midi_data_t *buffer;
+} jack_midi_event_t;
+
+jack_client_t *
+jack_client_open(const char *client_name, int options, jack_status_t *status,
+        ...);
+
+int
+jack_client_close(jack_client_t *client);
+
+int
+jack_set_process_callback(jack_client_t *client, JackProcessCallback cb,
+        void *arg);
+
+int
+jack_activate(jack_client_t *client);
+
+int
+jack_deactivate(jack_client_t *client);
+
+jack_nframes_t
+jack_get_buffer_size(jack_client_t *client);
+
+jack_nframes_t
+jack_get_sample_rate(jack_client_t *client);
+
+/* Up to 16 input ports and one output port are supported */
+jack_port_t *
+jack_port_register(jack_client_t *client, const char *port_name,
+        const char *port_type, unsigned long flags, unsigned long buffer_size);
+
+void *
+jack_port_get_buffer(jack_port_t *port, jack_nframes_t nframes);
+
+uint32_t
+jack_midi_get_event_count(void *port_buffer);
+
+int
+jack_midi_event_get(jack_midi_event_t *event, void *port_buffer,
+        uint32_t event_index);
+
+void
+jack_midi_clear_buffer(void *port_buffer);
+
+/* Returns NULL if the port buffer is full */
+jack_midi_data_t *
+jack_midi_event_reserve(void *port_buffer, jack_nframes_t time,
+        size_t data_size);
+
+typedef struct jack_ringbuffer_t jack_ringbuffer_t;
+
+jack_ringbuffer_t *
+jack_ringbuffer_create(size_t sz);
+
+void
+jack_ringbuffer_free(jack_ringbuffer_t *rb);
+
+size_t
+jack_ringbuffer_read_space(const jack_ringbuffer_t *rb);
+
+size_t
+jack_ringbuffer_write_space(const jack_ringbuffer_t *rb);
+
+size_t
+jack_ringbuffer_read(jack_ringbuffer_t *rb, char *dest, size_t cnt);
+
+size_t
+jack_ringbuffer_peek(jack_ringbuffer_t *rb, char *dest, size_t cnt);
+
+void
+jack_ringbuffer_read_advance(jack_ringbuffer_t *rb, size_t cnt);
+
+size_t
+jack_ringbuffer_write(jack_ringbuffer_t *rb, const char *src, size_t cnt);
+
+#endif /* JACK_SIM_H */
@@ -0,0 +1,44 @@
+/* Latency histograms, see latency_hist.h */
+#include "latency_hist.h"
+#include <time.h>
+
+uint64_t
+latency_hist_now_ns(void)
+{
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC,&ts);
+    return (uint64_t)ts.tv_sec*1000000000ULL + ts.tv_nsec;
+}
+
+void
+latency_hist_add(latency_hist *h, uint64_t ns)
+{
+    int bin = 63 - __builtin_clzll(ns | 1);
+    if (bin >= LATENCY_HIST_NBINS) { bin = LATENCY_HIST_NBINS - 1; }
+    h->bins[bin]++;
+    h->n++;
+    h->sum_ns += ns;
+    if (ns > h->max_ns) { h->max_ns = ns; }
+}
+
+uint64_t
+latency_hist_quantile(const latency_hist *h, double q)
+{
+    uint64_t n = 0, target = (uint64_t)(q*h->n);
+    int i;
+    if (h->n == 0) { return 0; }
+    for (i = 0; i < LATENCY_HIST_NBINS - 1; i++) {
+        n += h->bins[i];
+        if (n > target) { break; }
+    }
+    return (uint64_t)1 << (i + 1);
+}
+
+void
+latency_hist_print(const latency_hist *h, FILE *f)
+{
+    fprintf(f,"%-12s n %10" PRIu64 " mean %10.0f ns p50 < %10" PRIu64
+            " ns p99 < %10" PRIu64 " ns max %10" PRIu64 " ns\n",h->name,h->n,
+            h->n ? (double)h->sum_ns/h->n : 0.,latency_hist_quantile(h,0.5),
+            latency_hist_quantile(h,0.99),h->max_ns);
+}
@@ -0,0 +1,38 @@
+#ifndef LATENCY_HIST_H
+#define LATENCY_HIST_H
+
+/* Histograms of latencies in ns with a bin for each power of 2, cheap enough
+   to update from the JACK process callback. A histogram must be updated by
+   one thread only, other threads reading it get approximate values. */
+#include <inttypes.h>
+#include <stdio.h>
+
+/* bin i counts latencies from 2^i up to 2^(i+1) ns, the last bin counts all
+   the longer ones too */
+#define LATENCY_HIST_NBINS 40
+
+typedef struct {
+    const char *name;
+    uint64_t bins[LATENCY_HIST_NBINS];
+    uint64_t n;
+    uint64_t sum_ns;
+    uint64_t max_ns;
+} latency_hist;
+
+/* CLOCK_MONOTONIC in ns, the clock Python's time.monotonic_ns uses on Linux */
+uint64_t
+latency_hist_now_ns(void);
+
+void
+latency_hist_add(latency_hist *h, uint64_t ns);
+
+/* Upper bound of the bin holding quantile q (0-1) of the latencies, 0 if the
+   histogram is empty */
+uint64_t
+latency_hist_quantile(const latency_hist *h, double q);
+
+/* One line with the count, mean, median, 99th percentile and maximum */
+void
+latency_hist_print(const latency_hist *h, FILE *f);
+
+#endif /* LATENCY_HIST_H */
@@ -0,0 +1,90 @@
+# Transform MIDI events with domelang programs.
+#
+# A DomeCallback is a batch callback (see midi_proc_jack.set_midi_batch_cb)
+# running a domelang program for each of the fields pitch, velocity, time and
+# channel. Each program starts with a stack holding the field of all the events
+# of the batch as one numpy array, runs once for the whole batch and leaves the
+# new values of the field on the top of the stack. For example
+#
+#   set_midi_dome_cb(0,['NoteOn','NoteOff'],pitch='7 -')
+#
+# transposes the notes on channel 0 down a fifth.
+
+import domelang
+import midi_proc_jack
+import numpy as np
+
+from midi_proc_jack import EventBatch
+
+class DomeCallback:
+    def __init__(self,pitch=None,velocity=None,time=None,channel=None,
+            copies=1):
+        """
+        pitch, velocity, time, channel: domelang source of the program
+            computing the field, or None to leave it as it is. The programs are
+            compiled once, by domelang.get_code.
+        copies: number of events made from each event. The fields of each event
+            are repeated copies times in a row before the programs run, so a
+            list of copies numbers added to a field (which domelang cycles to
+            the length of the field) gives each copy its own offset.
+
+        The result of a program can be a number or a vector, shorter vectors
+        are cycled to the number of events. Times are truncated to whole
+        samples and can't go below 0, pitches wrap like MIDIEvent.set_pitch,
+        velocities are clamped to 0-127 and channels wrap at 16.
+        """
+        srcs=[pitch,velocity,time,channel]
+        self.codes=[None if src is None else domelang.get_code(src)
+                for src in srcs]
+        self.copies=copies
+        self.executor=domelang.Executor()
+    def _run(self,code,x):
+        """
+        Run code with the array x on the stack. Returns its result as an array
+        of the length of x.
+        """
+        if code is None:
+            return x
+        stack=[x]
+        self.executor.run(stack,code)
+        if not stack:
+            raise ValueError('domelang program left the stack empty')
+        ret=stack[-1]
+        # lists are left by programs building uneven nestings, arrays stay
+        # arrays
+        if type(ret) != np.ndarray:
+            ret=domelang.from_arrays(ret)
+        ret=np.ravel(np.asarray(ret,dtype=np.float64))
+        if len(ret) == 0:
+            raise ValueError('domelang program returned an empty vector')
+        return np.resize(ret,len(x))
+    def __call__(self,batch):
+        arr=np.repeat(batch.arr,self.copies)
+        ret=EventBatch(arr)
+        pitched=ret._code_mask(midi_proc_jack._pitched_codes)
+        vel_hi,vel_lo=ret._velocity_col()
+        status=arr['status'].astype(np.int64)
+        data1=arr['data1'].astype(np.int64)
+        data2=arr['data2'].astype(np.int64)
+        fields=[data1,np.where(vel_lo,data1,data2),
+                arr['tme_mon'].astype(np.int64),status&0x0f]
+        pitch,velocity,tme,chan=[self._run(c,f)
+                for c,f in zip(self.codes,fields)]
+        pitch=pitch.astype(np.int64)&0x7f
+        velocity=np.clip(velocity,0,127).astype(np.uint8)
+        arr['data1'][pitched]=pitch[pitched]
+        arr['data2'][vel_hi]=velocity[vel_hi]
+        arr['data1'][vel_lo]=velocity[vel_lo]
+        arr['tme_mon']=np.maximum(tme.astype(np.int64),0)
+        arr['status']=(status&0xf0)|(chan.astype(np.int64)&0x0f)
+        return ret
+
+def set_midi_dome_cb(chan,name,pitch=None,velocity=None,time=None,
+        channel=None,copies=1):
+    """
+    Transform the events selected by chan and name (see set_midi_cb) with a
+    DomeCallback. The MIDIProcThread must run in batch mode.
+    """
+    cb=DomeCallback(pitch,velocity,time,channel,copies)
+    midi_proc_jack.set_midi_batch_cb(chan,name,cb)
+    return cb
@@ -0,0 +1,239 @@
+# Callbacks that are table lookups, applied by midi_proc_jack itself.
+#
+# A MidiMap maps each event of a status byte to a fixed list of events,
+# chosen by its data1 (the pitch of a note, the controller of a
+# ControlChange): a new data1 and optionally a new type and channel, data2
+# (velocity, controller value) through a curve and a delay. That covers
+# remapping pitches or controllers, transposing, velocity curves and fixed
+# delay fan-outs. A MidiMap is set like any callback,
+#
+#   midi_proc_jack.set_midi_cb(0,['NoteOn','NoteOff'],MidiMap(transpose=-7))
+#
+# and runs as one in Python. Once enable() is called, the MidiMaps set as
+# callbacks are compiled into tables in shared memory, uploaded again whenever
+# the callbacks change, and midi_proc_jack -a makes their events in process()
+# without sending anything here. A MidiMap that doesn't fit in the tables is
+# left to run in Python.
+
+import midi_proc_jack
+import struct
+import sysv_ipc as ipc
+import time
+import warnings
+
+from midi_proc_jack import MIDIEvent,_status_sizes
+
+# Key of the shared memory holding the tables and their layout, must match
+# map_key and maptab_shared in midi_proc_jack.c
+MAP_KEY=126
+MAPTAB_NMAPS=32
+MAPTAB_NCURVES=16
+MAPTAB_NOUTS=4096
+MAPTAB_KEEP=0xff
+_head_struct=struct.Struct("II")
+_entry_struct=struct.Struct("HBB")
+_out_struct=struct.Struct("BBBBI")
+_MAPS_OFF=256
+_CURVES_OFF=_MAPS_OFF+MAPTAB_NMAPS*128*_entry_struct.size
+_OUTS_OFF=_CURVES_OFF+MAPTAB_NCURVES*128
+_TABLE_SIZE=_OUTS_OFF+MAPTAB_NOUTS*_out_struct.size
+_TABLES_OFF=_head_struct.size
+# Set in seen, with the table in use, by each period of midi_proc_jack -a, must
+# match MAPTAB_SEEN_USED in midi_proc_jack.c
+MAPTAB_SEEN_USED=2
+# Longest time to wait for midi_proc_jack to stop using the table about to be
+# written, in s. It only uses a table for one period.
+UPLOAD_WAIT=0.1
+
+_IDENTITY=tuple(range(128))
+
+def _curve(velocity):
+    """
+    Returns the curve velocity (None, 128 values or a function of the input
+    value) as a tuple of 128 values in 0-127.
+    """
+    if velocity is None:
+        return _IDENTITY
+    if callable(velocity):
+        velocity=[velocity(v) for v in range(128)]
+    if len(velocity) != 128:
+        raise ValueError('a velocity curve needs 128 values')
+    return tuple(min(max(int(v),0),127) for v in velocity)
+
+class MidiMap:
+    def __init__(self,remap=None,transpose=0,fan_out=((0,0),),velocity=None,
+            typ=None,chan=None):
+        """
+        remap: dict from data1 to data1, or a function of data1 returning
+            data1 or None. The events whose data1 isn't remapped are passed on
+            as they are. If None, all the events are mapped.
+        transpose: added to the remapped data1
+        fan_out: an event is made for each (offset, delay) or (offset, delay,
+            velocity) in fan_out, with offset added to its data1 and output
+            delay frames after the input. delay must be non-negative and fit
+            in 32 bits. velocity replaces the map's velocity curve for that
+            event.
+        velocity: curve applied to data2, None to keep it, 128 values or a
+            function of the input data2. Values are truncated to whole numbers
+            and clamped to 0-127.
+        typ: name of the event type made, e.g., 'NoteOn' from ControlChange
+            events, None for the type of the input. Note offs can be made as
+            NoteOns of velocity 0.
+        chan: channel of the events made, None for the channel of the input.
+        data1 values wrap like MIDIEvent.set_pitch.
+        """
+        self.code=0 if typ is None else midi_proc_jack.get_midi_event_code(typ)
+        self.chan=MAPTAB_KEEP if chan is None else chan&0x0f
+        base_curve=_curve(velocity)
+        outs=[]
+        for out in fan_out:
+            curve=base_curve if len(out) < 3 else _curve(out[2])
+            delay=int(out[1])
+            if not 0 <= delay <= 0xffffffff:
+                raise ValueError('a fan-out delay must be in 0-%d frames'
+                        % (0xffffffff,))
+            outs.append((out[0],delay,curve))
+        # for each data1 the events made, as (data1, curve, delay), or None if
+        # it isn't mapped
+        self.entries=[]
+        for d1 in range(128):
+            if remap is None:
+                r=d1
+            elif callable(remap):
+                r=remap(d1)
+            else:
+                r=remap.get(d1)
+            if r is None:
+                self.entries.append(None)
+                continue
+            self.entries.append([((r+transpose+off)&0x7f,curve,delay)
+                for off,delay,curve in outs])
+    def __call__(self,mev):
+        status=mev.buf[mev.off]
+        outs=self.entries[mev.buf[mev.off+1]]
+        if outs is None:
+            return [mev]
+        data2=mev.buf[mev.off+2] if mev.size >= 3 else 0
+        status=((self.code or status&0xf0)
+                |(status&0x0f if self.chan == MAPTAB_KEEP else self.chan))
+        size=_status_sizes[status]
+        ret=[]
+        for d1,curve,delay in outs:
+            m=MIDIEvent.__new__(MIDIEvent)
+            m.tme_mon=mev.tme_mon+delay
+            m.size=size
+            m.buf=bytearray([status,d1,curve[data2]][:size])
+            m.off=0
+            ret.append(m)
+        return ret
+
+def _compile():
+    """
+    Returns the bytes of a maptab holding the MidiMaps set as callbacks that
+    fit in it.
+    """
+    tab=bytearray(_TABLE_SIZE)
+    # map index of each MidiMap put in the table, by id
+    indices={}
+    curves={_IDENTITY: 0}
+    nouts=0
+    for status in range(256):
+        m=midi_proc_jack.midi_cbs[status]
+        if (not isinstance(m,MidiMap)
+                or midi_proc_jack.midi_batch_cbs[status] is not None):
+            continue
+        if id(m) not in indices:
+            new_curves=set(c for outs in m.entries if outs
+                    for d1,c,delay in outs if c not in curves)
+            n=sum(len(outs) for outs in m.entries if outs)
+            if (len(indices) == MAPTAB_NMAPS
+                    or len(curves)+len(new_curves) > MAPTAB_NCURVES
+                    or nouts+n > MAPTAB_NOUTS):
+                # doesn't fit, runs in Python
+                continue
+            for c in new_curves:
+                curves[c]=len(curves)
+            mi=len(indices)
+            indices[id(m)]=mi
+            for d1,outs in enumerate(m.entries):
+                off=_MAPS_OFF+(mi*128+d1)*_entry_struct.size
+                if outs is None:
+                    # passed on as it is
+                    outs=[(d1,_IDENTITY,0)]
+                    code,chan=0,MAPTAB_KEEP
+                else:
+                    code,chan=m.code,m.chan
+                _entry_struct.pack_into(tab,off,nouts,len(outs),1)
+                for out_d1,c,delay in outs:
+                    _out_struct.pack_into(tab,_OUTS_OFF+nouts*_out_struct.size,
+                            code,chan,out_d1,curves[c],delay)
+                    nouts+=1
+        tab[status]=indices[id(m)]+1
+    for c,ci in curves.items():
+        tab[_CURVES_OFF+ci*128:_CURVES_OFF+(ci+1)*128]=bytes(c)
+    return tab
+
+# The shared memory the tables are uploaded to, None when not enabled
+_shm=None
+
+def _write_table(tab):
+    active,seen=_head_struct.unpack(_shm.read(_head_struct.size,0))
+    active&=1
+    # process() may still be using the other table if it hasn't started a
+    # period since the last upload. Nothing uses it unless midi_proc_jack -a
+    # is attached, seen stays set if it died without closing its port.
+    deadline=time.monotonic()+UPLOAD_WAIT
+    while (seen&MAPTAB_SEEN_USED and seen&1 != active
+            and _shm.number_attached > 1):
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.001)
+        seen=_head_struct.unpack(_shm.read(_head_struct.size,0))[1]
+    nxt=1-active
+    _shm.write(bytes(tab),_TABLES_OFF+nxt*_TABLE_SIZE)
+    _shm.write(struct.pack("I",nxt),0)
+    return True
+
+def upload():
+    """
+    Compile the MidiMaps set as callbacks and upload them to midi_proc_jack.
+    Returns whether they were uploaded. If midi_proc_jack doesn't release the
+    table to write within UPLOAD_WAIT it warns and leaves the tables uploaded
+    before.
+    """
+    if _shm is None:
+        return False
+    if not _write_table(_compile()):
+        warnings.warn('midi_proc_jack still uses the mapping table, '
+                'not uploaded')
+        return False
+    return True
+
+def enable(key=MAP_KEY,port=0):
+    """
+    Upload the MidiMaps set as callbacks to midi_proc_jack -a, and again each
+    time the callbacks change.
+    port: the input port of midi_proc_jack -n whose events are handled here
+    """
+    global _shm
+    if _shm is None:
+        _shm=ipc.SharedMemory(midi_proc_jack.port_key(key,port),ipc.IPC_CREAT,
+                size=_TABLES_OFF+2*_TABLE_SIZE)
+    midi_proc_jack.map_uploader=upload
+    upload()
+
+def disable():
+    """
+    Have midi_proc_jack send all the events here again, where the MidiMaps run
+    as callbacks. Warns like upload if the tables can't be cleared, they are
+    no longer uploaded either way.
+    """
+    global _shm
+    if _shm is None:
+        return
+    midi_proc_jack.map_uploader=None
+    if not _write_table(bytes(_TABLE_SIZE)):
+        warnings.warn('midi_proc_jack still uses the mapping table, '
+                'not cleared')
+    _shm.detach()
+    _shm=None
@@ -0,0 +1,178 @@
+# Run MIDI callbacks in a pool of worker processes.
+#
+# A WorkerPool splits each batch received by a MIDIProcThread into shards by a
+# key of the events, the channel by default, and sends each shard to a worker
+# process. Events with the same key always go to the same worker, in the order
+# they were received. Each worker runs the callbacks in its own copy of the
+# callback tables (set_midi_cb, set_midi_batch_cb), set up by the setup function
+# given to the pool. The MIDIProcThread hands each batch to the pool without
+# waiting, and a thread of the pool sends the results of each worker back as
+# soon as they arrive, merging by tme_mon those that arrive together. So a slow
+# callback on one channel only holds up the channels sharing its worker rather
+# than all of them.
+#
+#   def setup(i):
+#       midi_proc_jack.set_midi_cb(None,'NoteOn',generate)
+#   pool=WorkerPool(4,setup)
+#   th=midi_proc_jack.MIDIProcThread(batch=True,pool=pool)
+
+import midi_proc_jack
+import collections
+import multiprocessing
+import multiprocessing.connection
+import numpy as np
+import signal
+import threading
+
+from midi_proc_jack import EventBatch
+
+def shard_by_channel(batch):
+    return batch.chan
+
+def _proc_bytes(b):
+    mevs,done=midi_proc_jack._cbs_proc_bytes(b)
+    return bytes(midi_proc_jack.events_to_bytes(mevs))+done
+
+def _worker(conn,setup,i):
+    # the parent decides when the workers stop
+    signal.signal(signal.SIGINT,signal.SIG_IGN)
+    if setup is not None:
+        setup(i)
+    while True:
+        b=conn.recv_bytes()
+        # an empty message asks the worker to stop, shards are never empty
+        if not b:
+            break
+        conn.send_bytes(_proc_bytes(b))
+    conn.close()
+
+class WorkerPool:
+    def __init__(self,nworkers,setup=None,key=shard_by_channel,context=None):
+        """
+        nworkers: number of worker processes
+        setup: called with the index of the worker (0 to nworkers-1) in each
+            worker process when it starts, to set its callbacks. With the fork
+            start method the workers also inherit the callbacks set in this
+            process before the pool was made, with the others setup must be
+            picklable.
+        key: function of an EventBatch returning an integer array with a key
+            for each event, an event goes to worker key % nworkers. By default
+            the channel.
+        context: multiprocessing context used to start the workers, the default
+            one if None.
+        """
+        if nworkers < 1:
+            raise ValueError('a WorkerPool needs at least 1 worker')
+        ctx=context or multiprocessing.get_context()
+        self.key=key
+        self.conns=[]
+        self.procs=[]
+        for i in range(nworkers):
+            conn,child_conn=ctx.Pipe()
+            p=ctx.Process(target=_worker,args=(child_conn,setup,i),daemon=True)
+            p.start()
+            child_conn.close()
+            self.conns.append(conn)
+            self.procs.append(p)
+        # for each worker the tags of the shards sent to it whose results
+        # haven't been received, oldest first
+        self.pending=[collections.deque() for i in range(nworkers)]
+        self.thread=None
+    def __len__(self):
+        return len(self.procs)
+    def submit(self,b,tag=None):
+        """
+        Send the events in bytes b to the workers without waiting for them.
+        The results of each worker are given to the send function of start
+        with tag. Only blocks if a worker is so far behind that its pipe is
+        full.
+        """
+        batch=EventBatch.from_bytes(b)
+        if len(batch) == 0:
+            return
+        shard=np.asarray(self.key(batch))%len(self.procs)
+        for i,conn in enumerate(self.conns):
+            m=shard == i
+            if m.any():
+                self.pending[i].append(tag)
+                conn.send_bytes(batch.arr[m].tobytes())
+    def _recv(self,i):
+        try:
+            ret=self.conns[i].recv_bytes()
+        except EOFError:
+            raise RuntimeError('MIDI worker %d exited' % (i,))
+        return ret,self.pending[i].popleft()
+    def _merge(self,results):
+        if len(results) == 1:
+            return results[0]
+        return EventBatch.from_bytes(b''.join(results)).sort().to_bytes()
+    def process(self,b):
+        """
+        Run the events in bytes b through the workers and wait for all of
+        them. Returns the bytes of the resulting events, sorted by tme_mon
+        keeping the order of simultaneous events from the same worker. Not for
+        a started pool.
+        """
+        self.submit(b)
+        results=[]
+        for i in range(len(self.conns)):
+            while self.pending[i]:
+                results.append(self._recv(i)[0])
+        if not results:
+            return b''
+        return self._merge(results)
+    def _run(self):
+        while True:
+            ready=multiprocessing.connection.wait(self.conns+[self.wake_r])
+            if self.wake_r in ready:
+                break
+            results=[]
+            tags=[]
+            for i,conn in enumerate(self.conns):
+                if conn in ready:
+                    r,tag=self._recv(i)
+                    results.append(r)
+                    tags.append(tag)
+            self.send(self._merge(results),tags)
+    def start(self,send):
+        """
+        Start sending the results of the workers as they arrive to send, a
+        function of the bytes of the results and the tags of their shards.
+        Called by MIDIProcThread, which then gives its batches to submit.
+        """
+        self.send=send
+        self.wake_r,self.wake_w=multiprocessing.Pipe(False)
+        self.thread=threading.Thread(target=self._run,daemon=True)
+        self.thread.start()
+    def stop(self):
+        """
+        Stop the thread sending the results. Those still to come are sent if
+        the pool is started again.
+        """
+        if self.thread is None:
+            return
+        self.wake_w.send_bytes(b'')
+        self.thread.join()
+        self.thread=None
+        self.wake_r.close()
+        self.wake_w.close()
+    def close(self):
+        """
+        Stop the workers and wait for them to exit.
+        """
+        self.stop()
+        for conn in self.conns:
+            try:
+                conn.send_bytes(b'')
+            except OSError:
+                # the worker has already exited
+                pass
+            conn.close()
+        for p in self.procs:
+            p.join()
+        self.conns=[]
+        self.procs=[]
+    def __enter__(self):
+        return self
+    def __exit__(self,*args):
+        self.close()
@@ -0,0 +1,101 @@
+# Run a MIDIProcThread process for each input port of midi_proc_jack -n.
+#
+# midi_proc_jack -n N registers N input ports (input, input_1 ...), sends the
+# events of each on its own message queue or shared memory ring, with the keys
+# given by midi_proc_jack.port_key, and merges the events sent back for all of
+# them into its output port in time order. PortProcesses starts a process for
+# each port running a MIDIProcThread on the keys of that port, so independent
+# controllers plugged into different ports are processed on different cores,
+# each with its own callbacks.
+#
+#   def setup(port):
+#       midi_proc_jack.set_midi_cb(None,'NoteOn',drums if port == 0 else keys)
+#   with PortProcesses(2,setup,batch=True) as procs:
+#       procs.join()
+
+import midi_map
+import midi_proc_jack
+import multiprocessing
+import signal
+
+def _run_port(port,setup,ready,stop,kwargs):
+    # the parent decides when the processes stop
+    signal.signal(signal.SIGINT,signal.SIG_IGN)
+    if setup is not None:
+        kwargs=dict(kwargs,**(setup(port) or {}))
+    th=midi_proc_jack.MIDIProcThread(port=port,**kwargs)
+    th.start()
+    ready.release()
+    stop.wait()
+    th.stop()
+    th.join()
+    if th.pool is not None:
+        th.pool.close()
+    midi_proc_jack.disable_subscriptions()
+    midi_map.disable()
+
+class PortProcesses:
+    def __init__(self,nports,setup=None,context=None,**kwargs):
+        """
+        nports: number of ports, the processes handle ports 0 to nports-1
+        setup: called with the port in the process of each port when it
+            starts, to set its callbacks and enable its subscriptions
+            (midi_proc_jack.enable_subscriptions(port=port)) or mapping tables
+            (midi_map.enable(port=port)). It can return a dict of further
+            arguments of the MIDIProcThread of that port, e.g. a pool or a
+            scheduler. With the fork start method the processes also inherit
+            the callbacks set in this process, with the others setup must be
+            picklable.
+        context: multiprocessing context used to start the processes, the
+            default one if None.
+        The other arguments are passed to MIDIProcThread in each process.
+        Returns once all the processes are set up and receiving.
+        """
+        if not 1 <= nports <= midi_proc_jack.MAX_PORTS:
+            raise ValueError('nports must be 1 to %d' %
+                    (midi_proc_jack.MAX_PORTS,))
+        ctx=context or multiprocessing.get_context()
+        self.stop_event=ctx.Event()
+        ready=ctx.Semaphore(0)
+        self.procs=[]
+        for port in range(nports):
+            # not daemonic so a port can run a midi_pool.WorkerPool
+            p=ctx.Process(target=_run_port,
+                    args=(port,setup,ready,self.stop_event,kwargs))
+            p.start()
+            self.procs.append(p)
+        for i in range(nports):
+            while not ready.acquire(timeout=0.1):
+                dead=[port for port,p in enumerate(self.procs)
+                        if not p.is_alive()]
+                if dead:
+                    self.close()
+                    raise RuntimeError('MIDI port %d process exited' %
+                            (dead[0],))
+    def __len__(self):
+        return len(self.procs)
+    def stop(self):
+        """
+        Ask the processes to stop. A MIDIProcThread waiting for room to send
+        only stops once midi_proc_jack has read its queue or ring.
+        """
+        self.stop_event.set()
+    def is_alive(self):
+        return any(p.is_alive() for p in self.procs)
+    def join(self,timeout=None):
+        """
+        Wait for the processes to exit, at most timeout seconds for each.
+        """
+        for p in self.procs:
+            p.join(timeout)
+    def close(self):
+        """
+        Stop the processes and wait for them to exit.
+        """
+        self.stop()
+        self.join()
+        self.procs=[]
+    def __enter__(self):
+        return self
+    def __exit__(self,*args):
+        self.close()
@@ -4,21 +4,36 @@
    Send midi events to a different process via message queue.
    Receive events from a different process via a message queue.
    Send these events using JACK library.
+
+   With -n N there are N input ports, each with its own message queues (or
+   shared memory rings) so the events of each can be processed by a different
+   process. The events sent back are merged into the one output port.
  */
 
+#include <errno.h>
 #include <stdio.h>
 #include <string.h>
 #include <unistd.h>
 #include <assert.h>
 #include <inttypes.h>
+#include <stdlib.h>
 #include <sys/types.h>
 #include <sys/ipc.h>
 #include <sys/msg.h>
+#include <sys/shm.h>
+#ifdef MIDI_PROC_SIM
+/* built as midi_proc_sim, see jack_sim.h */
+#include "jack_sim.h"
+#else
 #include <jack/jack.h>
 #include <jack/midiport.h>
 #include <jack/ringbuffer.h>
-#include "heap.h"
+#endif
+#include "timewheel.h"
 #include "fastcache.h"
+#include "shmring.h"
+#include "latency_hist.h"
+#include "coalesce.h"
 
 #ifdef __MINGW32__
 #include <pthread.h>
@@ -34,64 +49,484 @@
 #define MAX(a,b) ( (a) < (b) ? (b) : (a) )
 #endif
 
+#ifndef MIN
+#define MIN(a,b) ( (a) < (b) ? (a) : (b) )
+#endif
+
 #define MSGQ_MIDIMSG_TYPE 1
 #define MIDI_HW_IF_CHAN_MAX 16
 #define MIDI_HW_IF_PITCH_MAX 128
 #define MIDIMSGBUFSIZE 16
 #define CACHE_NOBJS 1024
+/* Maximum number of midimsgs packed into one message queue message */
+#define MSGQ_BATCH_NMSGS 128
+/* Number of midimsgs held by each shared memory ring */
+#define SHMRING_NMSGS 1024
 
 static int debug = 0;
 
-static jack_port_t* port;
 static jack_port_t* output_port;
-static jack_ringbuffer_t *rb = NULL;
-/* mutex for incoming midi events / outgoing messages */
-static pthread_mutex_t msg_thread_lock = PTHREAD_MUTEX_INITIALIZER;
-static pthread_cond_t data_ready = PTHREAD_COND_INITIALIZER;
-/* mutex for outgoing midi events / incoming messages */
-static pthread_mutex_t heap_lock = PTHREAD_MUTEX_INITIALIZER;
 
 static int keeprunning = 1;
 static uint64_t monotonic_cnt = 0;
-Heap *outevheap;
+timewheel_t *outevwheel;
 static int passthrough = 0;
+/* Exchange messages through shared memory rings rather than message queues */
+static int use_shm = 0;
+/* Send only the events the other application subscribed to, see
+   subs_shared */
+static int use_subs = 0;
+/* Apply the mapping tables uploaded by the other application, see
+   maptab_shared */
+static int use_maps = 0;
+/* Merge the ControlChange and PitchBend events of each period, see
+   coalesce_period */
+static int coalesce = 0;
+/* Stamp the events with the time they leave each stage, see midimsg_stage */
+static int stamp_stages = 0;
+/* Set by SIGUSR1, the main thread then prints the stats */
+static volatile sig_atomic_t dump_stats = 0;
 
 #define RBSIZE 512
+#define RBSIZE_IN CACHE_NOBJS
 
 typedef struct {
     /* MIDI message data */
 	char  buffer[MIDIMSGBUFSIZE];
     /* number of data in message */
 	uint32_t size;
-    /* time since application started, also used by scheduler to determine when events should be output i.e., the heap sorts by this value so that the event that should happen soonest is always at the top. */
+    /* time since application started, also used by scheduler to determine when events should be output i.e., the timing wheel returns the events due in each period sorted by this value. */
 	uint64_t tme_mon;
 } midimsg;
 
+/* With -t the time in ns (latency_hist_now_ns) an event left the previous
+   stage of the pipeline is kept in the last 8 bytes of its buffer, which MIDI
+   messages of up to MIDIMSG_STAMP_OFF bytes don't use. 0 means not stamped.
+   midi_proc_jack.py stamps the events it sends with the same clock. */
+#define MIDIMSG_STAMP_OFF 8
+/* Set in the stamps written by midi_proc_jack.py and clear in those written
+   here, so the events it sends back without stamping them, which still
+   carry the stamp they were sent with, are left out of the recv histogram */
+#define MIDIMSG_STAMP_PY 1
+
+static uint64_t
+midimsg_stamp_get(const midimsg *m)
+{
+    uint64_t t = 0;
+    if (m->size <= MIDIMSG_STAMP_OFF) {
+        memcpy(&t,m->buffer + MIDIMSG_STAMP_OFF,sizeof(t));
+    }
+    return t;
+}
+
+static void
+midimsg_stamp(midimsg *m, uint64_t t)
+{
+    t &= ~(uint64_t)MIDIMSG_STAMP_PY;
+    if (m->size <= MIDIMSG_STAMP_OFF) {
+        memcpy(m->buffer + MIDIMSG_STAMP_OFF,&t,sizeof(t));
+    }
+}
+
+/* Add the time since m was last stamped to h and stamp it with now */
+static void
+midimsg_stage(midimsg *m, latency_hist *h, uint64_t now)
+{
+    uint64_t t = midimsg_stamp_get(m);
+    if (t && (now >= t)) { latency_hist_add(h,now - t); }
+    midimsg_stamp(m,now);
+}
+
+/* Latency of each hop, from the time an event was stamped by the previous
+   stage. Each is updated by the thread receiving the events, the hops through
+   the output and input threads are measured per port (see proc_port). */
+static latency_hist hist_rb_in = { .name = "recv->sched" };
+static latency_hist hist_wheel = { .name = "sched->jack" };
+
+/* Counters of the events passing through, printed with the histograms on
+   SIGUSR1. Each is written by one thread so the printed values are only
+   approximate. Those of the output and input threads are per port (see
+   proc_port). */
+static struct {
+    /* process() */
+    uint64_t jack_in;
+    /* events dropped because the rb of their port was full */
+    uint64_t rb_full;
+    /* periods where received events waited because the cache was full */
+    uint64_t cache_full;
+    uint64_t jack_out;
+    /* events output without going to the other application, see
+       subs_shared */
+    uint64_t forwarded;
+    /* events left out because a later one in the period replaced them, see
+       coalesce_period */
+    uint64_t coalesced;
+    /* events handled by the mapping tables, see maptab_shared */
+    uint64_t mapped;
+    /* events not output because of midi_ev_filt */
+    uint64_t filtered;
+    /* events dropped because the JACK output buffer was full */
+    uint64_t reserve_failed;
+    /* events output in a period after the one they were due in */
+    uint64_t late;
+    size_t rb_max;
+    size_t wheel_max;
+    /* input threads, added to atomically */
+    uint64_t cache_grown;
+} stats;
+
+/* The keys of the first input port, those of input port i are
+   PORT_KEY_STRIDE * i higher */
 static key_t in_key = 123;
 static key_t out_key = 124;
+static key_t subs_key = 125;
+
+/* The events the other application has callbacks for, published in shared
+   memory with the subs_key of the port by midi_proc_jack.py
+   (enable_subscriptions). Bit (status & 7) of mask[status >> 3] is set if
+   events with that status byte are sent to it, the others are forwarded
+   straight to the output port. All events are sent until published is set. */
+typedef struct {
+    uint32_t published;
+    uint8_t mask[32];
+} subs_shared;
+
+static key_t map_key = 126;
+
+#define MAPTAB_NMAPS 32
+#define MAPTAB_NCURVES 16
+#define MAPTAB_NOUTS 4096
+/* maptab_out.chan taking the channel of the input */
+#define MAPTAB_KEEP 0xff
+
+/* An event made from a mapped input event */
+typedef struct {
+    /* high nibble of the status byte, 0 for the type of the input */
+    uint8_t type;
+    /* MAPTAB_KEEP for the channel of the input */
+    uint8_t chan;
+    uint8_t data1;
+    /* index in curves of the table giving data2 from the input data2 */
+    uint8_t curve;
+    /* frames after the input */
+    uint32_t delay;
+} maptab_out;
+
+/* What an event with a given status and data1 is mapped to */
+typedef struct {
+    /* outs[first] to outs[first + n - 1] */
+    uint16_t first;
+    uint8_t n;
+    /* if 0, the event isn't mapped and goes on to the other application, with
+       n == 0 it is swallowed */
+    uint8_t mapped;
+} maptab_entry;
+
+typedef struct {
+    /* per status byte, 0 if not mapped or 1 + its index in maps */
+    uint8_t map[256];
+    /* per data1 */
+    maptab_entry maps[MAPTAB_NMAPS][128];
+    uint8_t curves[MAPTAB_NCURVES][128];
+    maptab_out outs[MAPTAB_NOUTS];
+} maptab;
+
+/* Mapping tables compiled by midi_map.py and uploaded in shared memory with
+   the map_key of the port, so process() makes the events of simple callbacks
+   itself without the round trip through the other application. The uploader writes
+   the table not in use and then sets active to it. process() sets seen to
+   the table it is using, or'd with MAPTAB_SEEN_USED, at the start of each
+   period, before using it and checking active again, and clears it when the
+   port closes. While MAPTAB_SEEN_USED is set the uploader waits for seen to
+   follow active before writing the other table again. */
+#define MAPTAB_SEEN_USED 2
+typedef struct {
+    uint32_t active;
+    uint32_t seen;
+    maptab tables[2];
+} maptab_shared;
+
+/* The table used by process() for the port it is reading, NULL if none */
+static const maptab *maptab_cur;
+
+/* Returns the entry of the mapping table for an event, NULL if it isn't
+   mapped */
+static const maptab_entry *
+map_entry(const jack_midi_data_t *buf, size_t size)
+{
+    const maptab_entry *e;
+    uint8_t m;
+    if (!maptab_cur || (size < 2) || !(m = maptab_cur->map[buf[0]])
+            || (m > MAPTAB_NMAPS)) {
+        return NULL;
+    }
+    e = &maptab_cur->maps[m - 1][buf[1] & 0x7f];
+    return e->mapped ? e : NULL;
+}
 
-static int msgqid_out;
-static int msgqid_in;
+/* Whether an event is sent to the application handling the port whose
+   subscriptions are subs, all are if subs is NULL */
+static int
+subscribed(const subs_shared *subs, const jack_midi_data_t *buf, size_t size)
+{
+    if (!subs || !__atomic_load_n(&subs->published,__ATOMIC_ACQUIRE)
+            || (size == 0)) {
+        return 1;
+    }
+    return (subs->mask[buf[0] >> 3] >> (buf[0] & 7)) & 1;
+}
 
-struct __attribute__ ((__packed__)) msgq_midimsg {
+/* A message queue message holds up to MSGQ_BATCH_NMSGS midimsgs, the number
+   sent is determined by the size of the message. midimsg is 8 byte aligned so
+   there is no padding after mtype. */
+struct msgq_midimsg {
     long mtype;
-    midimsg msg;
+    midimsg msgs[MSGQ_BATCH_NMSGS];
 };
 typedef struct msgq_midimsg msgq_midimsg;
 
+/* Most input ports */
+#define MAX_PORTS 16
+/* Difference between the keys of consecutive input ports, so port 1 uses 133
+   and 134 for its events, 135 for its subscriptions and 136 for its mapping
+   tables */
+#define PORT_KEY_STRIDE 10
+
+/* An input port and the channel to the application processing its events:
+   the ringbuffers to and from process(), the threads moving the events
+   between them and the message queues or shared memory rings, and the
+   subscriptions and mapping tables published by that application. */
+typedef struct {
+    jack_port_t *port;
+    /* midimsgs from process() to the output thread */
+    jack_ringbuffer_t *rb;
+    /* midimsgs received from the other application, on their way to
+       process(). Only process() touches the timing wheel and the midimsg
+       cache so it never waits on the input thread. */
+    jack_ringbuffer_t *rb_in;
+    /* mutex for incoming midi events / outgoing messages */
+    pthread_mutex_t msg_thread_lock;
+    pthread_cond_t data_ready;
+    key_t in_key;
+    key_t out_key;
+    int msgqid_out;
+    int msgqid_in;
+    /* Shared memory rings used instead of the message queues if use_shm,
+       they use the same keys. */
+    shmring_t *shmring_out;
+    shmring_t *shmring_in;
+    /* NULL unless -m, see subs_shared */
+    subs_shared *subs;
+    /* NULL unless -a, see maptab_shared */
+    maptab_shared *maps;
+    latency_hist hist_rb_out;
+    latency_hist hist_msgq_in;
+    /* names of the histograms of the ports after the first */
+    char hist_names[2][24];
+    /* output_thread */
+    uint64_t sent;
+    uint64_t send_failed;
+    /* times the shared memory ring was full */
+    uint64_t shmring_full;
+    /* input_thread */
+    uint64_t received;
+    /* times push_to_process waited for room in rb_in */
+    uint64_t rb_in_full;
+    /* push_to_process waits on rb_in_drained while rb_in is full and sets
+       rb_in_waiting, process() signals it once it has read from rb_in */
+    pthread_mutex_t rb_in_lock;
+    pthread_cond_t rb_in_drained;
+    int rb_in_waiting;
+    size_t rb_in_max;
+} proc_port;
+
+static proc_port ports[MAX_PORTS];
+static int nports = 1;
+
 static void
-push_to_output_msgq (midimsg* event)
+push_to_output_msgq (proc_port *p, msgq_midimsg *tosend, size_t nevents)
 {
-    msgq_midimsg tosend;
-    tosend.mtype = 1;
-    tosend.msg = *event;
-    if (msgsnd(msgqid_out,&tosend,sizeof(tosend),0) == -1) {
+    tosend->mtype = MSGQ_MIDIMSG_TYPE;
+    if (stamp_stages) {
+        uint64_t now = latency_hist_now_ns();
+        size_t i;
+        for (i = 0; i < nevents; i++) {
+            midimsg_stage(&tosend->msgs[i],&p->hist_rb_out,now);
+        }
+    }
+    if (msgsnd(p->msgqid_out,tosend,sizeof(midimsg)*nevents,0) == -1) {
         perror("msgsnd");
+        p->send_failed += nevents;
+    } else {
+        p->sent += nevents;
     }
 }
 
+/* Move as many messages as fit from the ringbuffer to the shared memory ring
+   and wake the reader. Messages that don't fit are left in the ringbuffer. */
+static void
+push_to_output_shmring (proc_port *p)
+{
+    jack_ringbuffer_t *rb = p->rb;
+    midimsg msgs[MSGQ_BATCH_NMSGS];
+    /* the stamps of msgs before they are stamped for sending, only those
+       written go in the histogram as the rest are sent again later */
+    uint64_t stamps[MSGQ_BATCH_NMSGS];
+    size_t n, nwritten = 0, i;
+    while ((n = jack_ringbuffer_peek(rb, (char*) msgs, sizeof(msgs))
+                / sizeof(midimsg)) > 0) {
+        uint64_t now = 0;
+        if (stamp_stages) {
+            now = latency_hist_now_ns();
+            for (i = 0; i < n; i++) {
+                stamps[i] = midimsg_stamp_get(&msgs[i]);
+                midimsg_stamp(&msgs[i],now);
+            }
+        }
+        size_t w = shmring_write(p->shmring_out,msgs,n);
+        jack_ringbuffer_read_advance(rb,w*sizeof(midimsg));
+        nwritten += w;
+        p->sent += w;
+        for (i = 0; stamp_stages && (i < w); i++) {
+            if (stamps[i] && (now >= stamps[i])) {
+                latency_hist_add(&p->hist_rb_out,now - stamps[i]);
+            }
+        }
+        if (w < n) {
+            if (debug) { fprintf(stderr,"shared memory ring full\n"); }
+            p->shmring_full++;
+            break;
+        }
+    }
+    if (nwritten && (shmring_notify(p->shmring_out) == -1)) {
+        perror("shmring_notify");
+    }
+}
+
+/* A midimsg waiting in the timing wheel to be output */
+typedef struct {
+    timewheel_node node;
+    midimsg msg;
+} sched_midimsg;
+
 static fastcache_t *out_midimsg_cache;
 
+/* Move the midimsgs the input thread put in the ringbuffer to the timing
+   wheel. If the cache is full the rest stay in the ringbuffer until some
+   scheduled messages have been output. */
+static void
+schedule_received (jack_ringbuffer_t *rb_in, uint64_t now)
+{
+    sched_midimsg *sched;
+    while (jack_ringbuffer_read_space(rb_in) >= sizeof(midimsg)) {
+        if (!(sched = fastcache_alloc(out_midimsg_cache))) {
+            if (debug) { fprintf(stderr,"cache full, incoming msgs wait\n"); }
+            stats.cache_full++;
+            break;
+        }
+        jack_ringbuffer_read(rb_in,(char*)&sched->msg,sizeof(midimsg));
+        if (stamp_stages) { midimsg_stage(&sched->msg,&hist_rb_in,now); }
+        sched->node.time = sched->msg.tme_mon;
+        timewheel_insert(outevwheel,&sched->node);
+    }
+}
+
+/* Most events of a period that are considered for coalescing */
+#define COALESCE_NEVENTS RBSIZE
+
+/* coalesce_seen[key] == coalesce_gen if an event with key was seen in the
+   current period, so nothing has to be cleared between periods */
+static uint32_t coalesce_seen[COALESCE_NKEYS];
+static uint32_t coalesce_gen = 0;
+/* Set by coalesce_period for the events to leave out */
+static uint8_t coalesce_drop[COALESCE_NEVENTS];
+
+/* Mark in coalesce_drop the ControlChange events of the period followed by
+   one for the same channel and controller, and the PitchBend events followed
+   by one on the same channel, so only the latest value of each is sent.
+   Controllers that aren't continuous values are left alone, see
+   coalesce_key.
+   Events that aren't subscribed to in subs are output as they are. */
+static void
+coalesce_period(const subs_shared *subs, void *buffer, jack_nframes_t n)
+{
+    jack_nframes_t i;
+    if (++coalesce_gen == 0) {
+        memset(coalesce_seen,0,sizeof(coalesce_seen));
+        coalesce_gen = 1;
+    }
+    n = MIN(n,COALESCE_NEVENTS);
+    for (i = n; i-- > 0; ) {
+        jack_midi_event_t event;
+        int key;
+        coalesce_drop[i] = 0;
+        if ((jack_midi_event_get(&event,buffer,i) != 0)
+                || ((key = coalesce_key(event.buffer,event.size)) < 0)
+                || !subscribed(subs,event.buffer,event.size)
+                || map_entry(event.buffer,event.size)) {
+            continue;
+        }
+        if (coalesce_seen[key] == coalesce_gen) {
+            coalesce_drop[i] = 1;
+        } else {
+            coalesce_seen[key] = coalesce_gen;
+        }
+    }
+}
+
+/* Schedule an incoming event to be output at its own time in this period,
+   through the timing wheel so it is filtered and ordered with the events from
+   the other application. Returns -1 if it can't be scheduled. */
+static int
+forward_event(const jack_midi_event_t *event, uint64_t tme_mon)
+{
+    sched_midimsg *sched;
+    if ((event->size > MIDIMSGBUFSIZE)
+            || !(sched = fastcache_alloc(out_midimsg_cache))) {
+        return -1;
+    }
+    memset(&sched->msg,0,sizeof(midimsg));
+    sched->msg.size = event->size;
+    sched->msg.tme_mon = tme_mon;
+    memcpy(sched->msg.buffer,event->buffer,event->size);
+    sched->node.time = tme_mon;
+    timewheel_insert(outevwheel,&sched->node);
+    stats.forwarded++;
+    return 0;
+}
+
+/* Schedule the events an input event at tme_mon is mapped to by e. Returns
+   -1, scheduling none, if the cache hasn't room for them all. */
+static int
+map_event(const maptab_entry *e, const jack_midi_event_t *event,
+        uint64_t tme_mon)
+{
+    uint8_t data2 = event->size >= 3 ? event->buffer[2] & 0x7f : 0;
+    uint32_t i;
+    if ((e->first + e->n > MAPTAB_NOUTS)
+            || (fastcache_nfree(out_midimsg_cache) < e->n)) {
+        return -1;
+    }
+    for (i = 0; i < e->n; i++) {
+        const maptab_out *o = &maptab_cur->outs[e->first + i];
+        sched_midimsg *sched = fastcache_alloc(out_midimsg_cache);
+        uint8_t type = o->type ? o->type & 0xf0 : event->buffer[0] & 0xf0;
+        uint8_t chan = o->chan == MAPTAB_KEEP ? event->buffer[0] & 0x0f
+            : o->chan & 0x0f;
+        memset(&sched->msg,0,sizeof(midimsg));
+        sched->msg.buffer[0] = type | chan;
+        sched->msg.buffer[1] = o->data1 & 0x7f;
+        sched->msg.buffer[2] =
+            maptab_cur->curves[o->curve % MAPTAB_NCURVES][data2] & 0x7f;
+        sched->msg.size = ((type == 0xc0) || (type == 0xd0)) ? 2 : 3;
+        sched->msg.tme_mon = tme_mon + o->delay;
+        sched->node.time = sched->msg.tme_mon;
+        timewheel_insert(outevwheel,&sched->node);
+    }
+    stats.mapped++;
+    return 0;
+}
+
 typedef enum {
     /* Filter out repeated note ons */
     midi_filter_flag_NOTEONS = (1 << 0),
@@ -173,110 +608,211 @@ midi_ev_filter_should_play(midi_ev_filter_t *ef,
 
 midi_ev_filter_t midi_ev_filt;
 
-int
-process (jack_nframes_t frames, void* arg)
+/* Copy the events of all the input ports to the output port, merged in time
+   order as JACK needs them reserved in order. */
+static void
+passthrough_ports (jack_nframes_t frames, void *midioutbuf)
 {
-    /* The count at the beginning of the frame, we need this to calculate the
-       offsets into the frame of the outgoing MIDI messages. */
-    uint64_t monotonic_cnt_beg_frame = monotonic_cnt;
-    jack_nframes_t _frames;
-	void *buffer, *midioutbuf;
+    void *bufs[MAX_PORTS];
+    uint32_t next[MAX_PORTS], counts[MAX_PORTS];
+    int pi;
+    for (pi = 0; pi < nports; pi++) {
+        bufs[pi] = jack_port_get_buffer(ports[pi].port, frames);
+        counts[pi] = jack_midi_get_event_count(bufs[pi]);
+        next[pi] = 0;
+    }
+    while (1) {
+        jack_midi_event_t event, ev;
+        int first = -1;
+        /* the port with the earliest next event */
+        for (pi = 0; pi < nports; pi++) {
+            /* events that can't be read are dropped */
+            while ((next[pi] < counts[pi])
+                    && (jack_midi_event_get(&ev,bufs[pi],next[pi]) != 0)) {
+                next[pi]++;
+            }
+            if ((next[pi] < counts[pi])
+                    && ((first < 0) || (ev.time < event.time))) {
+                event = ev;
+                first = pi;
+            }
+        }
+        if (first < 0) { break; }
+        next[first]++;
+        unsigned char *midimsgbuf = 
+            jack_midi_event_reserve(midioutbuf, event.time, 
+                    event.size);
+        if (midimsgbuf) {
+            memcpy(midimsgbuf,event.buffer,event.size);
+        } else {
+            if (debug) { fprintf(stderr,"midi_proc_jack: MIDI msg dropped\n"); }
+        }
+    }
+}
+
+/* Pass the events of input port p in this period, which starts at
+   monotonic_cnt_beg_frame, to its output thread, or map or forward them. now
+   is the time they are stamped with, see midimsg_stage. */
+static void
+receive_port (proc_port *p, jack_nframes_t frames,
+        uint64_t monotonic_cnt_beg_frame, uint64_t now)
+{
+	void *buffer;
 	jack_nframes_t N;
 	jack_nframes_t i;
 
-	buffer = jack_port_get_buffer (port, frames);
-    midioutbuf = jack_port_get_buffer(output_port, frames);
-	jack_midi_clear_buffer(midioutbuf);
+	buffer = jack_port_get_buffer (p->port, frames);
 	assert (buffer);
 
     /* We assume events returned sorted by their order in time, which seems
        to be true if you check out the midi_dump.c example. */
 	N = jack_midi_get_event_count (buffer);
 
-    if (passthrough) {
-        if (debug) { fprintf(stderr,"passing through\n"); }
-        for (i = 0; i < N; ++i) {
-            jack_midi_event_t event;
-            int r;
-
-            r = jack_midi_event_get (&event, buffer, i);
-
-            unsigned char *midimsgbuf = 
-                jack_midi_event_reserve(midioutbuf, event.time, 
-                        event.size);
-            if (r == 0 && midimsgbuf) {
-                memcpy(midimsgbuf,event.buffer,event.size);
-            } else {
-                if (debug) { fprintf(stderr,"midi_proc_jack: MIDI msg dropped\n"); }
-            }
+    maptab_cur = NULL;
+    if (p->maps) {
+        /* Publish the table used before using it and check it is still the
+           active one, so an upload that switched active in between waits for
+           this period instead of writing the table just picked */
+        uint32_t active = __atomic_load_n(&p->maps->active,__ATOMIC_SEQ_CST);
+        uint32_t again;
+        while (1) {
+            __atomic_store_n(&p->maps->seen,(active & 1) | MAPTAB_SEEN_USED,
+                    __ATOMIC_SEQ_CST);
+            again = __atomic_load_n(&p->maps->active,__ATOMIC_SEQ_CST);
+            if (again == active) { break; }
+            active = again;
         }
-        return 0;
+        maptab_cur = &p->maps->tables[active & 1];
     }
-    _frames = frames;
+    if (coalesce) { coalesce_period(p->subs,buffer,N); }
 	for (i = 0; i < N; ++i) {
 		jack_midi_event_t event;
+		const maptab_entry *e;
 		int r;
 
-		r = jack_midi_event_get (&event, buffer, i);
+        if (coalesce && (i < COALESCE_NEVENTS) && coalesce_drop[i]) {
+            stats.jack_in++;
+            stats.coalesced++;
+            continue;
+        }
 
-		if (r == 0 && jack_ringbuffer_write_space (rb) >= sizeof(midimsg)) {
-			midimsg m;
-			m.tme_mon = monotonic_cnt;
-			m.size    = event.size;
-			memcpy (m.buffer, event.buffer, MAX(sizeof(m.buffer), event.size));
-			jack_ringbuffer_write (rb, (void *) &m, sizeof(midimsg));
-            monotonic_cnt += event.time;
-            _frames = event.time > _frames ? 0 : _frames - event.time;
+		r = jack_midi_event_get (&event, buffer, i);
 
+        if ((r == 0) && (e = map_entry(event.buffer,event.size))
+                && (map_event(e,&event,
+                        monotonic_cnt_beg_frame + event.time) == 0)) {
+            stats.jack_in++;
+            continue;
+        }
+        if ((r == 0) && !subscribed(p->subs,event.buffer,event.size)
+                && (forward_event(&event,
+                        monotonic_cnt_beg_frame + event.time) == 0)) {
+            stats.jack_in++;
+            continue;
+        }
+		if (r == 0 && jack_ringbuffer_write_space (p->rb) >= sizeof(midimsg)) {
+            /* zeroed so the bytes after the MIDI data hold no stamp */
+			midimsg m = { .size = event.size };
+            /* event.time is the offset of the event in this period */
+			m.tme_mon = monotonic_cnt_beg_frame + event.time;
+			memcpy (m.buffer, event.buffer, MIN(sizeof(m.buffer), event.size));
+            if (stamp_stages) { midimsg_stamp(&m,now); }
+			jack_ringbuffer_write (p->rb, (void *) &m, sizeof(midimsg));
+            stats.jack_in++;
+		} else if (r == 0) {
+            stats.rb_full++;
 		}
 	}
+    stats.rb_max = MAX(stats.rb_max,
+            jack_ringbuffer_read_space(p->rb) / sizeof(midimsg));
+}
 
-	monotonic_cnt += _frames;
+int
+process (jack_nframes_t frames, void* arg)
+{
+    /* The count at the beginning of the frame, we need this to calculate the
+       offsets into the frame of the outgoing MIDI messages. */
+    uint64_t monotonic_cnt_beg_frame = monotonic_cnt;
+	void *midioutbuf;
+	int pi;
+    /* the time stamped on the events, see midimsg_stage */
+    uint64_t now = stamp_stages ? latency_hist_now_ns() : 0;
 
-	if (pthread_mutex_trylock (&msg_thread_lock) == 0) {
-		pthread_cond_signal (&data_ready);
-		pthread_mutex_unlock (&msg_thread_lock);
-	}
+    midioutbuf = jack_port_get_buffer(output_port, frames);
+	jack_midi_clear_buffer(midioutbuf);
 
-    if (pthread_mutex_trylock (&heap_lock) == 0) {
-        midimsg *soonestmsg = NULL;
-        if (debug) { fprintf(stderr,"Heap size: %zu\n",Heap_size(outevheap)); }
-        if (debug) { fprintf(stderr,"current time, frame start: %lu frame end: %lu\n",monotonic_cnt_beg_frame,monotonic_cnt); }
-        while ((Heap_top(outevheap,(void**)&soonestmsg) == HEAP_ENONE)
-                && (soonestmsg != NULL) 
-                && (soonestmsg->tme_mon < monotonic_cnt)) {
-            if (debug) { fprintf(stderr,"message address: %p\n",(void*)soonestmsg); }
-            unsigned char *midimsgbuf = NULL;
-            jack_nframes_t currel;
-            /* message can maybe get sent, it is time, first filter repeated note ons and note offs. */
-            int shouldplay = 0;
-            if ((shouldplay = midi_ev_filter_should_play(&midi_ev_filt,soonestmsg->buffer))) {
-                currel = soonestmsg->tme_mon >= monotonic_cnt_beg_frame ?
-                    soonestmsg->tme_mon - monotonic_cnt_beg_frame : 0;
-                midimsgbuf = 
-                    jack_midi_event_reserve(midioutbuf, currel, 
-                            soonestmsg->size);
-            }
-            if (midimsgbuf) {
-                if (debug) { fprintf(stderr,"play MIDI msg, time: %lu status: %#x ",soonestmsg->tme_mon,soonestmsg->buffer[0]);
-                    int i;
-                    for (i = 1; i < soonestmsg->size; i++) { fprintf(stderr,"%d ",soonestmsg->buffer[i]); }
-                    fprintf(stderr,"\n");
-                }
-                memcpy(midimsgbuf,soonestmsg->buffer,soonestmsg->size);
-            } else {
-                if (shouldplay) {
-                    if (debug) { fprintf(stderr,"Returned NULL when requesting MIDI event of size %u at time %u, MIDI msg not sent\n",
-                            soonestmsg->size,currel); }
-                }
+    if (passthrough) {
+        if (debug) { fprintf(stderr,"passing through\n"); }
+        passthrough_ports(frames,midioutbuf);
+        return 0;
+    }
+    for (pi = 0; pi < nports; pi++) {
+        receive_port(&ports[pi],frames,monotonic_cnt_beg_frame,now);
+    }
+
+	monotonic_cnt += frames;
+
+    for (pi = 0; pi < nports; pi++) {
+        if (pthread_mutex_trylock (&ports[pi].msg_thread_lock) == 0) {
+            pthread_cond_signal (&ports[pi].data_ready);
+            pthread_mutex_unlock (&ports[pi].msg_thread_lock);
+        }
+    }
+
+    /* the events sent back for all the ports go in the one timing wheel, so
+       they are output in time order */
+    for (pi = 0; pi < nports; pi++) {
+        schedule_received(ports[pi].rb_in,now);
+        if (__atomic_load_n(&ports[pi].rb_in_waiting,__ATOMIC_ACQUIRE)
+                && (pthread_mutex_trylock (&ports[pi].rb_in_lock) == 0)) {
+            pthread_cond_signal (&ports[pi].rb_in_drained);
+            pthread_mutex_unlock (&ports[pi].rb_in_lock);
+        }
+    }
+    stats.wheel_max = MAX(stats.wheel_max,timewheel_size(outevwheel));
+    if (debug) { fprintf(stderr,"Scheduled messages: %zu\n",timewheel_size(outevwheel)); }
+    if (debug) { fprintf(stderr,"current time, frame start: %lu frame end: %lu\n",monotonic_cnt_beg_frame,monotonic_cnt); }
+    /* the messages due in this frame, sorted by time */
+    timewheel_node *due = timewheel_advance(outevwheel,monotonic_cnt);
+    while (due) {
+        sched_midimsg *sched = (sched_midimsg*)due;
+        midimsg *soonestmsg = &sched->msg;
+        due = due->next;
+        if (debug) { fprintf(stderr,"message address: %p\n",(void*)soonestmsg); }
+        unsigned char *midimsgbuf = NULL;
+        jack_nframes_t currel;
+        /* message can maybe get sent, it is time, first filter repeated note ons and note offs. */
+        int shouldplay = 0;
+        if ((shouldplay = midi_ev_filter_should_play(&midi_ev_filt,soonestmsg->buffer))) {
+            currel = soonestmsg->tme_mon >= monotonic_cnt_beg_frame ?
+                soonestmsg->tme_mon - monotonic_cnt_beg_frame : 0;
+            if (soonestmsg->tme_mon < monotonic_cnt_beg_frame) {
+                stats.late++;
             }
-            Heap_pop(outevheap,(void**)&soonestmsg);
-            fastcache_free(out_midimsg_cache,soonestmsg);
+            midimsgbuf = 
+                jack_midi_event_reserve(midioutbuf, currel, 
+                        soonestmsg->size);
         }
-        if (soonestmsg) {
-            if (debug) { fprintf(stderr,"Soonest message at time %lu\n",soonestmsg->tme_mon); }
+        if (midimsgbuf) {
+            if (debug) { fprintf(stderr,"play MIDI msg, time: %lu status: %#x ",soonestmsg->tme_mon,soonestmsg->buffer[0]);
+                int i;
+                for (i = 1; i < soonestmsg->size; i++) { fprintf(stderr,"%d ",soonestmsg->buffer[i]); }
+                fprintf(stderr,"\n");
+            }
+            memcpy(midimsgbuf,soonestmsg->buffer,soonestmsg->size);
+            stats.jack_out++;
+            if (stamp_stages) {
+                uint64_t t = midimsg_stamp_get(soonestmsg);
+                if (t && (now >= t)) { latency_hist_add(&hist_wheel,now - t); }
+            }
+        } else if (!shouldplay) {
+            stats.filtered++;
+        } else {
+            stats.reserve_failed++;
+            if (debug) { fprintf(stderr,"Returned NULL when requesting MIDI event of size %u at time %u, MIDI msg not sent\n",
+                    soonestmsg->size,currel); }
         }
-        pthread_mutex_unlock(&heap_lock);
+        fastcache_free(out_midimsg_cache,sched);
     }
 
 	return 0;
@@ -287,7 +823,7 @@ process (jack_nframes_t frames, void* arg)
 typedef struct {
     pthread_mutex_t *msg_thread_lock;
     int *keeprunning;
-    jack_ringbuffer_t *rb;
+    proc_port *port;
     pthread_cond_t *data_ready;
 } outthread_data;
 
@@ -299,13 +835,20 @@ output_thread(void *aux)
 
     if (debug) { fprintf(stderr,"output thread running\n"); }
     while (*thread_data->keeprunning) {
-        const int mqlen = jack_ringbuffer_read_space (thread_data->rb) / sizeof(midimsg);
-        int i;
-        for (i=0; i < mqlen; ++i) {
-            midimsg m;
-            jack_ringbuffer_read(thread_data->rb, (char*) &m, sizeof(midimsg));
-
-            push_to_output_msgq(&m);
+        proc_port *p = thread_data->port;
+        int mqlen = jack_ringbuffer_read_space (p->rb) / sizeof(midimsg);
+        if (use_shm) {
+            push_to_output_shmring(p);
+            mqlen = 0;
+        }
+        /* send the waiting messages in as few msgsnd calls as possible */
+        while (mqlen > 0) {
+            msgq_midimsg tosend;
+            int n = mqlen < MSGQ_BATCH_NMSGS ? mqlen : MSGQ_BATCH_NMSGS;
+            jack_ringbuffer_read(p->rb, (char*) tosend.msgs,
+                    sizeof(midimsg)*n);
+            push_to_output_msgq(p,&tosend,n);
+            mqlen -= n;
             //fprintf(stderr,"message sent\n");
         }
         fflush (stdout);
@@ -320,67 +863,314 @@ output_thread(void *aux)
 
 typedef struct {
     int *keeprunning;
-    int msgqid_in;
-    pthread_mutex_t *heap_lock;
-    Heap *outevheap;
+    proc_port *port;
 } inthread_data;
 
+/* Pass n messages received from the other application to process(), waiting
+   while the ringbuffer is full */
+static void
+push_to_process(inthread_data *thread_data, midimsg *msgs, size_t n)
+{
+    proc_port *p = thread_data->port;
+    size_t space, queued = 0;
+    int pi;
+    /* process() can't allocate memory, so grow the midimsg cache here if it
+       wouldn't have room for these and the messages still in the ringbuffers
+       of all the ports */
+    for (pi = 0; pi < nports; pi++) {
+        queued += jack_ringbuffer_read_space(ports[pi].rb_in) / sizeof(midimsg);
+    }
+    while (fastcache_nfree(out_midimsg_cache) < queued + n) {
+        if (fastcache_grow(out_midimsg_cache,CACHE_NOBJS)) {
+            fprintf(stderr,"could not grow midimsg cache\n");
+            break;
+        }
+        /* the input threads of all the ports may grow it */
+        __atomic_add_fetch(&stats.cache_grown,CACHE_NOBJS,__ATOMIC_RELAXED);
+        if (debug) { fprintf(stderr,"grew midimsg cache\n"); }
+    }
+    if (stamp_stages) {
+        uint64_t now = latency_hist_now_ns();
+        size_t i;
+        for (i = 0; i < n; i++) {
+            uint64_t t = midimsg_stamp_get(&msgs[i]);
+            if ((t & MIDIMSG_STAMP_PY) && (now >= t)) {
+                latency_hist_add(&p->hist_msgq_in,now - t);
+            }
+            midimsg_stamp(&msgs[i],now);
+        }
+    }
+    p->received += n;
+    while ((n > 0) && *thread_data->keeprunning) {
+        space = jack_ringbuffer_write_space(p->rb_in) / sizeof(midimsg);
+        if (space == 0) {
+            /* process() empties it every period. A signal it sends while
+               the lock is held here is missed, the next period's isn't. */
+            p->rb_in_full++;
+            pthread_mutex_lock(&p->rb_in_lock);
+            __atomic_store_n(&p->rb_in_waiting,1,__ATOMIC_RELEASE);
+            while ((jack_ringbuffer_write_space(p->rb_in) < sizeof(midimsg))
+                    && *thread_data->keeprunning) {
+                pthread_cond_wait(&p->rb_in_drained,&p->rb_in_lock);
+            }
+            __atomic_store_n(&p->rb_in_waiting,0,__ATOMIC_RELEASE);
+            pthread_mutex_unlock(&p->rb_in_lock);
+            continue;
+        }
+        if (space > n) { space = n; }
+        jack_ringbuffer_write(p->rb_in,(char*)msgs,
+                space*sizeof(midimsg));
+        msgs += space;
+        n -= space;
+        p->rb_in_max = MAX(p->rb_in_max,
+                jack_ringbuffer_read_space(p->rb_in) / sizeof(midimsg));
+    }
+}
+
 static void *
 input_thread(void *aux)
 {
     inthread_data *thread_data = aux;
+    proc_port *p = thread_data->port;
     msgq_midimsg just_recvd;
     if (debug) { fprintf(stderr,"input thread running\n"); }
     while (*thread_data->keeprunning) {
+        if (use_shm) {
+            size_t n;
+            /* wait until woken by the writer, then read everything */
+            if (shmring_wait(p->shmring_in) < 0) {
+                if (errno == EINTR) { continue; }
+                perror("shmring_wait");
+                *thread_data->keeprunning = 0;
+                break;
+            }
+            while ((n = shmring_read(p->shmring_in,just_recvd.msgs,
+                            MSGQ_BATCH_NMSGS)) > 0) {
+                push_to_process(thread_data,just_recvd.msgs,n);
+            }
+            continue;
+        }
+        ssize_t nbytes;
         /* msgrcv waits for messages on Message Queue */
-        if (msgrcv(thread_data->msgqid_in, &just_recvd,
-                    sizeof(msgq_midimsg), MSGQ_MIDIMSG_TYPE, 0) < 0) {
+        if ((nbytes = msgrcv(p->msgqid_in, &just_recvd,
+                    sizeof(just_recvd.msgs), MSGQ_MIDIMSG_TYPE, 0)) < 0) {
             perror("msgrcv");
             *thread_data->keeprunning = 0;
             break;
         }
         //fprintf(stderr,"message received\n");
-        /* once one is obtained, push to heap */
-        pthread_mutex_lock(thread_data->heap_lock);
-        midimsg *mmsg_topush = fastcache_alloc(out_midimsg_cache);
-        if (!mmsg_topush) {
-            fprintf(stderr,"cache full, incoming msg dropped\n");
-            pthread_mutex_unlock(thread_data->heap_lock);
-            continue;
-        }
-        *mmsg_topush = just_recvd.msg;
-        if (Heap_push(thread_data->outevheap,mmsg_topush) 
-                != HEAP_ENONE) {
-            fprintf(stderr,"heap push failed, incoming msg dropped, heap full?\n");
-            fastcache_free(out_midimsg_cache,mmsg_topush);
-        }
-        if (debug) { fprintf(stderr,"Pushed message to heap.\n"); }
-        pthread_mutex_unlock(thread_data->heap_lock);
+        /* once obtained, schedule all the messages */
+        push_to_process(thread_data,just_recvd.msgs,nbytes / sizeof(midimsg));
     }
     if (debug) { fprintf(stderr,"input thread stopping\n"); }
     return thread_data;
 }
 
-/* Comparison function for sorting the midi message heap */
-static int
-mmsg_cmp(void *_a, void *_b)
+static void
+stopsig(int sn)
 {
-    midimsg *a = _a;
-    midimsg *b = _b;
-    return a->tme_mon >= b->tme_mon;
+    keeprunning = 0;
 }
 
-/* heap doesn't need to know the index */
 static void
-set_idx_ignore(void *a, size_t idx)
+dumpsig(int sn)
 {
-    return;
+    dump_stats = 1;
+}
+
+/* Number of messages waiting in message queue msqid, -1 if unknown */
+static long
+msgq_depth(int msqid)
+{
+    struct msqid_ds ds;
+    if (msgctl(msqid,IPC_STAT,&ds) == -1) { return -1; }
+    return ds.msg_qnum;
 }
 
 static void
-stopsig(int sn)
+print_stats(FILE *f)
 {
-    keeprunning = 0;
+    uint64_t sent = 0, received = 0, send_failed = 0, shmring_full = 0,
+             rb_in_full = 0;
+    size_t rb = 0, rb_in = 0, rb_in_max = 0;
+    int pi;
+    for (pi = 0; pi < nports; pi++) {
+        proc_port *p = &ports[pi];
+        sent += p->sent;
+        received += p->received;
+        send_failed += p->send_failed;
+        shmring_full += p->shmring_full;
+        rb_in_full += p->rb_in_full;
+        rb += jack_ringbuffer_read_space(p->rb) / sizeof(midimsg);
+        rb_in += jack_ringbuffer_read_space(p->rb_in) / sizeof(midimsg);
+        rb_in_max = MAX(rb_in_max,p->rb_in_max);
+    }
+    fprintf(f,"events: jack in %" PRIu64 " mapped %" PRIu64 " forwarded %"
+            PRIu64 " coalesced %" PRIu64 " sent %" PRIu64 " received %" PRIu64
+            " jack out %" PRIu64 "\n",stats.jack_in,stats.mapped,
+            stats.forwarded,stats.coalesced,sent,received,stats.jack_out);
+    fprintf(f,"drops: rb full %" PRIu64 " send failed %" PRIu64
+            " reserve failed %" PRIu64 " filtered %" PRIu64 " late %" PRIu64
+            "\n",stats.rb_full,send_failed,stats.reserve_failed,
+            stats.filtered,stats.late);
+    fprintf(f,"waits: shmring full %" PRIu64 " rb_in full %" PRIu64
+            " cache full %" PRIu64 " cache grown by %" PRIu64 "\n",
+            shmring_full,rb_in_full,stats.cache_full,stats.cache_grown);
+    fprintf(f,"depth: rb %zu (max %zu) rb_in %zu (max %zu) wheel %zu (max %zu)"
+            " cache free %zu",rb,stats.rb_max,rb_in,rb_in_max,
+            timewheel_size(outevwheel),stats.wheel_max,
+            fastcache_nfree(out_midimsg_cache));
+    if (!use_shm && (nports == 1)) {
+        fprintf(f," msgq out %ld msgq in %ld",msgq_depth(ports[0].msgqid_out),
+                msgq_depth(ports[0].msgqid_in));
+    }
+    fprintf(f,"\n");
+    /* the totals above are summed over these */
+    for (pi = 0; (nports > 1) && (pi < nports); pi++) {
+        proc_port *p = &ports[pi];
+        fprintf(f,"port %d: sent %" PRIu64 " received %" PRIu64 " rb %zu"
+                " rb_in %zu (max %zu)",pi,p->sent,p->received,
+                jack_ringbuffer_read_space(p->rb) / sizeof(midimsg),
+                jack_ringbuffer_read_space(p->rb_in) / sizeof(midimsg),
+                p->rb_in_max);
+        if (!use_shm) {
+            fprintf(f," msgq out %ld msgq in %ld",msgq_depth(p->msgqid_out),
+                    msgq_depth(p->msgqid_in));
+        }
+        fprintf(f,"\n");
+    }
+    if (stamp_stages) {
+        for (pi = 0; pi < nports; pi++) {
+            latency_hist_print(&ports[pi].hist_rb_out,f);
+            latency_hist_print(&ports[pi].hist_msgq_in,f);
+        }
+        latency_hist_print(&hist_rb_in,f);
+        latency_hist_print(&hist_wheel,f);
+    }
+    fflush(f);
+}
+
+/* Open the channel of input port pi to the other application and register
+   the port, exits on error */
+static void
+port_open (jack_client_t *client, int pi)
+{
+    proc_port *p = &ports[pi];
+    char name[32];
+    key_t off = PORT_KEY_STRIDE * pi;
+
+	p->rb = jack_ringbuffer_create (RBSIZE * sizeof(midimsg));
+	p->rb_in = jack_ringbuffer_create (RBSIZE_IN * sizeof(midimsg));
+    pthread_mutex_init(&p->msg_thread_lock,NULL);
+    pthread_cond_init(&p->data_ready,NULL);
+    pthread_mutex_init(&p->rb_in_lock,NULL);
+    pthread_cond_init(&p->rb_in_drained,NULL);
+
+    /* the first port keeps the name it had when there was only one */
+    if (pi == 0) {
+        snprintf(name,sizeof(name),"input");
+    } else {
+        snprintf(name,sizeof(name),"input_%d",pi);
+    }
+	p->port = jack_port_register (client, name, JACK_DEFAULT_MIDI_TYPE, JackPortIsInput, 0);
+
+	if (p->port == NULL) {
+		fprintf (stderr, "Could not register port %s.\n", name);
+		exit (EXIT_FAILURE);
+	}
+
+    if (pi == 0) {
+        p->hist_rb_out.name = "jack->send";
+        p->hist_msgq_in.name = "recv";
+    } else {
+        snprintf(p->hist_names[0],sizeof(p->hist_names[0]),"jack->send %d",pi);
+        snprintf(p->hist_names[1],sizeof(p->hist_names[1]),"recv %d",pi);
+        p->hist_rb_out.name = p->hist_names[0];
+        p->hist_msgq_in.name = p->hist_names[1];
+    }
+
+    p->out_key = out_key + off;
+    p->in_key = in_key + off;
+
+    p->msgqid_out = msgget(p->out_key,0666|IPC_CREAT);
+    if (p->msgqid_out == -1) {
+        perror("msgget out");
+    }
+
+    p->msgqid_in = msgget(p->in_key,0666|IPC_CREAT);
+    if (p->msgqid_in == -1) {
+        perror("msgget in");
+    }
+
+    if (use_shm) {
+        p->shmring_out = shmring_attach(p->out_key,SHMRING_NMSGS,sizeof(midimsg));
+        p->shmring_in = shmring_attach(p->in_key,SHMRING_NMSGS,sizeof(midimsg));
+        if (!p->shmring_out || !p->shmring_in) {
+            fprintf(stderr, "Could not attach shared memory rings\n");
+            exit (EXIT_FAILURE);
+        }
+    }
+
+    if (use_subs) {
+        int shmid = shmget(subs_key + off,sizeof(subs_shared),0666|IPC_CREAT);
+        if ((shmid == -1)
+                || ((p->subs = shmat(shmid,NULL,0)) == (void*)-1)) {
+            perror("subscriptions shared memory");
+            exit (EXIT_FAILURE);
+        }
+    }
+
+    if (use_maps) {
+        int shmid = shmget(map_key + off,sizeof(maptab_shared),0666|IPC_CREAT);
+        if ((shmid == -1)
+                || ((p->maps = shmat(shmid,NULL,0)) == (void*)-1)) {
+            perror("mapping tables shared memory");
+            exit (EXIT_FAILURE);
+        }
+        /* left set if an earlier run died without closing the port */
+        __atomic_store_n(&p->maps->seen,0,__ATOMIC_RELEASE);
+    }
+}
+
+/* Wake the threads of port p so they see keeprunning is 0. The output thread
+   only releases the lock while it waits so it can't miss the signal. */
+static void
+port_wake (proc_port *p)
+{
+    pthread_mutex_lock(&p->msg_thread_lock);
+    pthread_cond_signal(&p->data_ready);
+    pthread_mutex_unlock(&p->msg_thread_lock);
+    pthread_mutex_lock(&p->rb_in_lock);
+    pthread_cond_signal(&p->rb_in_drained);
+    pthread_mutex_unlock(&p->rb_in_lock);
+    if (use_shm) {
+        shmring_notify(p->shmring_in);
+    } else {
+        /* an empty message is received as no midimsgs */
+        msgq_midimsg wakeup = { .mtype = MSGQ_MIDIMSG_TYPE };
+        msgsnd(p->msgqid_in,&wakeup,0,IPC_NOWAIT);
+    }
+}
+
+static void
+port_close (proc_port *p)
+{
+	jack_ringbuffer_free (p->rb);
+	jack_ringbuffer_free (p->rb_in);
+    if (use_shm) {
+        shmring_detach(p->shmring_out);
+        shmring_detach(p->shmring_in);
+    }
+    if (p->subs) { shmdt(p->subs); }
+    if (p->maps) {
+        /* nothing to wait for once this port stops reading the tables */
+        __atomic_store_n(&p->maps->seen,0,__ATOMIC_RELEASE);
+        shmdt(p->maps);
+    }
+    pthread_mutex_destroy(&p->msg_thread_lock);
+    pthread_cond_destroy(&p->data_ready);
+    pthread_mutex_destroy(&p->rb_in_lock);
+    pthread_cond_destroy(&p->rb_in_drained);
 }
 
 /* TODO: Make better exit on error that cleans up. */
@@ -396,14 +1186,47 @@ main (int argc, char* argv[])
 	char const default_name[] = "midi_proc_jack";
 	char const * client_name;
 	int r;
+	int pi;
 
 	int cn = 1;
 
-	if (argc > 1) {
-		if (!strcmp (argv[1], "-p")) {
+    /* -p passes MIDI through untouched
+       -s exchanges messages through shared memory rings instead of message
+          queues
+       -t stamps the events to measure the latency of each stage, printed
+          with the other stats on SIGUSR1
+       -m sends only the events the other application subscribed to and
+          outputs the rest straight away, see subs_shared
+       -c sends only the last ControlChange for each controller and the last
+          PitchBend of each channel received in a period
+       -a applies the mapping tables uploaded by midi_map.py, see
+          maptab_shared
+       -n N registers N input ports, input, input_1 ... input_N-1, each with
+          its own keys, see PORT_KEY_STRIDE */
+	while ((argc > cn) && (argv[cn][0] == '-')) {
+		if (!strcmp (argv[cn], "-p")) {
             passthrough = 1;
-            cn = 2; 
+        } else if (!strcmp (argv[cn], "-s")) {
+            use_shm = 1;
+        } else if (!strcmp (argv[cn], "-t")) {
+            stamp_stages = 1;
+        } else if (!strcmp (argv[cn], "-m")) {
+            use_subs = 1;
+        } else if (!strcmp (argv[cn], "-c")) {
+            coalesce = 1;
+        } else if (!strcmp (argv[cn], "-a")) {
+            use_maps = 1;
+        } else if (!strcmp (argv[cn], "-n") && (argc > cn + 1)) {
+            nports = atoi(argv[++cn]);
+            if ((nports < 1) || (nports > MAX_PORTS)) {
+                fprintf (stderr, "Number of ports must be 1 to %d\n", MAX_PORTS);
+                exit (EXIT_FAILURE);
+            }
+        } else {
+            fprintf (stderr, "Unknown option %s\n", argv[cn]);
+            exit (EXIT_FAILURE);
         }
+        cn++;
     }
 
 	if (argc > cn) {
@@ -418,57 +1241,47 @@ main (int argc, char* argv[])
 		exit (EXIT_FAILURE);
 	}
 
-	rb = jack_ringbuffer_create (RBSIZE * sizeof(midimsg));
-
 	jack_set_process_callback (client, process, 0);
 
-	port = jack_port_register (client, "input", JACK_DEFAULT_MIDI_TYPE, JackPortIsInput, 0);
+    for (pi = 0; pi < nports; pi++) {
+        port_open(client,pi);
+    }
 	output_port = jack_port_register (client, "out", JACK_DEFAULT_MIDI_TYPE, JackPortIsOutput, 0);
 
-	if (port == NULL) {
+	if (output_port == NULL) {
 		fprintf (stderr, "Could not register port.\n");
 		exit (EXIT_FAILURE);
 	}
 
-    msgqid_out = msgget(out_key,0666|IPC_CREAT);
-    if (msgqid_out == -1) {
-        perror("msgget out");
-    }
-
-    msgqid_in = msgget(in_key,0666|IPC_CREAT);
-    if (msgqid_in == -1) {
-        perror("msgget in");
-    }
-
-    outevheap = Heap_new(CACHE_NOBJS,
-            mmsg_cmp,
-            set_idx_ignore);
+    /* one tick of the timing wheel per JACK period */
+    outevwheel = timewheel_new(jack_get_buffer_size(client),monotonic_cnt);
 
-    if (!outevheap) {
-        fprintf(stderr, "Could not allocate heap\n");
+    if (!outevwheel) {
+        fprintf(stderr, "Could not allocate timing wheel\n");
         exit (EXIT_FAILURE);
     }
 
-    out_midimsg_cache = fastcache_new(sizeof(midimsg),CACHE_NOBJS);
+    out_midimsg_cache = fastcache_new(sizeof(sched_midimsg),CACHE_NOBJS);
 
     if (!out_midimsg_cache) {
         fprintf(stderr, "Could not allocate midimsg cache\n");
         exit(EXIT_FAILURE);
     }
 
-    outthread_data ot_data = {
-        .msg_thread_lock = &msg_thread_lock,
-        .keeprunning = &keeprunning,
-        .rb = rb,
-        .data_ready = &data_ready,
-    };
-
-    inthread_data it_data = {
-        .keeprunning = &keeprunning,
-        .msgqid_in = msgqid_in,
-        .heap_lock = &heap_lock,
-        .outevheap = outevheap,
-    };
+    outthread_data ot_data[MAX_PORTS];
+    inthread_data it_data[MAX_PORTS];
+    for (pi = 0; pi < nports; pi++) {
+        ot_data[pi] = (outthread_data) {
+            .msg_thread_lock = &ports[pi].msg_thread_lock,
+            .keeprunning = &keeprunning,
+            .port = &ports[pi],
+            .data_ready = &ports[pi].data_ready,
+        };
+        it_data[pi] = (inthread_data) {
+            .keeprunning = &keeprunning,
+            .port = &ports[pi],
+        };
+    }
 
     /* I would reckon only filtering note offs is the most common configuration */
     midi_ev_filter_init(&midi_ev_filt,midi_filter_flag_NOTEOFFS);
@@ -479,27 +1292,48 @@ main (int argc, char* argv[])
 		exit (EXIT_FAILURE);
 	}
 
-    pthread_t midi_to_msgq;
-    pthread_t msgq_to_midi;
+    pthread_t midi_to_msgq[MAX_PORTS];
+    pthread_t msgq_to_midi[MAX_PORTS];
     
     signal(SIGINT,stopsig);
+    signal(SIGUSR1,dumpsig);
 
-    if (pthread_create(&midi_to_msgq,NULL,output_thread,&ot_data)) {
-        perror("pthread create midi_to_msgq");
-        exit (EXIT_FAILURE);
+    for (pi = 0; pi < nports; pi++) {
+        if (pthread_create(&midi_to_msgq[pi],NULL,output_thread,&ot_data[pi])) {
+            perror("pthread create midi_to_msgq");
+            exit (EXIT_FAILURE);
+        }
+
+        if (pthread_create(&msgq_to_midi[pi],NULL,input_thread,&it_data[pi])) {
+            perror("pthread create msgq_to_midi");
+            exit (EXIT_FAILURE);
+        }
     }
 
-    if (pthread_create(&msgq_to_midi,NULL,input_thread,&it_data)) {
-        perror("pthread create msgq_to_midi");
-        exit (EXIT_FAILURE);
+    /* the sleep is cut short by the signals */
+    while (keeprunning) {
+        if (dump_stats) {
+            dump_stats = 0;
+            print_stats(stderr);
+        }
+        usleep(100000);
+    }
+
+    for (pi = 0; pi < nports; pi++) {
+        port_wake(&ports[pi]);
+    }
+    for (pi = 0; pi < nports; pi++) {
+        pthread_join(midi_to_msgq[pi],NULL);
+        pthread_join(msgq_to_midi[pi],NULL);
     }
-    
-    pthread_join(midi_to_msgq,NULL);
-    pthread_join(msgq_to_midi,NULL);
 
 	jack_deactivate (client);
 	jack_client_close (client);
-	jack_ringbuffer_free (rb);
+    for (pi = 0; pi < nports; pi++) {
+        port_close(&ports[pi]);
+    }
+    timewheel_free(outevwheel);
+    fastcache_destroy(out_midimsg_cache);
 
 	return 0;
 }
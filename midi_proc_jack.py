@@ -1,4 +1,5 @@
 import sysv_ipc as ipc
+import shmring
 import time
 import struct
 import array
@@ -6,11 +7,38 @@ import signal
 import sys
 import threading
 
+# numpy is only needed for EventBatch and batch callbacks
+try:
+    import numpy as np
+except ImportError:
+    np=None
+
 BUFLEN=16
 MSGTYPE=1
+# Message type used to wake a blocked MIDIProcThread, always sorts after
+# MSGTYPE so pending MIDI messages are handled first
+MSGTYPE_WAKEUP=2
 
 head_struct=struct.Struct("l")
 tail_struct=struct.Struct("IQ")
+# A whole midimsg as laid out in midi_proc_jack.c: data buffer followed by tail
+midimsg_struct=struct.Struct("%dsIQ" % (BUFLEN,))
+# Maximum number of midimsgs packed into one queue message, must match
+# MSGQ_BATCH_NMSGS in midi_proc_jack.c
+MSGQ_BATCH_NMSGS=128
+MSGQ_MAX_MESSAGE_SIZE=MSGQ_BATCH_NMSGS*midimsg_struct.size
+# Number of midimsgs held by each shared memory ring, must match SHMRING_NMSGS
+# in midi_proc_jack.c
+SHMRING_NMSGS=1024
+# Key of the shared memory the subscriptions are published in and its layout,
+# must match subs_key and subs_shared in midi_proc_jack.c
+SUBS_KEY=125
+subs_struct=struct.Struct("I32s")
+# midi_proc_jack -n registers several input ports, the keys of port i are those
+# of port 0 plus PORT_KEY_STRIDE*i. Must match PORT_KEY_STRIDE and MAX_PORTS in
+# midi_proc_jack.c
+PORT_KEY_STRIDE=10
+MAX_PORTS=16
 
 out_fmt="""
 buf: %s
@@ -21,9 +49,43 @@ tme_mon: %ull
 
 done = False
 
+# The MIDIProcThreads running, stopped by SIGINT
+_running_threads=set()
+
+# Set to a midi_trace.TraceBuffer (see midi_trace.enable) to record the events
+# received and sent by MIDIProcThread. Tracing is off when None.
+tracer=None
+# Stages at which events are traced
+TRACE_IN=0
+TRACE_OUT=1
+# Set to a midi_stats.Stats (see midi_stats.enable) to count the events
+# processed by MIDIProcThread and measure the latency of each stage. Off when
+# None.
+stats=None
+
+# The shared memory the subscriptions are published in, see
+# enable_subscriptions. None when not published.
+_subs_shm=None
+# Set by midi_map.enable to upload the mapping tables again when the callbacks
+# change. None when they are not uploaded.
+map_uploader=None
+
+def port_key(key,port):
+    """
+    Returns the key input port port of midi_proc_jack -n uses for what port 0
+    uses key for.
+    """
+    if not 0 <= port < MAX_PORTS:
+        raise ValueError('port must be 0 to %d' % (MAX_PORTS-1,))
+    return key+PORT_KEY_STRIDE*port
+
 def setdone(x,y):
     print("Got signal")
     done = True
+    # the signal is handled in the main thread, a MIDIProcThread started
+    # with start() would stay blocked waiting for events
+    for th in list(_running_threads):
+        th.stop()
     sys.exit(0)
 
 signal.signal(signal.SIGINT,setdone)
@@ -83,31 +145,115 @@ def get_midi_event_size(name):
 def _midi_cb_default(mev):
     return [mev]
 
-midi_cbs_chan = {
-        'NoteOff': _midi_cb_default,
-        'NoteOn': _midi_cb_default,
-        'PolyKeyPress': _midi_cb_default,
-        'ControlChange': _midi_cb_default,
-        'ProgramChange': _midi_cb_default,
-        'ChanPress': _midi_cb_default,
-        'PitchBend': _midi_cb_default
-        # Others not yet supported
-}
-midi_cbs=[]
-for i in range(16):
-    midi_cbs.append(midi_cbs_chan.copy())
+# Callback for each status byte, so the callback for an event is found with
+# midi_cbs[status]
+midi_cbs=[_midi_cb_default]*256
+
+def _midi_cb_statuses(chan,name):
+    """
+    Returns the status bytes selected by chan and name. Each can be a single
+    value, a list of values or None meaning all channels or all supported
+    events.
+    """
+    if chan is None:
+        chan=range(16)
+    elif type(chan) == int:
+        chan=[chan]
+    if name is None:
+        name=midi_code_table.keys()
+    elif type(name) == str:
+        name=[name]
+    codes=[get_midi_event_code(n) for n in name]
+    for c in chan:
+        if c < 0 or c > 15:
+            raise ValueError('MIDI channel %d out of range' % (c,))
+    return [code|c for c in chan for code in codes]
+
 def set_midi_cb(chan,name,cb):
     """
-    chan: channel on which to set the callback
-    name: event for which to set the callback
+    chan: channel on which to set the callback, a list of channels or None for
+        all channels
+    name: event for which to set the callback, a list of events or None for all
+        events
     cb: the callback
         should accept a MIDIEvent and return a list of MIDIEvents based on the
         MIDIEvent. This list can be empty, in that case the MIDI event is
         swallowed by the application.
     """
-    midi_cbs[chan][name]=cb
+    for status in _midi_cb_statuses(chan,name):
+        midi_cbs[status]=cb
+    _callbacks_changed()
 def reset_midi_cb(chan,name):
-    midi_cbs[chan][name]=_midi_cb_default
+    set_midi_cb(chan,name,_midi_cb_default)
+
+# Batch callback for each status byte, None if events are handled by midi_cbs
+midi_batch_cbs=[None]*256
+_midi_batch_cbs_set=False
+
+def set_midi_batch_cb(chan,name,cb):
+    """
+    chan, name: select the events as for set_midi_cb
+    cb: the callback
+        should accept an EventBatch holding all the selected events of a batch
+        received by a MIDIProcThread, or of a message when it isn't in batch
+        mode, and return an EventBatch of events to send. Takes precedence
+        over callbacks set with set_midi_cb.
+    """
+    global _midi_batch_cbs_set
+    for status in _midi_cb_statuses(chan,name):
+        midi_batch_cbs[status]=cb
+    _midi_batch_cbs_set=any(cb is not None for cb in midi_batch_cbs)
+    _callbacks_changed()
+def reset_midi_batch_cb(chan,name):
+    set_midi_batch_cb(chan,name,None)
+
+def subscription_mask():
+    """
+    Returns the bitmap of the status bytes that have a callback, bit (s & 7) of
+    byte s >> 3 for status byte s.
+    """
+    mask=bytearray(32)
+    for s in range(256):
+        if midi_cbs[s] is not _midi_cb_default or midi_batch_cbs[s] is not None:
+            mask[s>>3]|=1<<(s&7)
+    return bytes(mask)
+
+def _callbacks_changed():
+    _publish_subscriptions()
+    if map_uploader:
+        map_uploader()
+
+def _publish_subscriptions():
+    if _subs_shm is not None:
+        # the mask before the flag saying it is valid
+        b=subs_struct.pack(1,subscription_mask())
+        _subs_shm.write(b[4:],4)
+        _subs_shm.write(b[:4],0)
+
+def enable_subscriptions(key=SUBS_KEY,port=0):
+    """
+    Publish the events that have callbacks to midi_proc_jack -m, which outputs
+    the others straight away rather than sending them here. set_midi_cb and
+    set_midi_batch_cb keep it up to date from then on, so the callbacks must be
+    set in this process (when using a midi_pool.WorkerPool, before making it).
+    port: the input port of midi_proc_jack -n whose events are handled here
+    """
+    global _subs_shm
+    if _subs_shm is None:
+        _subs_shm=ipc.SharedMemory(port_key(key,port),ipc.IPC_CREAT,
+                size=subs_struct.size)
+    _publish_subscriptions()
+
+def disable_subscriptions():
+    """
+    Have midi_proc_jack send all the events here again.
+    """
+    global _subs_shm
+    if _subs_shm is None:
+        return
+    _subs_shm.write(subs_struct.pack(0,bytes(32)))
+    _subs_shm.detach()
+    _subs_shm=None
 
 def print_midi_from_bytes(b):
     sz=len(b)
@@ -157,7 +303,42 @@ def proc_midi(msg):
         _,dat1,dat2=midi3_struct.unpack(buf[:size])
         dat1,dat2=midi_cbs[chan][kind](dat1,dat2)
 
+# Name and size of the event for each status byte, None and 0 if the event is
+# not supported
+_status_names=[None]*256
+_status_sizes=[0]*256
+for _code,_name in midi_event_table.items():
+    for _chan in range(16):
+        _status_names[_code|_chan]=_name
+        _status_sizes[_code|_chan]=midi_event_size_table[_name]
+
+_pitched_codes=frozenset([0x80,0x90,0xa0])
+_velocity_codes=frozenset([0x80,0x90,0xa0,0xd0])
+
+# The size and time of a midimsg, skipping the data buffer
+_midimsg_tail_struct=struct.Struct("%dxIQ" % (BUFLEN,))
+# A midimsg packed from the bytes of its MIDI data, its size and time, for
+# each size of MIDI data. Packing zeroes the rest of the data buffer.
+_midimsg_pack_structs=[None,None,
+        struct.Struct("BB%dxIQ" % (BUFLEN-2,)),
+        struct.Struct("BBB%dxIQ" % (BUFLEN-3,))]
+
+def format_midi_event(tme_mon,dat):
+    """
+    Returns a description of the MIDI event at time tme_mon with data dat,
+    status byte first.
+    """
+    return "time: %d type: %s chan: %d\n\tdata: %#x %s" % (tme_mon,
+            _status_names[dat[0]],dat[0]&0x0f,dat[0],
+            ' '.join(['%d' % (d,) for d in dat[1:]]))
+
 class MIDIEvent:
+    """
+    A MIDI event. The MIDI data (status byte first) are stored in buf starting
+    at offset off, so events decoded from a batch of midimsgs all refer to the
+    same buffer rather than holding copies of their data.
+    """
+    __slots__=('tme_mon','size','buf','off')
     def __init__(self,tme_mon,typ,chan,dat):
         """
         tme_mon: absolute time in samples
@@ -167,108 +348,344 @@ class MIDIEvent:
              short, array truncated. Status byte written properly with code and
              channel.
         """
-        self.size=get_midi_event_size(typ)
+        code=get_midi_event_code(typ)
+        self.size=_status_sizes[code]
         self.tme_mon=tme_mon
-        self.typ=typ
-        self.chan=chan
-        self.dat = bytearray(self.size)
-        if len(dat) < self.size:
-            self.dat[:len(dat)]=dat
-        elif len(dat) > self.size:
-            self.dat[::1] = dat[:self.size]
-        else:
-            self.dat[::1] = dat
-        self.dat[0] = get_midi_event_code(typ) | chan
+        self.buf=bytearray(dat[:self.size])
+        self.off=0
+        if len(self.buf) < self.size:
+            self.buf.extend(bytes(self.size-len(self.buf)))
+        self.buf[0]=code|(chan&0x0f)
+    @property
+    def typ(self):
+        return _status_names[self.buf[self.off]]
+    @property
+    def chan(self):
+        return self.buf[self.off]&0x0f
+    @chan.setter
+    def chan(self,chan):
+        self.buf[self.off]=(self.buf[self.off]&0xf0)|(chan&0x0f)
+    @property
+    def dat(self):
+        """
+        memoryview of the MIDI data, including the status byte.
+        """
+        return memoryview(self.buf)[self.off:self.off+self.size]
     def copy(self):
-        return MIDIEvent(self.tme_mon,self.typ,self.chan,self.dat)
+        ret=MIDIEvent.__new__(MIDIEvent)
+        ret.tme_mon=self.tme_mon
+        ret.size=self.size
+        ret.buf=bytearray(self.buf[self.off:self.off+self.size])
+        ret.off=0
+        return ret
     def print(self):
-        print("time: %d type: %s chan: %d"%(self.tme_mon,self.typ,self.chan))
-        print('\tdata: ',end='')
-        for i in range(self.size):
-            if (i == 0): print("%#x " % (self.dat[i],),end='')
-            else: print("%d " % (self.dat[i],),end='')
-        print()
+        print(format_midi_event(self.tme_mon,
+            self.buf[self.off:self.off+self.size]))
     def to_bytes(self):
-        ret=bytearray(BUFLEN+tail_struct.size)
-        ret[:self.size]=self.dat
-        ret[-tail_struct.size:]=tail_struct.pack(self.size,int(self.tme_mon))
+        ret=bytearray(midimsg_struct.size)
+        self.pack_into(ret,0)
         return ret
+    def pack_into(self,buf,off):
+        """
+        Write the event as a midimsg into the writable buffer buf at offset
+        off, without allocating memory.
+        """
+        b=self.buf
+        o=self.off
+        if self.size == 3:
+            _midimsg_pack_structs[3].pack_into(buf,off,b[o],b[o+1],b[o+2],3,
+                    int(self.tme_mon))
+        else:
+            _midimsg_pack_structs[2].pack_into(buf,off,b[o],b[o+1],2,
+                    int(self.tme_mon))
     def assert_pitched_type(self):
-        if (self.typ not in ['NoteOn','NoteOff','PolyKeyPress']):
+        if (self.buf[self.off]&0xf0) not in _pitched_codes:
             raise TypeError("Doesn't represent pitched type")
     def assert_velocity_type(self):
-        if (self.typ not in ['NoteOn','NoteOff','PolyKeyPress','ChanPress']):
+        if (self.buf[self.off]&0xf0) not in _velocity_codes:
             raise TypeError("Doesn't represent velocity type")
     def assert_program_change_type(self):
-        if self.typ != 'ProgramChange':
+        if (self.buf[self.off]&0xf0) != 0xc0:
             raise TypeError("Doesn't represent program change type")
     def assert_control_change_type(self):
-        if self.typ != 'ControlChange':
+        if (self.buf[self.off]&0xf0) != 0xb0:
             raise TypeError("Doesn't represent control change type")
     def assert_pitch_bend_type(self):
-        if self.typ != 'PitchBend':
+        if (self.buf[self.off]&0xf0) != 0xe0:
             raise TypeError("Doesn't represent pitch bend type")
     def get_pitch(self):
         self.assert_pitched_type()
-        return self.dat[1]
+        return self.buf[self.off+1]
     def set_pitch(self,p):
         p=int(p)
         self.assert_pitched_type()
-        self.dat[1]=p&0x7f
+        self.buf[self.off+1]=p&0x7f
     def get_velocity(self):
         self.assert_velocity_type()
-        if (self.typ in ['NoteOn','NoteOff','PolyKeyPress']):
-            return self.dat[2]
+        if (self.buf[self.off]&0xf0) in _pitched_codes:
+            return self.buf[self.off+2]
         else:
-            return self.dat[1]
+            return self.buf[self.off+1]
     def set_velocity(self,v):
         v=int(v)
         self.assert_velocity_type()
-        if (self.typ in ['NoteOn','NoteOff','PolyKeyPress']):
-            self.dat[2]=v&0x7f
+        if (self.buf[self.off]&0xf0) in _pitched_codes:
+            self.buf[self.off+2]=v&0x7f
         else:
-            self.dat[1]=v&0x7f
+            self.buf[self.off+1]=v&0x7f
     def get_program(self):
         self.assert_program_change_type()
-        return self.dat[1]
+        return self.buf[self.off+1]
     def set_program(self,p):
         p=int(p)
         self.assert_program_change_type()
-        self.dat[1]=p&0x7f
+        self.buf[self.off+1]=p&0x7f
     def get_cc_num(self):
         self.assert_control_change_type()
-        return self.dat[1]
+        return self.buf[self.off+1]
     def set_cc_num(self,n):
         n=int(n)
         self.assert_control_change_type()
-        self.dat[1]=n&0x7f
+        self.buf[self.off+1]=n&0x7f
     def get_cc_val(self):
         self.assert_control_change_type()
-        return self.dat[2]
+        return self.buf[self.off+2]
     def set_cc_val(self,v):
         v=int(v)
         self.assert_control_change_type()
-        self.dat[2]=v&0x7f
+        self.buf[self.off+2]=v&0x7f
     def get_pitch_bend(self):
         self.assert_pitch_bend_type()
-        return (self.dat[2] << 7) + self.dat[1]
+        return (self.buf[self.off+2] << 7) + self.buf[self.off+1]
     def set_pitch_bend(self,b):
         b=int(b)
         self.assert_pitch_bend_type()
-        self.dat[1] = b&0x7f
-        self.dat[2] = (b>>7)&0x7f
+        self.buf[self.off+1] = b&0x7f
+        self.buf[self.off+2] = (b>>7)&0x7f
 
     def from_bytes(b):
         """
         b: bytes representing c struct packing the data
         """
-        buf=b[:BUFLEN]
-        b=b[BUFLEN:]
-        size,tme_mon=tail_struct.unpack(b[:tail_struct.size])
-        if (size < 1):
-            raise ValueError('bytes must contain valid MIDI message')
-        return MIDIEvent(tme_mon,
-            get_midi_event_name(buf[0]&0xf0),buf[0]&0x0f,buf)
+        return events_from_bytes(memoryview(b)[:midimsg_struct.size])[0]
+
+def events_from_bytes(b):
+    """
+    b: bytes holding one or more packed midimsgs, as received from the message
+       queue. Trailing bytes that don't make up a whole midimsg are ignored.
+    Returns a list of MIDIEvents, decoded in one pass. The events refer to b
+    directly if it is writable, otherwise to a single writable copy of b.
+    """
+    b=memoryview(b)
+    if b.readonly:
+        buf=bytearray(b)
+    else:
+        buf=b
+    mevs=[]
+    off=0
+    with memoryview(buf) as mv:
+        for size,tme_mon in _midimsg_tail_struct.iter_unpack(
+                mv[:len(mv)-(len(mv)%midimsg_struct.size)]):
+            if (size < 1):
+                raise ValueError('bytes must contain valid MIDI message')
+            status=buf[off]
+            mev=MIDIEvent.__new__(MIDIEvent)
+            mev.size=_status_sizes[status]
+            if mev.size == 0:
+                raise KeyError('MIDI code %x not supported' % (status&0xf0,))
+            mev.tme_mon=tme_mon
+            mev.buf=buf
+            mev.off=off
+            mevs.append(mev)
+            off+=midimsg_struct.size
+    return mevs
+
+def events_to_bytes(mevs):
+    """
+    Pack a list of MIDIEvents into one bytearray of consecutive midimsgs.
+    """
+    ret=bytearray(len(mevs)*midimsg_struct.size)
+    events_pack_into(mevs,ret,0)
+    return ret
+
+def events_pack_into(mevs,buf,off):
+    """
+    Pack a list of MIDIEvents as consecutive midimsgs into the writable buffer
+    buf starting at offset off, which must have room for them. Returns the
+    offset after the last one.
+    """
+    step=midimsg_struct.size
+    for m in mevs:
+        m.pack_into(buf,off)
+        off+=step
+    return off
+
+if np is not None:
+    # midimsg as a structured dtype, the MIDI data buffer is split into the
+    # status byte and the two data bytes that follow it. The padding is named
+    # so that it is copied along with the events rather than left undefined.
+    midimsg_dtype=np.dtype({
+        'names': ['status','data1','data2','_pad0','size','_pad1','tme_mon'],
+        'formats': [np.uint8,np.uint8,np.uint8,(np.uint8,BUFLEN-3),np.uint32,
+            np.uint32,np.uint64],
+        'offsets': [0,1,2,3,BUFLEN,BUFLEN+4,BUFLEN+8],
+        'itemsize': midimsg_struct.size})
+
+class EventBatch:
+    """
+    A batch of MIDI events held in a structured NumPy array with the layout of
+    midimsg, so it is converted to and from the bytes sent on the message
+    queue in one call. The transforms modify the batch in place and return it,
+    so they can be chained.
+    """
+    def __init__(self,arr):
+        """
+        arr: array of dtype midimsg_dtype
+        """
+        self.arr=arr
+    @staticmethod
+    def from_bytes(b):
+        """
+        b: bytes holding packed midimsgs, trailing bytes that don't make up a
+           whole midimsg are ignored.
+        """
+        n=len(b)//midimsg_struct.size
+        return EventBatch(np.frombuffer(b,dtype=midimsg_dtype,count=n).copy())
+    @staticmethod
+    def from_events(mevs):
+        return EventBatch.from_bytes(events_to_bytes(mevs))
+    @staticmethod
+    def concat(batches):
+        return EventBatch(np.concatenate([b.arr for b in batches]))
+    def to_bytes(self):
+        return self.arr.tobytes()
+    def to_events(self):
+        return events_from_bytes(bytearray(self.arr.tobytes()))
+    def __len__(self):
+        return len(self.arr)
+    def copy(self):
+        return EventBatch(self.arr.copy())
+    @property
+    def status(self):
+        return self.arr['status']
+    @property
+    def data1(self):
+        return self.arr['data1']
+    @property
+    def data2(self):
+        return self.arr['data2']
+    @property
+    def size(self):
+        return self.arr['size']
+    @property
+    def tme_mon(self):
+        return self.arr['tme_mon']
+    @property
+    def chan(self):
+        return self.arr['status']&0x0f
+    def _code_mask(self,codes):
+        return np.isin(self.arr['status']&0xf0,list(codes))
+    def select(self,mask):
+        """
+        Returns a new batch of the events where mask is True.
+        """
+        return EventBatch(self.arr[mask])
+    def filter(self,chan=None,name=None):
+        """
+        Returns a new batch of the events matching chan and name, which are
+        interpreted as for set_midi_cb.
+        """
+        return self.select(np.isin(self.arr['status'],
+            _midi_cb_statuses(chan,name)))
+    def sort(self):
+        """
+        Sort the events by time, keeping the order of simultaneous events.
+        """
+        self.arr=self.arr[np.argsort(self.arr['tme_mon'],kind='stable')]
+        return self
+    def transpose(self,n):
+        """
+        Add n to the pitch of the pitched events, wrapping like
+        MIDIEvent.set_pitch.
+        """
+        m=self._code_mask(_pitched_codes)
+        self.arr['data1'][m]=(self.arr['data1'][m].astype(np.int64)+n)&0x7f
+        return self
+    def _velocity_col(self):
+        """
+        Returns the masks of the events with their velocity in data2 and data1.
+        """
+        return (self._code_mask(_pitched_codes),
+                (self.arr['status']&0xf0) == 0xd0)
+    def scale_velocity(self,f):
+        """
+        Multiply velocities by f, clamping the result to 0-127.
+        """
+        # in floats, uint8 would wrap before the clip
+        for col,m in zip(['data2','data1'],self._velocity_col()):
+            self.arr[col][m]=np.clip(self.arr[col][m].astype(np.float64)*f,
+                    0,127).astype(np.uint8)
+        return self
+    def clamp_velocity(self,lo=0,hi=127):
+        """
+        Clamp velocities to lo-hi, itself clamped to 0-127.
+        """
+        for col,m in zip(['data2','data1'],self._velocity_col()):
+            self.arr[col][m]=np.clip(self.arr[col][m].astype(np.int64),
+                    max(lo,0),min(hi,127))
+        return self
+    def offset_time(self,dt):
+        """
+        Add dt samples to the times of the events, times before 0 become 0.
+        """
+        t=self.arr['tme_mon'].astype(np.int64)+np.asarray(dt,dtype=np.int64)
+        self.arr['tme_mon']=np.maximum(t,0)
+        return self
+    def fan_out(self,pitch=0,time=0,velocity=0):
+        """
+        Returns a new batch where each event is repeated once for each entry of
+        the offsets pitch, time and velocity, which are broadcast against each
+        other. The offsets are added to the pitch, time and velocity of the
+        copies, e.g., fan_out(pitch=[0,4,7]) makes a major triad of each note.
+        """
+        pitch,time,velocity=np.broadcast_arrays(
+                np.atleast_1d(np.asarray(pitch,dtype=np.int64)),
+                np.atleast_1d(np.asarray(time,dtype=np.int64)),
+                np.atleast_1d(np.asarray(velocity,dtype=np.int64)))
+        k=len(pitch)
+        ret=EventBatch(np.repeat(self.arr,k))
+        n=len(self.arr)
+        ret.transpose(np.tile(pitch,n)[ret._code_mask(_pitched_codes)])
+        ret.offset_time(np.tile(time,n))
+        m_hi,m_lo=ret._velocity_col()
+        vel=np.tile(velocity,n)
+        for col,m in zip(['data2','data1'],[m_hi,m_lo]):
+            ret.arr[col][m]=np.clip(ret.arr[col][m].astype(np.int64)+vel[m],
+                    0,127)
+        return ret
+
+def _midi_batch_cbs_proc(b):
+    """
+    Routes the events in bytes b that have a batch callback to it. Returns the
+    bytes of the results of the batch callbacks and the bytes of the events
+    that have no batch callback.
+    """
+    batch=EventBatch.from_bytes(b)
+    cbs=[]
+    for status in np.unique(batch.status):
+        cb=midi_batch_cbs[status]
+        if cb is not None and cb not in cbs:
+            cbs.append(cb)
+    if not cbs:
+        return b'',b
+    handled=np.zeros(len(batch),dtype=bool)
+    results=[]
+    for cb in cbs:
+        statuses=[s for s in range(256) if midi_batch_cbs[s] is cb]
+        m=np.isin(batch.status,statuses)
+        results.append(cb(batch.select(m)).to_bytes())
+        handled|=m
+    return b''.join(results),batch.select(~handled).to_bytes()
 
 def _midi_cbs_proc(mev):
     """
@@ -276,27 +693,296 @@ def _midi_cbs_proc(mev):
     If the callback has not yet been set, returns a list only containing the mev, otherwise
     the callback should return a list of MIDI events based on the mev.
     """
-    return midi_cbs[mev.chan][mev.typ](mev)
+    return midi_cbs[mev.buf[mev.off]](mev)
+
+def _midi_cbs_proc_batch(mevs):
+    """
+    Routes each MIDI event in the list mevs to its callback and returns the
+    concatenated results. Events whose callback is the default are passed
+    through without calling it.
+    """
+    ret=[]
+    for mev in mevs:
+        cb=midi_cbs[mev.buf[mev.off]]
+        if cb is _midi_cb_default:
+            ret.append(mev)
+        else:
+            ret+=cb(mev)
+    return ret
+
+def _cbs_proc_bytes(b):
+    """
+    Runs the callbacks over the events in bytes b. Returns the list of events
+    from the callbacks set with set_midi_cb and the bytes of the events from the
+    batch callbacks.
+    """
+    done=b''
+    if _midi_batch_cbs_set:
+        done,b=_midi_batch_cbs_proc(b)
+    return _midi_cbs_proc_batch(events_from_bytes(b)),done
 
 class MIDIProcThread(threading.Thread):
-    def __init__(self,key_in=124,key_out=123): 
+    def __init__(self,key_in=124,key_out=123,block=True,poll_interval=0.001,
+            batch=False,batch_max=1024,transport='msgq',pool=None,
+            scheduler=None,port=0):
+        """
+        key_in: key of message queue MIDI messages are received on
+        key_out: key of message queue processed MIDI messages are sent on
+        block: if True, the thread sleeps in msgrcv until a message arrives,
+               otherwise it polls the queue every poll_interval seconds.
+        poll_interval: sleep time in seconds between polls when not blocking
+        batch: if True, drain up to batch_max pending events at once, run the
+               callbacks over all of them and send the results packed
+               MSGQ_BATCH_NMSGS events to a message.
+        batch_max: maximum number of events processed in one batch
+        transport: 'msgq' to use message queues or 'shm' to use shared memory
+                   rings (midi_proc_jack -s) with the keys key_in and key_out.
+                   With 'shm' the thread always blocks and processes all
+                   waiting events as a batch.
+        pool: a midi_pool.WorkerPool running the callbacks in its worker
+              processes instead of this thread, which sends their results from
+              its own thread while the pool is started with this one. Needs
+              batch mode or the 'shm' transport.
+        scheduler: a midi_sched.LookaheadScheduler holding back the events
+                   that are not due soon, started and stopped with the thread.
+        port: handle the events of this input port of midi_proc_jack -n, whose
+              keys are key_in and key_out offset by port_key. See midi_ports
+              to run a process for each port.
+        """
         threading.Thread.__init__(self)
         self.running=0
-        self.key_in=key_in
-        self.q_in = ipc.MessageQueue(self.key_in,ipc.IPC_CREAT)
-        self.key_out=key_out
-        self.q_out = ipc.MessageQueue(self.key_out,ipc.IPC_CREAT)
+        self.block=block
+        self.poll_interval=poll_interval
+        self.batch=batch
+        self.batch_max=batch_max
+        self.transport=transport
+        if pool is not None and not batch and transport == 'msgq':
+            raise ValueError('A worker pool needs batch mode')
+        self.pool=pool
+        self.scheduler=scheduler
+        # the scheduler sends from its own thread
+        self.send_lock=threading.Lock()
+        # the processed events are packed into these buffers to be sent, so
+        # sending allocates no memory for each event. out_msg holds one event,
+        # out_buf is replaced by a larger one when a batch doesn't fit.
+        self.out_msg=bytearray(midimsg_struct.size)
+        self.out_buf=bytearray(batch_max*midimsg_struct.size)
+        self.port=port
+        self.key_in=port_key(key_in,port)
+        self.key_out=port_key(key_out,port)
+        if transport == 'shm':
+            self.ring_in=shmring.ShmRing(self.key_in,SHMRING_NMSGS,
+                    midimsg_struct.size)
+            self.ring_out=shmring.ShmRing(self.key_out,SHMRING_NMSGS,
+                    midimsg_struct.size)
+        elif transport == 'msgq':
+            self.q_in = ipc.MessageQueue(self.key_in,ipc.IPC_CREAT,
+                    max_message_size=MSGQ_MAX_MESSAGE_SIZE)
+            self.q_out = ipc.MessageQueue(self.key_out,ipc.IPC_CREAT,
+                    max_message_size=MSGQ_MAX_MESSAGE_SIZE)
+        else:
+            raise ValueError('Unknown transport %s' % (transport,))
+    def _proc_msg(self,msg):
+        t_recv=None
+        if stats:
+            t_recv=stats.received(msg,self)
+        if self.scheduler is not None:
+            self.scheduler.observe(msg)
+        if tracer:
+            tracer.record(TRACE_IN,events_from_bytes(msg))
+        done=b''
+        if _midi_batch_cbs_set:
+            done,msg=_midi_batch_cbs_proc(msg)
+        for mev in events_from_bytes(msg):
+            cb=midi_cbs[mev.buf[mev.off]]
+            if cb is _midi_cb_default:
+                # sent back as received, without calling the default callback
+                # or packing the event again
+                if tracer:
+                    tracer.record(TRACE_OUT,[mev])
+                self.out_msg[:]=mev.buf[mev.off:mev.off+midimsg_struct.size]
+                self._send_out_msg(t_recv)
+                continue
+            mevs=cb(mev)
+            if tracer:
+                tracer.record(TRACE_OUT,mevs)
+            for m in mevs:
+                m.pack_into(self.out_msg,0)
+                self._send_out_msg(t_recv)
+        if done and tracer:
+            tracer.record(TRACE_OUT,events_from_bytes(done))
+        for off in range(0,len(done),midimsg_struct.size):
+            self.out_msg[:]=done[off:off+midimsg_struct.size]
+            self._send_out_msg(t_recv)
+    def _send_out_msg(self,t_recv):
+        """
+        Send the event in out_msg, made from events received at t_recv.
+        """
+        if stats:
+            stats.sent(self.out_msg,t_recv)
+        if self.scheduler is not None:
+            self._output(self.out_msg)
+        else:
+            self.q_out.send(self.out_msg,type=MSGTYPE)
+    def _drain(self,msgs):
+        """
+        Append messages waiting in the input queue to msgs until it holds
+        batch_max events or the queue is empty.
+        """
+        nevs=sum(len(m) for m in msgs)//midimsg_struct.size
+        while nevs < self.batch_max:
+            try:
+                msg=self.q_in.receive(block=False,type=MSGTYPE)[0]
+            except ipc.BusyError:
+                break
+            msgs.append(msg)
+            nevs+=len(msg)//midimsg_struct.size
+        return msgs
+    def _proc_bytes(self,b):
+        """
+        Process the events in bytes b and return the bytes of the resulting
+        events, as a memoryview of out_buf that is valid until the next call.
+        """
+        # read once so stats being switched on or off while processing can't
+        # leave t_recv unset
+        st=stats
+        if st:
+            t_recv=st.received(b,self)
+        if self.scheduler is not None:
+            self.scheduler.observe(b)
+        if tracer:
+            tracer.record(TRACE_IN,events_from_bytes(b))
+        if self.pool is not None:
+            # sent by _pool_output when the workers are done
+            self.pool.submit(b,t_recv if st else None)
+            return memoryview(self.out_buf)[:0]
+        mevs,done=_cbs_proc_bytes(b)
+        n=len(mevs)*midimsg_struct.size
+        if n+len(done) > len(self.out_buf):
+            self.out_buf=bytearray(2*(n+len(done)))
+        events_pack_into(mevs,self.out_buf,0)
+        self.out_buf[n:n+len(done)]=done
+        buf=memoryview(self.out_buf)[:n+len(done)]
+        if st:
+            st.sent(buf,t_recv)
+        if tracer:
+            tracer.record(TRACE_OUT,events_from_bytes(buf))
+        return buf
+    def _pool_output(self,b,t_recvs):
+        """
+        Send the results b of the worker pool, made from events received at
+        t_recvs. Called from the thread of the pool.
+        """
+        buf=bytearray(b)
+        st=stats
+        t_recvs=[t for t in t_recvs if t is not None]
+        if st and t_recvs:
+            st.sent(buf,min(t_recvs))
+        if tracer:
+            tracer.record(TRACE_OUT,events_from_bytes(buf))
+        self._output(buf)
+    def _send(self,buf):
+        buf=memoryview(buf)
+        if self.transport == 'shm':
+            while True:
+                n=self.ring_out.write(buf)
+                if n:
+                    self.ring_out.notify()
+                buf=buf[n:]
+                if not buf or not self.running:
+                    break
+                # ring full, sleep until midi_proc_jack has read from it
+                if stats:
+                    stats.ring_full+=1
+                # stop() clears running before waking this, checked again
+                # after wait_space drops stale wakeups, which may include it
+                self.ring_out.wait_space(lambda: self.running)
+            return
+        step=MSGQ_BATCH_NMSGS*midimsg_struct.size
+        for off in range(0,len(buf),step):
+            self.q_out.send(buf[off:off+step],type=MSGTYPE)
+    def _output(self,buf):
+        """
+        Send buf now or, with a scheduler, the part of it that is due soon.
+        """
+        if not buf:
+            # with a pool the results are sent from its thread, which can't
+            # share the output ring with an empty write from this one
+            return
+        if self.scheduler is None:
+            self._send(buf)
+            return
+        buf=self.scheduler.hold(buf)
+        if buf:
+            with self.send_lock:
+                self._send(buf)
+    def _send_locked(self,buf):
+        with self.send_lock:
+            self._send(buf)
+    def _proc_batch(self,msgs):
+        self._output(self._proc_bytes(b''.join(msgs)))
+    def _run_poll(self):
+        while self.running:
+            if self.batch:
+                msgs=self._drain([])
+                if msgs:
+                    self._proc_batch(msgs)
+                    continue
+            else:
+                while self.q_in.current_messages > 0:
+                    msg=self.q_in.receive(type=MSGTYPE)[0]
+                    self._proc_msg(msg)
+            time.sleep(self.poll_interval)
+    def _run_block(self):
+        # A negative type receives the lowest type <= MSGTYPE_WAKEUP, so MIDI
+        # messages are always received before a wakeup. msgrcv is interrupted
+        # by signals so SIGINT handlers still run.
+        while self.running:
+            msg,typ=self.q_in.receive(type=-MSGTYPE_WAKEUP)
+            if typ != MSGTYPE:
+                continue
+            if self.batch:
+                self._proc_batch(self._drain([msg]))
+            else:
+                self._proc_msg(msg)
+    def _run_shm(self):
+        # Every write to the ring posts its semaphore once, so there may be
+        # wakeups with nothing left to read.
+        while self.running:
+            self.ring_in.wait()
+            b=self.ring_in.read()
+            if b:
+                self._output(self._proc_bytes(b))
     def run(self):
         self.running=1
-        while self.running:
-            while self.q_in.current_messages > 0:
-                msg=self.q_in.receive(type=MSGTYPE)[0]
-                mev=MIDIEvent.from_bytes(msg)
-                mev.print()
-                mevs=_midi_cbs_proc(mev)
-                print("mevs length: %d" % (len(mevs),))
-                for m in mevs:
-                    m.print()
-                    self.q_out.send(m.to_bytes(),type=MSGTYPE)
-            time.sleep(0.001)
+        _running_threads.add(self)
+        try:
+            if self.scheduler is not None:
+                self.scheduler.start(self._send_locked)
+            if self.pool is not None:
+                self.pool.start(self._pool_output)
+            if self.transport == 'shm':
+                self._run_shm()
+            elif self.block:
+                self._run_block()
+            else:
+                self._run_poll()
+        finally:
+            if self.pool is not None:
+                self.pool.stop()
+            _running_threads.discard(self)
         return
+    def stop(self):
+        """
+        Ask the thread to stop. A blocked thread is woken by posting a message
+        of type MSGTYPE_WAKEUP to its input queue, or by posting the semaphores
+        of its input ring and, in case it waits for space, its output ring.
+        """
+        self.running=0
+        if self.scheduler is not None:
+            self.scheduler.stop()
+        if self.transport == 'shm':
+            self.ring_in.notify()
+            self.ring_out.wake_space()
+        elif self.block:
+            self.q_in.send(bytes(1),type=MSGTYPE_WAKEUP)
@@ -6,8 +6,10 @@ import time
 MSGTYPE=1
 key_in=124
 key_out=123
-q_in = ipc.MessageQueue(key_in,ipc.IPC_CREAT)
-q_out = ipc.MessageQueue(key_out,ipc.IPC_CREAT)
+# midi_proc_jack sends up to 128 midimsgs of 32 bytes in one message
+max_message_size=128*32
+q_in = ipc.MessageQueue(key_in,ipc.IPC_CREAT,max_message_size=max_message_size)
+q_out = ipc.MessageQueue(key_out,ipc.IPC_CREAT,max_message_size=max_message_size)
 
 def doquit(x,y):
     sys.exit(0)
@@ -0,0 +1,157 @@
+# Hold the events sent by MIDIProcThread until they are near enough to be due.
+#
+# Callbacks can make events due seconds ahead. Sent to midi_proc_jack straight
+# away they all sit in its timing wheel and midimsg cache, which then grows. A
+# LookaheadScheduler passed to MIDIProcThread (scheduler=) keeps the events due
+# later than horizon frames from now in buckets of bucket_frames frames and
+# sends each bucket once its start comes within the horizon, from its own
+# thread, so midi_proc_jack only ever holds about horizon frames of events.
+#
+# midi_proc_jack's clock isn't shared, so "now" is estimated from the time of
+# the last event received, which midi_proc_jack stamps with its frame count,
+# advanced at the sample rate.
+
+import heapq
+import threading
+import time
+
+from midi_proc_jack import midimsg_struct,_midimsg_tail_struct
+
+class LookaheadScheduler:
+    def __init__(self,horizon=24000,rate=48000,bucket_frames=None):
+        """
+        horizon: events due within this many frames from now are sent straight
+            away
+        rate: sample rate of midi_proc_jack, to advance the clock between
+            received events
+        bucket_frames: size of the buckets the later events are kept in,
+            horizon/4 if None
+        """
+        if horizon <= 0:
+            raise ValueError('horizon must be positive')
+        self.horizon=horizon
+        self.rate=rate
+        self.bucket_frames=bucket_frames or max(horizon//4,1)
+        # bucket number -> bytearray of the midimsgs in it, in the order held
+        self.buckets={}
+        # heap of the bucket numbers in buckets
+        self.heap=[]
+        self.cond=threading.Condition()
+        # frame of the last received event and time.monotonic() when received
+        self.clock=None
+        self.thread=None
+        self.running=False
+        self.send=None
+    def start(self,send):
+        """
+        Start releasing held events to send, a function of bytes of midimsgs.
+        Called by MIDIProcThread.
+        """
+        self.send=send
+        self.running=True
+        self.thread=threading.Thread(target=self._run,daemon=True)
+        self.thread.start()
+    def stop(self):
+        """
+        Stop the release thread, the events still held are kept (see pending).
+        """
+        with self.cond:
+            self.running=False
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread=None
+    def now(self):
+        """
+        Estimate of the frame midi_proc_jack is at, None before any event was
+        received.
+        """
+        if self.clock is None:
+            return None
+        frame,t=self.clock
+        return frame+int((time.monotonic()-t)*self.rate)
+    def observe(self,b):
+        """
+        Set the clock from the bytes b of midimsgs just received.
+        """
+        n=len(b)//midimsg_struct.size
+        if n:
+            tme_mon=_midimsg_tail_struct.unpack_from(b,
+                    (n-1)*midimsg_struct.size)[1]
+            self.clock=(tme_mon,time.monotonic())
+    def pending(self):
+        """
+        Number of events held.
+        """
+        with self.cond:
+            return sum(len(b) for b in self.buckets.values()
+                    )//midimsg_struct.size
+    def _due_bucket(self):
+        """
+        The last bucket that starts within the horizon, None if the clock isn't
+        known yet.
+        """
+        now=self.now()
+        if now is None:
+            return None
+        return (now+self.horizon)//self.bucket_frames
+    def hold(self,buf):
+        """
+        Keep the events in the midimsgs in buf that are not yet due. Returns
+        the bytes of the ones that are, to be sent now.
+        """
+        due=self._due_bucket()
+        if due is None:
+            return buf
+        step=midimsg_struct.size
+        n=len(buf)//step
+        tmes=[tme_mon for size,tme_mon in _midimsg_tail_struct.iter_unpack(
+            memoryview(buf)[:n*step])]
+        if not tmes or max(tmes)//self.bucket_frames <= due:
+            return buf
+        ret=bytearray()
+        added=False
+        with self.cond:
+            for i,tme_mon in enumerate(tmes):
+                k=tme_mon//self.bucket_frames
+                m=buf[i*step:(i+1)*step]
+                if k <= due:
+                    ret+=m
+                    continue
+                bucket=self.buckets.get(k)
+                if bucket is None:
+                    bucket=self.buckets[k]=bytearray()
+                    heapq.heappush(self.heap,k)
+                    added=True
+                bucket+=m
+            if added:
+                # the release thread may be waiting for a later bucket
+                self.cond.notify()
+        return ret
+    def _release(self):
+        """
+        Take the buckets that are due out of the heap, returns their bytes.
+        """
+        due=self._due_bucket()
+        ret=bytearray()
+        while self.heap and self.heap[0] <= due:
+            ret+=self.buckets.pop(heapq.heappop(self.heap))
+        return ret
+    def _run(self):
+        with self.cond:
+            while self.running:
+                b=self._release()
+                if b:
+                    self.cond.release()
+                    try:
+                        self.send(b)
+                    finally:
+                        self.cond.acquire()
+                    continue
+                if self.heap:
+                    # until the first bucket comes within the horizon
+                    wait=((self.heap[0]*self.bucket_frames-self.horizon
+                        -self.now())/self.rate)
+                    self.cond.wait(max(wait,0.))
+                else:
+                    self.cond.wait()
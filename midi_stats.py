@@ -0,0 +1,139 @@
+# Counters and per-stage latency histograms for MIDIProcThread.
+#
+# The latency of a stage is measured from the time stamped on each event by the
+# stage before it. midi_proc_jack -t stamps the events it sends, Stats stamps
+# the events MIDIProcThread sends back with the same clock
+# (time.monotonic_ns, CLOCK_MONOTONIC) so midi_proc_jack can measure the hop
+# back. The stamp is kept in the last 8 bytes of the midimsg data buffer,
+# which MIDI messages of up to STAMP_OFF bytes don't use, 0 meaning not
+# stamped. Both programs print their stats on SIGUSR1.
+
+import midi_proc_jack
+import signal
+import struct
+import sys
+import time
+
+# Must match MIDIMSG_STAMP_OFF in midi_proc_jack.c
+STAMP_OFF=8
+# Set in the stamps written here, midi_proc_jack only measures the hop back
+# for events stamped with it. Must match MIDIMSG_STAMP_PY in midi_proc_jack.c
+STAMP_PY=1
+# The stamp and size of a midimsg
+_stamp_size_struct=struct.Struct("%dxQI%dx" % (STAMP_OFF,
+    midi_proc_jack.midimsg_struct.size-STAMP_OFF-12))
+_stamp_struct=struct.Struct("Q")
+
+class LatencyHist:
+    """
+    Histogram of latencies in ns with a bin for each power of 2, like
+    latency_hist in latency_hist.c.
+    """
+    NBINS=40
+    def __init__(self,name):
+        self.name=name
+        # bin i counts latencies from 2^i up to 2^(i+1) ns, the last bin
+        # counts all the longer ones too
+        self.bins=[0]*LatencyHist.NBINS
+        self.n=0
+        self.sum_ns=0
+        self.max_ns=0
+    def add(self,ns):
+        b=min(max(ns.bit_length()-1,0),LatencyHist.NBINS-1)
+        self.bins[b]+=1
+        self.n+=1
+        self.sum_ns+=ns
+        if ns > self.max_ns:
+            self.max_ns=ns
+    def quantile(self,q):
+        """
+        Upper bound of the bin holding quantile q (0-1) of the latencies, 0 if
+        the histogram is empty.
+        """
+        if self.n == 0:
+            return 0
+        target=int(q*self.n)
+        n=0
+        for i in range(LatencyHist.NBINS-1):
+            n+=self.bins[i]
+            if n > target:
+                break
+        else:
+            i=LatencyHist.NBINS-1
+        return 1 << (i+1)
+    def format(self):
+        return ("%-12s n %10d mean %10.0f ns p50 < %10d ns p99 < %10d ns "
+                "max %10d ns" % (self.name,self.n,
+                    self.sum_ns/self.n if self.n else 0.,self.quantile(0.5),
+                    self.quantile(0.99),self.max_ns))
+
+class Stats:
+    def __init__(self):
+        self.nrecv_batches=0
+        self.nrecv_events=0
+        self.nsent_events=0
+        # times MIDIProcThread waited for room in the output shared memory ring
+        self.ring_full=0
+        # most messages seen waiting in the input message queue
+        self.msgq_in_max=0
+        # from the stamp of midi_proc_jack's output thread to being received
+        self.hist_recv=LatencyHist('send->recv')
+        # from receiving a message or batch to sending the results
+        self.hist_proc=LatencyHist('recv->send')
+    def received(self,b,th):
+        """
+        Count the events in bytes b received by MIDIProcThread th and measure
+        the latency of the stamped ones. Returns the time they were received.
+        """
+        now=time.monotonic_ns()
+        n=len(b)//midi_proc_jack.midimsg_struct.size
+        self.nrecv_batches+=1
+        self.nrecv_events+=n
+        for stamp,size in _stamp_size_struct.iter_unpack(
+                memoryview(b)[:n*midi_proc_jack.midimsg_struct.size]):
+            if stamp and size <= STAMP_OFF and now >= stamp:
+                self.hist_recv.add(now-stamp)
+        if th.transport == 'msgq':
+            self.msgq_in_max=max(self.msgq_in_max,th.q_in.current_messages)
+        return now
+    def sent(self,buf,t_recv):
+        """
+        Stamp the events in the writable buffer buf about to be sent, which
+        were made from events received at t_recv.
+        """
+        now=time.monotonic_ns()
+        stamp=now|STAMP_PY
+        n=len(buf)//midi_proc_jack.midimsg_struct.size
+        for off in range(0,n*midi_proc_jack.midimsg_struct.size,
+                midi_proc_jack.midimsg_struct.size):
+            if _stamp_size_struct.unpack_from(buf,off)[1] <= STAMP_OFF:
+                _stamp_struct.pack_into(buf,off+STAMP_OFF,stamp)
+        self.nsent_events+=n
+        self.hist_proc.add(now-t_recv)
+    def format(self):
+        return '\n'.join([
+            "events: received %d in %d batches sent %d" % (self.nrecv_events,
+                self.nrecv_batches,self.nsent_events),
+            "waits: shmring full %d" % (self.ring_full,),
+            "depth: msgq in max %d" % (self.msgq_in_max,),
+            self.hist_recv.format(),
+            self.hist_proc.format()])
+
+def dump(f=sys.stderr):
+    if midi_proc_jack.stats:
+        f.write(midi_proc_jack.stats.format()+'\n')
+        f.flush()
+
+def enable(signum=signal.SIGUSR1):
+    """
+    Start collecting stats into a new Stats, which is returned. The stats are
+    written to stderr when the process receives signal signum, unless it is
+    None.
+    """
+    midi_proc_jack.stats=Stats()
+    if signum is not None:
+        signal.signal(signum,lambda s,f: dump())
+    return midi_proc_jack.stats
+
+def disable():
+    midi_proc_jack.stats=None
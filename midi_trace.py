@@ -0,0 +1,133 @@
+# Low overhead tracing of the events passing through MIDIProcThread.
+#
+# Events are recorded into a preallocated ring buffer, the oldest records are
+# overwritten when it is full. The records can be flushed to a file as text or
+# binary by a TraceFlushThread or with dump. Run this module with binary trace
+# files as arguments to print them as text.
+
+import midi_proc_jack
+import struct
+import sys
+import threading
+import time
+
+# A trace record: host time in ns, stage and the midimsg as sent on the queue
+record_struct=struct.Struct("QI4x%dsIQ" % (midi_proc_jack.BUFLEN,))
+_header_struct=struct.Struct("QI4x")
+_zeros=bytes(midi_proc_jack.BUFLEN)
+
+stage_names = {
+        midi_proc_jack.TRACE_IN: 'in',
+        midi_proc_jack.TRACE_OUT: 'out'
+}
+
+class TraceBuffer:
+    def __init__(self,nrecords=4096):
+        """
+        nrecords: number of records the ring buffer holds
+        """
+        self.nrecords=nrecords
+        self.buf=bytearray(nrecords*record_struct.size)
+        # total records written and read, the position in the ring buffer is
+        # these modulo nrecords
+        self.nwritten=0
+        self.nread=0
+        # records overwritten before they were read
+        self.ndropped=0
+        self.lock=threading.Lock()
+    def record(self,stage,mevs):
+        """
+        Record a list of MIDIEvents at stage.
+        """
+        t=time.monotonic_ns()
+        with self.lock:
+            for m in mevs:
+                off=(self.nwritten%self.nrecords)*record_struct.size
+                _header_struct.pack_into(self.buf,off,t,stage)
+                off+=_header_struct.size
+                self.buf[off:off+midi_proc_jack.BUFLEN]=_zeros
+                self.buf[off:off+m.size]=m.buf[m.off:m.off+m.size]
+                midi_proc_jack.tail_struct.pack_into(self.buf,
+                        off+midi_proc_jack.BUFLEN,m.size,int(m.tme_mon))
+                self.nwritten+=1
+    def drain(self):
+        """
+        Returns the records not yet read, oldest first, as bytes.
+        """
+        with self.lock:
+            n=self.nwritten-self.nread
+            if n > self.nrecords:
+                self.ndropped+=n-self.nrecords
+                n=self.nrecords
+            beg=((self.nwritten-n)%self.nrecords)*record_struct.size
+            end=beg+n*record_struct.size
+            if end <= len(self.buf):
+                ret=bytes(self.buf[beg:end])
+            else:
+                ret=bytes(self.buf[beg:])+bytes(self.buf[:end-len(self.buf)])
+            self.nread=self.nwritten
+        return ret
+
+def format_records(b):
+    """
+    Returns the records in b as lines of text.
+    """
+    lines=[]
+    for t,stage,dat,size,tme_mon in record_struct.iter_unpack(b):
+        lines.append("host: %d stage: %s %s" % (t,stage_names.get(stage,stage),
+            midi_proc_jack.format_midi_event(tme_mon,dat[:size])))
+    return lines
+
+def write_records(f,b,binary=False):
+    """
+    Write records b to file f, as text or, if binary is True, as they are.
+    f must be opened in binary mode when writing binary records.
+    """
+    if binary:
+        f.write(b)
+    else:
+        for l in format_records(b):
+            f.write(l+'\n')
+    f.flush()
+
+def enable(nrecords=4096):
+    """
+    Start tracing into a new TraceBuffer holding nrecords records, which is
+    returned.
+    """
+    midi_proc_jack.tracer=TraceBuffer(nrecords)
+    return midi_proc_jack.tracer
+
+def disable():
+    midi_proc_jack.tracer=None
+
+def dump(f=sys.stdout,binary=False):
+    """
+    Write the records not yet read from the current trace buffer to f.
+    """
+    if midi_proc_jack.tracer:
+        write_records(f,midi_proc_jack.tracer.drain(),binary)
+
+class TraceFlushThread(threading.Thread):
+    def __init__(self,f,binary=False,interval=0.1):
+        """
+        Thread that writes the records of the current trace buffer to file f
+        every interval seconds.
+        """
+        threading.Thread.__init__(self,daemon=True)
+        self.f=f
+        self.binary=binary
+        self.interval=interval
+        self.stopped=threading.Event()
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            dump(self.f,self.binary)
+        dump(self.f,self.binary)
+    def stop(self):
+        self.stopped.set()
+
+if __name__ == '__main__':
+    for fname in sys.argv[1:]:
+        with open(fname,'rb') as f:
+            b=f.read()
+        write_records(sys.stdout,b[:len(b)-(len(b)%record_struct.size)])
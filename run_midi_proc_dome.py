@@ -0,0 +1,14 @@
+import midi_dome
+import midi_proc_jack
+
+th=midi_proc_jack.MIDIProcThread(batch=True)
+
+# the ornament of run_midi_proc_jack.py: each note followed by 5 more, rising
+# in pitch, getting further apart and louder
+midi_dome.set_midi_dome_cb(0,['NoteOn','NoteOff'],
+        pitch='-24 -22 ( -20 ( -17 ( -15 ( -12 ( +',
+        velocity='0 -40 ( -20 ( -13.333333333333334 ( -10 ( -8 ( +',
+        time='0 6000 ( 18000 ( 36000 ( 60000 ( 90000 ( +',
+        copies=6)
+
+th.run()
@@ -24,7 +24,6 @@ def ornament(mev):
         r.append(m)
     return r
 
-midi_proc_jack.set_midi_cb(0,'NoteOn',ornament)
-midi_proc_jack.set_midi_cb(0,'NoteOff',ornament)
+midi_proc_jack.set_midi_cb(0,['NoteOn','NoteOff'],ornament)
 
 th.run()
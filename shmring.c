@@ -0,0 +1,161 @@
+/* Single-producer / single-consumer ring buffer in System V shared memory */
+#include "shmring.h"
+#include <errno.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/ipc.h>
+#include <sys/sem.h>
+#include <sys/shm.h>
+
+#define SHMRING_CACHE_LINE 64
+
+/* Layout of the shared memory segment, must match shmring.py. head and tail
+   count the items written and read, the position of an item in the ring is the
+   count modulo nitems. They are kept on separate cache lines so the producer
+   and consumer don't contend. waiting is set by a producer waiting for space.
+   */
+typedef struct {
+    uint32_t nitems;
+    uint32_t item_size;
+    uint32_t waiting;
+    char _pad0[SHMRING_CACHE_LINE - 3*sizeof(uint32_t)];
+    uint32_t head;
+    char _pad1[SHMRING_CACHE_LINE - sizeof(uint32_t)];
+    uint32_t tail;
+    char _pad2[SHMRING_CACHE_LINE - sizeof(uint32_t)];
+    char items[];
+} shmring_shared;
+
+struct shmring_t {
+    shmring_shared *shared;
+    int semid;
+    int space_semid;
+    uint32_t mask;
+    uint32_t item_size;
+};
+
+shmring_t *
+shmring_attach(key_t key, uint32_t nitems, uint32_t item_size)
+{
+    if ((nitems == 0) || (nitems & (nitems - 1))) { return NULL; }
+    shmring_t *ret = calloc(1,sizeof(shmring_t));
+    if (!ret) { return NULL; }
+    int shmid = shmget(key,sizeof(shmring_shared) + nitems*item_size,
+            0666|IPC_CREAT);
+    if (shmid == -1) { goto fail; }
+    ret->shared = shmat(shmid,NULL,0);
+    if (ret->shared == (void*)-1) { goto fail; }
+    /* a new segment is zeroed */
+    if (ret->shared->nitems == 0) {
+        ret->shared->nitems = nitems;
+        ret->shared->item_size = item_size;
+    }
+    if ((ret->shared->nitems != nitems)
+            || (ret->shared->item_size != item_size)) {
+        shmdt(ret->shared);
+        goto fail;
+    }
+    /* a new semaphore has value 0 on Linux */
+    ret->semid = semget(key,1,0666|IPC_CREAT);
+    ret->space_semid = semget(key + SHMRING_SPACE_KEY_OFF,1,0666|IPC_CREAT);
+    if ((ret->semid == -1) || (ret->space_semid == -1)) {
+        shmdt(ret->shared);
+        goto fail;
+    }
+    ret->mask = nitems - 1;
+    ret->item_size = item_size;
+    return ret;
+fail:
+    free(ret);
+    return NULL;
+}
+
+void
+shmring_detach(shmring_t *sr)
+{
+    shmdt(sr->shared);
+    free(sr);
+}
+
+/* Copy n items between the ring at count pos and buf, in up to 2 parts
+   because the ring wraps around. */
+static void
+shmring_copy(shmring_t *sr, uint32_t pos, char *buf, size_t n, int to_ring)
+{
+    size_t idx = pos & sr->mask;
+    size_t n1 = sr->mask + 1 - idx;
+    if (n1 > n) { n1 = n; }
+    char *ring = sr->shared->items;
+    if (to_ring) {
+        memcpy(ring + idx*sr->item_size, buf, n1*sr->item_size);
+        memcpy(ring, buf + n1*sr->item_size, (n - n1)*sr->item_size);
+    } else {
+        memcpy(buf, ring + idx*sr->item_size, n1*sr->item_size);
+        memcpy(buf + n1*sr->item_size, ring, (n - n1)*sr->item_size);
+    }
+}
+
+/* Post the semaphore semid, returns 0 on success, -1 on error with errno
+   set. */
+static int
+shmring_post(int semid)
+{
+    struct sembuf op = { .sem_num = 0, .sem_op = 1, .sem_flg = 0 };
+    /* If the semaphore is at its maximum the other side has plenty of pending
+       wakeups already */
+    if ((semop(semid,&op,1) == -1) && (errno != ERANGE)) {
+        return -1;
+    }
+    return 0;
+}
+
+size_t
+shmring_write(shmring_t *sr, const void *items, size_t n)
+{
+    uint32_t head = sr->shared->head;
+    uint32_t tail = __atomic_load_n(&sr->shared->tail,__ATOMIC_ACQUIRE);
+    size_t space = sr->mask + 1 - (head - tail);
+    if (n > space) { n = space; }
+    shmring_copy(sr,head,(char*)items,n,1);
+    __atomic_store_n(&sr->shared->head,head + n,__ATOMIC_RELEASE);
+    return n;
+}
+
+size_t
+shmring_read_space(shmring_t *sr)
+{
+    return __atomic_load_n(&sr->shared->head,__ATOMIC_ACQUIRE)
+        - sr->shared->tail;
+}
+
+size_t
+shmring_read(shmring_t *sr, void *items, size_t n)
+{
+    uint32_t tail = sr->shared->tail;
+    size_t avail = shmring_read_space(sr);
+    if (n > avail) { n = avail; }
+    shmring_copy(sr,tail,items,n,0);
+    __atomic_store_n(&sr->shared->tail,tail + n,__ATOMIC_RELEASE);
+    /* the new tail must be visible before waiting is read, the producer sets
+       waiting before it reads tail, so one of the two sees the other */
+    __atomic_thread_fence(__ATOMIC_SEQ_CST);
+    if (n && __atomic_load_n(&sr->shared->waiting,__ATOMIC_RELAXED)
+            && (shmring_post(sr->space_semid) == -1)) {
+        perror("shmring_post");
+    }
+    return n;
+}
+
+int
+shmring_notify(shmring_t *sr)
+{
+    return shmring_post(sr->semid);
+}
+
+int
+shmring_wait(shmring_t *sr)
+{
+    struct sembuf op = { .sem_num = 0, .sem_op = -1, .sem_flg = 0 };
+    return semop(sr->semid,&op,1);
+}
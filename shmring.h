@@ -0,0 +1,56 @@
+#ifndef SHMRING_H
+#define SHMRING_H
+
+/* Single-producer / single-consumer ring buffer of constant sized items in
+   System V shared memory, shared between processes. The consumer sleeps on a
+   System V semaphore with the same key as the shared memory segment, the
+   producer posts it after each write. A producer that finds the ring full can
+   sleep on a second semaphore, with key + SHMRING_SPACE_KEY_OFF, that the
+   consumer posts after reading while the producer waits. */
+#include <stddef.h>
+#include <stdint.h>
+#include <sys/types.h>
+
+/* Must match SPACE_KEY_OFF in shmring.py */
+#define SHMRING_SPACE_KEY_OFF 0x10000000
+
+typedef struct shmring_t shmring_t;
+
+/*
+   Attach to the ring with key, creating it if it doesn't exist.
+   nitems is the number of items the ring holds, must be a power of 2
+   item_size is the size of one item in bytes
+   Returns NULL if the ring couldn't be created or exists with a different
+   nitems or item_size.
+*/
+shmring_t *
+shmring_attach(key_t key, uint32_t nitems, uint32_t item_size);
+
+void
+shmring_detach(shmring_t *sr);
+
+/* Write up to n items, returns the number of items written, which is less
+   than n if the ring doesn't have enough space. Producer only. */
+size_t
+shmring_write(shmring_t *sr, const void *items, size_t n);
+
+/* Read up to n items, returns the number of items read. Wakes a producer
+   waiting for space if any were read. Consumer only. */
+size_t
+shmring_read(shmring_t *sr, void *items, size_t n);
+
+/* Number of items that can be read */
+size_t
+shmring_read_space(shmring_t *sr);
+
+/* Wake the consumer, call after writing. Returns 0 on success, -1 on error
+   with errno set. */
+int
+shmring_notify(shmring_t *sr);
+
+/* Sleep until the producer calls shmring_notify. Returns 0 on success, -1 on
+   error with errno set, e.g., to EINTR if interrupted by a signal. */
+int
+shmring_wait(shmring_t *sr);
+
+#endif /* SHMRING_H */
@@ -0,0 +1,156 @@
+# Single-producer / single-consumer ring buffer in System V shared memory,
+# the Python side of shmring.c.
+#
+# The consumer sleeps on a System V semaphore with the same key as the shared
+# memory segment, the producer posts it after each write. A producer that finds
+# the ring full can sleep on a second semaphore, with key + SPACE_KEY_OFF, that
+# the consumer posts after reading while the producer waits.
+
+import sysv_ipc as ipc
+import struct
+
+# Layout of the shared memory segment, must match shmring_shared in shmring.c
+_CACHE_LINE=64
+_info_struct=struct.Struct("II")
+_count_struct=struct.Struct("I")
+_WAITING_OFF=_info_struct.size
+_HEAD_OFF=_CACHE_LINE
+_TAIL_OFF=2*_CACHE_LINE
+_ITEMS_OFF=3*_CACHE_LINE
+# must match SHMRING_SPACE_KEY_OFF in shmring.h
+SPACE_KEY_OFF=0x10000000
+
+def _semaphore(key):
+    # Opening an existing semaphore with IPC_CREAT would reset its value and
+    # lose pending wakeups
+    try:
+        return ipc.Semaphore(key,ipc.IPC_CREX,initial_value=0)
+    except ipc.ExistentialError:
+        return ipc.Semaphore(key)
+
+def _post(sem):
+    try:
+        sem.release()
+    except ValueError:
+        # the semaphore is at its maximum, the other side has plenty of
+        # pending wakeups already
+        pass
+
+class ShmRing:
+    def __init__(self,key,nitems,item_size):
+        """
+        Attach to the ring with key, creating it if it doesn't exist.
+        nitems: number of items the ring holds, must be a power of 2
+        item_size: size of one item in bytes
+        """
+        if nitems <= 0 or (nitems & (nitems-1)):
+            raise ValueError('nitems must be a power of 2')
+        self.key=key
+        self.nitems=nitems
+        self.item_size=item_size
+        self.shm=ipc.SharedMemory(key,ipc.IPC_CREAT,
+                size=_ITEMS_OFF+nitems*item_size)
+        self.sem=_semaphore(key)
+        self.space_sem=_semaphore(key+SPACE_KEY_OFF)
+        self.mv=memoryview(self.shm)
+        n,sz=_info_struct.unpack_from(self.mv,0)
+        if n == 0:
+            # a new segment is zeroed
+            _info_struct.pack_into(self.mv,0,nitems,item_size)
+        elif (n,sz) != (nitems,item_size):
+            self.close()
+            raise ValueError('ring %d exists with %d items of size %d' %
+                    (key,n,sz))
+    def _count(self,off):
+        return _count_struct.unpack_from(self.mv,off)[0]
+    def _items(self,pos,n):
+        """
+        Returns the byte ranges of n items starting at count pos, in up to 2
+        parts because the ring wraps around.
+        """
+        idx=pos&(self.nitems-1)
+        n1=min(n,self.nitems-idx)
+        beg=_ITEMS_OFF+idx*self.item_size
+        return [(beg,beg+n1*self.item_size),
+                (_ITEMS_OFF,_ITEMS_OFF+(n-n1)*self.item_size)]
+    def write(self,b):
+        """
+        Write the whole items in b that fit in the ring, returns the number of
+        bytes written. Producer only.
+        """
+        b=memoryview(b)
+        head=self._count(_HEAD_OFF)
+        space=self.nitems-((head-self._count(_TAIL_OFF))&0xffffffff)
+        n=min(len(b)//self.item_size,space)
+        off=0
+        for beg,end in self._items(head,n):
+            self.mv[beg:end]=b[off:off+end-beg]
+            off+=end-beg
+        _count_struct.pack_into(self.mv,_HEAD_OFF,(head+n)&0xffffffff)
+        return off
+    def read(self):
+        """
+        Returns the bytes of all the items that can be read and wakes a
+        producer waiting for space if there were any. Consumer only.
+        """
+        tail=self._count(_TAIL_OFF)
+        n=(self._count(_HEAD_OFF)-tail)&0xffffffff
+        ret=b''.join([self.mv[beg:end] for beg,end in self._items(tail,n)])
+        _count_struct.pack_into(self.mv,_TAIL_OFF,(tail+n)&0xffffffff)
+        if n and self._count(_WAITING_OFF):
+            _post(self.space_sem)
+        return ret
+    def space(self):
+        """
+        Returns the number of items that can be written.
+        """
+        return self.nitems-((self._count(_HEAD_OFF)-self._count(_TAIL_OFF))
+                &0xffffffff)
+    def notify(self):
+        """
+        Wake the consumer, call after writing.
+        """
+        _post(self.sem)
+    def wait(self):
+        """
+        Sleep until the producer calls notify.
+        """
+        self.sem.acquire()
+    def wait_space(self,keep_waiting=None):
+        """
+        Sleep until the consumer has read items if the ring is full, or until
+        wake_space is called. Producer only.
+        keep_waiting: function checked before sleeping, which doesn't sleep if
+            it returns False. Whoever makes it return False must call
+            wake_space after, as that wakeup may be dropped with stale ones.
+        """
+        _count_struct.pack_into(self.mv,_WAITING_OFF,1)
+        # Drop the wakeups left by reads of earlier waits, then look again
+        # (the semop is a barrier) so a read after setting waiting isn't missed
+        self.space_sem.block=False
+        try:
+            while True:
+                self.space_sem.acquire()
+        except ipc.BusyError:
+            pass
+        finally:
+            self.space_sem.block=True
+        if self.space() == 0 and (keep_waiting is None or keep_waiting()):
+            self.space_sem.acquire()
+        _count_struct.pack_into(self.mv,_WAITING_OFF,0)
+    def wake_space(self):
+        """
+        Wake a producer sleeping in wait_space.
+        """
+        _post(self.space_sem)
+    def close(self):
+        self.mv.release()
+        self.shm.detach()
+    def remove(self):
+        """
+        Remove the shared memory segment and semaphore from the system.
+        """
+        self.close()
+        self.shm.remove()
+        self.sem.remove()
+        self.space_sem.remove()
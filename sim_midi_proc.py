@@ -0,0 +1,361 @@
+# Run the whole processing chain without JACK and report its throughput and
+# timing.
+#
+# Events from a file or made up by a seeded generator are fed to
+# midi_proc_sim (midi_proc_jack.c built against jack_sim.c, make
+# midi_proc_sim), which passes them through the message queues or shared
+# memory rings to a MIDIProcThread in this process and back, and writes the
+# events its process() outputs with the frame they were output at. Each event
+# is sent back delayed by --delay frames, so every output event is expected at
+# its input frame plus the delay and any later is late. With --subscribe the
+# callback is only set on some channels and midi_proc_sim -m outputs the
+# events on the others at their input frame. With --map the delay is a
+# midi_map.MidiMap applied by midi_proc_sim -a itself. With --ports the events
+# are spread over the input ports of midi_proc_sim -n by channel, each handled
+# by its own process (midi_ports.PortProcesses).
+#
+# midi_proc_sim uses the fixed keys of midi_proc_jack, so don't run this while
+# midi_proc_jack is running.
+
+import midi_map
+import midi_pool
+import midi_ports
+import midi_proc_jack
+import midi_sched
+import midi_stats
+import sysv_ipc as ipc
+import argparse
+import collections
+import functools
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+SIM=os.path.join(os.path.dirname(os.path.abspath(__file__)),'midi_proc_sim')
+# keys used by midi_proc_jack.c, from C to Python and back
+KEY_C_TO_PY=124
+KEY_PY_TO_C=123
+
+def generate(nnotes,rate,events_per_sec,seed):
+    """
+    Returns the events (frame, status, data1, data2) of nnotes notes starting
+    events_per_sec/2 times a second on average and lasting up to 2 intervals.
+    Notes sounding at the same time have different pitches so none of the
+    note offs are filtered out by midi_proc_jack.
+    """
+    rng=random.Random(seed)
+    mean_interval=2*rate/events_per_sec
+    evs=[]
+    t=0.
+    for i in range(nnotes):
+        t+=rng.expovariate(1/mean_interval)
+        pitch=16+i%96
+        vel=rng.randint(1,127)
+        chan=rng.randint(0,15)
+        dur=rng.uniform(1,2*mean_interval)
+        evs.append((int(t),0x90|chan,pitch,vel))
+        evs.append((int(t+dur),0x80|chan,pitch,0))
+    evs.sort(key=lambda e: e[0])
+    return evs
+
+def generate_sweeps(nsweeps,end,rate,events_per_sec,seed):
+    """
+    Returns the events of nsweeps fader sweeps or pitch bend wheel moves
+    between frames 0 and end, each sending events_per_sec ControlChange or
+    PitchBend events a second for a second.
+    """
+    rng=random.Random(seed)
+    evs=[]
+    for i in range(nsweeps):
+        t=rng.uniform(0,max(end-rate,0))
+        chan=rng.randint(0,15)
+        n=int(events_per_sec)
+        for j in range(n):
+            frame=int(t+j*rate/events_per_sec)
+            if i%2:
+                bend=j*0x3fff//n
+                evs.append((frame,0xe0|chan,bend&0x7f,bend>>7))
+            else:
+                evs.append((frame,0xb0|chan,1+i%16,j*127//n))
+    return evs
+
+def read_events(f):
+    evs=[]
+    for line in f:
+        fields=[int(x) for x in line.split()]
+        if len(fields) >= 3:
+            evs.append(tuple(fields))
+    return evs
+
+def write_events(f,evs):
+    for ev in evs:
+        f.write(' '.join(str(x) for x in ev)+'\n')
+
+def drain_transport(shm,nports=1):
+    """
+    Throw away what a previous run left in the queues or rings of the first
+    nports ports.
+    """
+    keys=[midi_proc_jack.port_key(key,port) for port in range(nports)
+            for key in [KEY_C_TO_PY,KEY_PY_TO_C]]
+    if shm:
+        for key in keys:
+            r=midi_proc_jack.shmring.ShmRing(key,midi_proc_jack.SHMRING_NMSGS,
+                    midi_proc_jack.midimsg_struct.size)
+            r.read()
+            r.close()
+        return
+    for key in keys:
+        q=ipc.MessageQueue(key,ipc.IPC_CREAT,
+                max_message_size=midi_proc_jack.MSGQ_MAX_MESSAGE_SIZE)
+        while q.current_messages > 0:
+            q.receive(block=False)
+
+def set_delay(delay,batch,chans=None,mapped=False):
+    if mapped:
+        midi_proc_jack.set_midi_cb(chans,None,
+                midi_map.MidiMap(fan_out=[(0,delay)]))
+        return
+    if delay == 0 and chans is None:
+        return
+    if batch:
+        midi_proc_jack.set_midi_batch_cb(chans,None,
+                lambda b: b.offset_time(delay))
+        return
+    def delay_cb(mev):
+        mev.tme_mon+=delay
+        return [mev]
+    midi_proc_jack.set_midi_cb(chans,None,delay_cb)
+
+def _setup_worker(delay,batch,chans,mapped,i):
+    set_delay(delay,batch,chans,mapped)
+
+def _setup_port(delay,batch,chans,mapped,horizon,rate,port):
+    set_delay(delay,batch,chans,mapped)
+    if chans is not None:
+        midi_proc_jack.enable_subscriptions(port=port)
+    if mapped:
+        midi_map.enable(port=port)
+    if horizon:
+        return {'scheduler': midi_sched.LookaheadScheduler(horizon,rate)}
+
+def quantile(xs,q):
+    return xs[min(int(q*len(xs)),len(xs)-1)]
+
+def report(evs_in,evs_out,delay,rate,speed,wall,chans=None,coalesced=False):
+    """
+    Match the output events to the input events with the same data in order
+    and print how late they were. Only the events on chans are delayed if it
+    isn't None. If coalesced, a ControlChange or PitchBend output is matched to
+    the last input with its data expected by then, the earlier ones were
+    merged.
+    """
+    expected=collections.defaultdict(collections.deque)
+    for ev in evs_in:
+        d=delay if chans is None or (ev[1]&0x0f) in chans else 0
+        expected[ev[1:]].append(ev[0]+d)
+    lateness=[]
+    unexpected=0
+    merged=0
+    for ev in evs_out:
+        q=expected.get(ev[1:])
+        if not q:
+            unexpected+=1
+            continue
+        if coalesced and ev[1]&0xf0 in (0xb0,0xe0):
+            while len(q) > 1 and q[1] <= ev[0]:
+                q.popleft()
+                merged+=1
+        lateness.append(ev[0]-q.popleft())
+    missing=sum(len(q) for q in expected.values())
+    missing_ctl=sum(len(q) for k,q in expected.items()
+            if k[0]&0xf0 in (0xb0,0xe0))
+    print("events: in %d out %d missing %d (control %d) merged %d "
+            "unexpected %d" % (len(evs_in),len(evs_out),missing,missing_ctl,
+                merged,unexpected))
+    # how long the input takes to play at speed
+    span=(evs_in[-1][0]-evs_in[0][0])/rate/speed if evs_in else 0
+    print("time: wall %.3f s, input %.3f s at %g times real time, "
+            "%.0f events/s in" % (wall,span,speed,
+                len(evs_in)/span if span else 0))
+    if not lateness:
+        return
+    lateness.sort()
+    mean=sum(lateness)/len(lateness)
+    sd=(sum((x-mean)**2 for x in lateness)/len(lateness))**0.5
+    print("lateness (frames): mean %.1f p50 %d p99 %d max %d min %d, "
+            "on time %.1f%%" % (mean,quantile(lateness,0.5),
+                quantile(lateness,0.99),lateness[-1],lateness[0],
+                100.*sum(1 for x in lateness if x == 0)/len(lateness)))
+    print("jitter: %.1f frames (%.3f ms)" % (sd,1e3*sd/rate))
+
+def run_sim(args,chans,in_paths,out_path):
+    """
+    Run midi_proc_sim on the input files of its ports, returns the wall time
+    it took.
+    """
+    env=dict(os.environ,MIDI_PROC_SIM_IN=':'.join(in_paths),
+            MIDI_PROC_SIM_OUT=out_path,
+            MIDI_PROC_SIM_NFRAMES=str(args.nframes),
+            MIDI_PROC_SIM_RATE=str(args.rate),
+            MIDI_PROC_SIM_SPEED=str(args.speed),
+            # long enough for the delayed events to come out
+            MIDI_PROC_SIM_TAIL=str(args.delay+args.rate))
+    t=time.perf_counter()
+    subprocess.run([SIM]+(['-s'] if args.shm else [])
+            +(['-m'] if chans is not None else [])
+            +(['-c'] if args.coalesce else [])
+            +(['-a'] if args.map else [])
+            +(['-n',str(len(in_paths))] if len(in_paths) > 1 else []),
+            env=env,check=True)
+    return time.perf_counter()-t
+
+def run_thread(args,chans,in_paths,out_path):
+    """
+    Run midi_proc_sim with a MIDIProcThread in this process, returns the wall
+    time midi_proc_sim took.
+    """
+    if args.stats:
+        midi_stats.enable(None)
+    # set here as well so the subscriptions can be published
+    set_delay(args.delay,args.batch,chans,args.map)
+    pool=None
+    if args.workers:
+        pool=midi_pool.WorkerPool(args.workers,
+                functools.partial(_setup_worker,args.delay,args.batch,
+                    chans,args.map))
+    if chans is not None:
+        midi_proc_jack.enable_subscriptions()
+    if args.map:
+        midi_map.enable()
+    th=midi_proc_jack.MIDIProcThread(KEY_C_TO_PY,KEY_PY_TO_C,
+            batch=args.batch,transport='shm' if args.shm else 'msgq',
+            pool=pool,scheduler=midi_sched.LookaheadScheduler(
+                args.horizon,args.rate*args.speed) if args.horizon else None)
+    th.start()
+    wall=run_sim(args,chans,in_paths,out_path)
+    th.stop()
+    # nothing reads what the thread sends any more, it may be waiting for
+    # room in the queue
+    while th.is_alive():
+        drain_transport(args.shm)
+        th.join(0.1)
+    if pool:
+        pool.close()
+    if chans is not None:
+        midi_proc_jack.disable_subscriptions()
+    if args.map:
+        midi_map.disable()
+    return wall
+
+def run_ports(args,chans,in_paths,out_path):
+    """
+    Run midi_proc_sim -n with a MIDIProcThread process for each port,
+    returns the wall time midi_proc_sim took.
+    """
+    procs=midi_ports.PortProcesses(len(in_paths),
+            functools.partial(_setup_port,args.delay,args.batch,chans,args.map,
+                args.horizon,args.rate*args.speed),
+            batch=args.batch,transport='shm' if args.shm else 'msgq')
+    wall=run_sim(args,chans,in_paths,out_path)
+    procs.stop()
+    # nothing reads what the processes send any more, they may be waiting for
+    # room in the queues
+    while procs.is_alive():
+        drain_transport(args.shm,len(in_paths))
+        procs.join(0.1)
+    procs.close()
+    return wall
+
+def main():
+    ap=argparse.ArgumentParser(description='Run midi_proc_sim and a '
+            'MIDIProcThread and report throughput and timing.')
+    ap.add_argument('--input',help='file of events: frame status data1 '
+            '[data2], made up by the generator if not given')
+    ap.add_argument('--notes',type=int,default=5000,
+            help='number of notes generated')
+    ap.add_argument('--events-per-sec',type=float,default=2000,
+            help='mean rate of the generated events')
+    ap.add_argument('--sweeps',type=int,default=0,
+            help='number of generated ControlChange or PitchBend sweeps')
+    ap.add_argument('--sweep-events-per-sec',type=float,default=500,
+            help='rate of the events of a sweep')
+    ap.add_argument('--seed',type=int,default=1)
+    ap.add_argument('--delay',type=int,default=4096,
+            help='frames added to the time of each event by MIDIProcThread')
+    ap.add_argument('--nframes',type=int,default=256,help='period size')
+    ap.add_argument('--rate',type=int,default=48000,help='sample rate')
+    ap.add_argument('--speed',type=float,default=1.,
+            help='times faster than real time the periods are run')
+    ap.add_argument('--batch',action='store_true',
+            help='run MIDIProcThread in batch mode')
+    ap.add_argument('--shm',action='store_true',
+            help='use shared memory rings instead of message queues')
+    ap.add_argument('--workers',type=int,default=0,
+            help='run the callbacks in a midi_pool.WorkerPool of this many '
+            'processes, needs --batch or --shm')
+    ap.add_argument('--horizon',type=int,default=0,
+            help='hold back events due later than this many frames ahead in '
+            'a midi_sched.LookaheadScheduler')
+    ap.add_argument('--subscribe',
+            help='comma separated channels to set the callback on, the others '
+            'are output by midi_proc_sim -m without going through Python')
+    ap.add_argument('--coalesce',action='store_true',
+            help='have midi_proc_sim -c merge the ControlChange and PitchBend '
+            'events of each period')
+    ap.add_argument('--map',action='store_true',
+            help='delay the events with a midi_map.MidiMap applied by '
+            'midi_proc_sim -a')
+    ap.add_argument('--ports',type=int,default=1,
+            help='spread the events over this many input ports of '
+            'midi_proc_sim -n by channel, each with its own MIDIProcThread '
+            'process')
+    ap.add_argument('--stats',action='store_true',
+            help='print the stats of MIDIProcThread (see midi_stats)')
+    ap.add_argument('--output',help='keep the output events in this file')
+    args=ap.parse_args()
+    chans=None
+    if args.subscribe:
+        chans=[int(c) for c in args.subscribe.split(',')]
+    if args.workers and not (args.batch or args.shm):
+        ap.error('--workers needs --batch or --shm')
+    if not 1 <= args.ports <= midi_proc_jack.MAX_PORTS:
+        ap.error('--ports must be 1 to %d' % (midi_proc_jack.MAX_PORTS,))
+    if args.ports > 1 and (args.workers or args.stats):
+        ap.error('--workers and --stats need a single port')
+    if not os.access(SIM,os.X_OK):
+        sys.exit('%s not found, run make midi_proc_sim' % (SIM,))
+    if args.input:
+        with open(args.input) as f:
+            evs_in=read_events(f)
+    else:
+        evs_in=generate(args.notes,args.rate,args.events_per_sec,args.seed)
+        if args.sweeps:
+            evs_in+=generate_sweeps(args.sweeps,evs_in[-1][0] if evs_in else
+                    args.rate,args.rate,args.sweep_events_per_sec,args.seed)
+            evs_in.sort(key=lambda e: e[0])
+    with tempfile.TemporaryDirectory() as d:
+        in_paths=[os.path.join(d,'in%d' % (port,))
+                for port in range(args.ports)]
+        out_path=args.output or os.path.join(d,'out')
+        for port,path in enumerate(in_paths):
+            with open(path,'w') as f:
+                write_events(f,[ev for ev in evs_in
+                    if (ev[1]&0x0f)%args.ports == port])
+        drain_transport(args.shm,args.ports)
+        if args.ports > 1:
+            wall=run_ports(args,chans,in_paths,out_path)
+        else:
+            wall=run_thread(args,chans,in_paths,out_path)
+        with open(out_path) as f:
+            evs_out=read_events(f)
+    report(evs_in,evs_out,args.delay,args.rate,args.speed,wall,chans,
+            args.coalesce)
+    if args.stats:
+        midi_stats.dump(sys.stdout)
+
+if __name__ == '__main__':
+    main()
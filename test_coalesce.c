@@ -0,0 +1,94 @@
+/* Tests for the keys of the events midi_proc_jack -c merges. Prints the
+   failures and exits with the number of failed tests. */
+#include "coalesce.h"
+#include <stdio.h>
+
+/* Check the key of the 3 byte event status, data1 is merged or not */
+static int
+check_merged(unsigned char status, unsigned char data1, int merged,
+        const char *what)
+{
+    unsigned char buf[3] = { status, data1, 64 };
+    int key = coalesce_key(buf,sizeof(buf));
+    if ((key >= 0) != merged) {
+        fprintf(stderr,"%s: %02x %02x has key %d\n",what,status,data1,key);
+        return 1;
+    }
+    if (key >= COALESCE_NKEYS) {
+        fprintf(stderr,"%s: %02x %02x key %d out of range\n",what,status,
+                data1,key);
+        return 1;
+    }
+    return 0;
+}
+
+/* Controllers holding a continuous value are merged, by channel and
+   controller */
+static int
+test_continuous(void)
+{
+    unsigned char mod[3] = { 0xb0, 1, 10 }, mod_later[3] = { 0xb0, 1, 90 },
+                  mod_chan[3] = { 0xb3, 1, 10 }, vol[3] = { 0xb0, 7, 10 };
+    int ret = 0;
+    ret |= check_merged(0xb0,1,1,"modulation");
+    ret |= check_merged(0xbf,7,1,"volume");
+    ret |= check_merged(0xb5,64,1,"sustain");
+    ret |= check_merged(0xb0,119,1,"last controller");
+    ret |= check_merged(0xe0,0,1,"pitch bend");
+    if (coalesce_key(mod,3) != coalesce_key(mod_later,3)) {
+        fprintf(stderr,"continuous: values of a controller have different "
+                "keys\n");
+        ret = 1;
+    }
+    if ((coalesce_key(mod,3) == coalesce_key(mod_chan,3))
+            || (coalesce_key(mod,3) == coalesce_key(vol,3))) {
+        fprintf(stderr,"continuous: different controllers share a key\n");
+        ret = 1;
+    }
+    return ret;
+}
+
+/* Bank select, RPN/NRPN and channel mode messages pass untouched, so two
+   NRPN writes or two bank select and program change pairs in a period keep
+   all their steps */
+static int
+test_sequences(void)
+{
+    static const unsigned char ccs[] = { 0, 32, 6, 38, 96, 97, 98, 99, 100,
+        101, 120, 121, 122, 123, 124, 125, 126, 127 };
+    size_t i;
+    int ret = 0;
+    for (i = 0; i < sizeof(ccs); i++) {
+        ret |= check_merged(0xb0,ccs[i],0,"sequence");
+        ret |= check_merged(0xb9,ccs[i],0,"sequence");
+    }
+    return ret;
+}
+
+/* Other events and short ones are never merged */
+static int
+test_others(void)
+{
+    unsigned char cc[3] = { 0xb0, 1, 10 };
+    int ret = 0;
+    ret |= check_merged(0x90,60,0,"note on");
+    ret |= check_merged(0x80,60,0,"note off");
+    ret |= check_merged(0xa0,60,0,"poly pressure");
+    if (coalesce_key(cc,2) >= 0) {
+        fprintf(stderr,"others: truncated ControlChange has a key\n");
+        ret = 1;
+    }
+    return ret;
+}
+
+int main (void)
+{
+    int nfailed = 0;
+    nfailed += test_continuous();
+    nfailed += test_sequences();
+    nfailed += test_others();
+    if (nfailed) {
+        fprintf(stderr,"%d tests failed\n",nfailed);
+    }
+    return nfailed;
+}
@@ -0,0 +1,105 @@
+# Check the EventBatch transforms and the conversions between EventBatches,
+# MIDIEvents and midimsg bytes.
+
+import midi_proc_jack
+
+from midi_proc_jack import EventBatch,MIDIEvent
+
+# out of the way of the keys of midi_proc_jack
+KEY_C_TO_PY=4124
+KEY_PY_TO_C=4123
+
+def make_events():
+    return [MIDIEvent(0,'NoteOn',0,bytes([0,60,100])),
+            MIDIEvent(10,'NoteOff',1,bytes([0,62,40])),
+            MIDIEvent(20,'ChanPress',2,bytes([0,90])),
+            MIDIEvent(30,'ControlChange',3,bytes([0,7,100])),
+            MIDIEvent(40,'PitchBend',4,bytes([0,1,64]))]
+
+def velocities(batch):
+    return [mev.get_velocity() for mev in batch.to_events()
+            if mev.typ in ('NoteOn','NoteOff','ChanPress')]
+
+def test_scale_velocity():
+    b=EventBatch.from_events(make_events())
+    assert velocities(b.copy().scale_velocity(0.5)) == [50,20,45]
+    # clamped at 127 rather than wrapping
+    assert velocities(b.copy().scale_velocity(3)) == [127,120,127]
+    # clamped at 0
+    assert velocities(b.copy().scale_velocity(-1)) == [0,0,0]
+    # the events without a velocity are left alone
+    scaled=b.copy().scale_velocity(3)
+    assert scaled.data1[3:].tolist() == [7,1]
+    assert scaled.data2[3:].tolist() == [100,64]
+    print("passed")
+
+def test_clamp_velocity():
+    b=EventBatch.from_events(make_events())
+    assert velocities(b.copy().clamp_velocity(50,95)) == [95,50,90]
+    assert velocities(b.copy().clamp_velocity(-10,300)) == [100,40,90]
+    print("passed")
+
+def test_offset_time():
+    b=EventBatch.from_events(make_events())
+    assert b.copy().offset_time(5).tme_mon.tolist() == [5,15,25,35,45]
+    # times before 0 become 0
+    assert b.copy().offset_time(-15).tme_mon.tolist() == [0,0,5,15,25]
+    assert (b.copy().offset_time([1,2,3,4,5]).tme_mon.tolist()
+            == [1,12,23,34,45])
+    print("passed")
+
+def test_round_trip():
+    mevs=make_events()
+    b=bytes(midi_proc_jack.events_to_bytes(mevs))
+    batch=EventBatch.from_bytes(b)
+    assert batch.to_bytes() == b
+    assert len(batch) == len(mevs)
+    for mev,m in zip(mevs,midi_proc_jack.events_from_bytes(batch.to_bytes())):
+        assert (m.tme_mon,m.size,bytes(m.dat)) == (mev.tme_mon,mev.size,
+                bytes(mev.dat))
+    assert (bytes(midi_proc_jack.events_to_bytes(batch.to_events())) == b)
+    # a transformed batch decodes to the transformed events
+    m=EventBatch.from_bytes(b).transpose(2).to_events()[0]
+    assert (m.get_pitch(),m.get_velocity(),m.tme_mon) == (62,100,0)
+    print("passed")
+
+def test_copy():
+    # copies of decoded events own their bytes, changing them leaves the
+    # events of the batch alone
+    batch=EventBatch.from_events(make_events())
+    mevs=batch.to_events()
+    c=mevs[0].copy()
+    c.set_pitch(72)
+    c.set_velocity(1)
+    assert (mevs[0].get_pitch(),mevs[0].get_velocity()) == (60,100)
+    assert (c.get_pitch(),c.get_velocity()) == (72,1)
+    assert (batch.to_events()[0].get_pitch(),
+            batch.to_events()[0].get_velocity()) == (60,100)
+    print("passed")
+
+def test_per_message():
+    # batch callbacks also run on the events of each message when a
+    # MIDIProcThread isn't in batch mode
+    th=midi_proc_jack.MIDIProcThread(key_in=KEY_C_TO_PY,key_out=KEY_PY_TO_C)
+    midi_proc_jack.set_midi_batch_cb(None,'NoteOn',lambda b: b.transpose(12))
+    mevs=make_events()
+    th._proc_msg(bytes(midi_proc_jack.events_to_bytes(mevs)))
+    midi_proc_jack.reset_midi_batch_cb(None,None)
+    observed=[]
+    while th.q_out.current_messages > 0:
+        observed+=midi_proc_jack.events_from_bytes(
+                th.q_out.receive(type=midi_proc_jack.MSGTYPE)[0])
+    desired=EventBatch.from_events(mevs[:1]).transpose(12).to_events()+mevs[1:]
+    assert (sorted((m.tme_mon,bytes(m.dat)) for m in observed)
+            == sorted((m.tme_mon,bytes(m.dat)) for m in desired))
+    th.q_in.remove()
+    th.q_out.remove()
+    print("passed")
+
+if __name__ == '__main__':
+    test_scale_velocity()
+    test_clamp_velocity()
+    test_offset_time()
+    test_round_trip()
+    test_copy()
+    test_per_message()
@@ -1,41 +1,263 @@
+/* Correctness tests and benchmark for fastcache. Prints the failures and
+   exits with the number of failed tests. */
 #include "fastcache.h"
 #include <assert.h>
+#include <pthread.h>
+#include <stdint.h>
 #include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+#include <unistd.h>
 
 #define OBJSZ 32
 #define NOBJS 1024
+#define GROW_NOBJS 256
+#define BENCH_NITERS 1000000
+#define MAGIC 0x6d69646975ULL
 
-int main (void)
+/* idx shares its memory with the cache's free list link */
+typedef struct {
+    uint64_t idx;
+    uint64_t magic;
+} obj;
+
+static double
+now_ns(void)
 {
-    fastcache_t *fc = fastcache_new(OBJSZ,NOBJS);
-    int i;
-    char *addr = NULL;
-    for (i = 0; i < NOBJS; i++) {
-        char *tmp = fastcache_alloc(fc);
-        if (!addr) {
-            addr = tmp;
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC,&ts);
+    return ts.tv_sec*1e9 + ts.tv_nsec;
+}
+
+static int
+ptr_cmp(const void *a, const void *b)
+{
+    uintptr_t pa = *(uintptr_t*)a, pb = *(uintptr_t*)b;
+    return (pa > pb) - (pa < pb);
+}
+
+/* Check that the n objects are distinct, don't overlap and hold their index */
+static int
+check_objs(obj **objs, size_t n, const char *what)
+{
+    size_t i;
+    obj **sorted = malloc(n*sizeof(obj*));
+    int ret = 0;
+    memcpy(sorted,objs,n*sizeof(obj*));
+    qsort(sorted,n,sizeof(obj*),ptr_cmp);
+    for (i = 1; i < n; i++) {
+        if ((char*)sorted[i] - (char*)sorted[i-1] < OBJSZ) {
+            fprintf(stderr,"%s: objects %p and %p overlap\n",what,
+                    (void*)sorted[i-1],(void*)sorted[i]);
+            ret = 1;
+            break;
         }
-        if (((tmp-addr)/OBJSZ) != i) {
-            fprintf(stderr,"objs offset: %zu, i: %d\n",(tmp-addr)/OBJSZ,i);
+    }
+    for (i = 0; i < n; i++) {
+        if (objs[i]->idx != i) {
+            fprintf(stderr,"%s: object %zu overwritten\n",what,i);
+            ret = 1;
+            break;
         }
     }
-    for (i = 0; i < NOBJS; i++) {
-        char *tmp = addr+(OBJSZ*i);
-        if (((tmp-addr)/OBJSZ) != i) {
-            fprintf(stderr,"free objs offset: %zu, i: %d\n",(tmp-addr)/OBJSZ,i);
+    free(sorted);
+    return ret;
+}
+
+/* Allocate objs[first] up to objs[n-1] */
+static int
+alloc_n(fastcache_t *fc, obj **objs, size_t first, size_t n, const char *what)
+{
+    size_t i;
+    for (i = first; i < n; i++) {
+        if (!(objs[i] = fastcache_alloc(fc))) {
+            fprintf(stderr,"%s: alloc %zu of %zu failed\n",what,i,n);
+            return 1;
         }
-        fastcache_free(fc,tmp);
+        objs[i]->idx = i;
     }
-    for (i = 0; i < NOBJS; i++) {
-        char *tmp = fastcache_alloc(fc);
-        if (!addr) {
-            addr = tmp;
+    return 0;
+}
+
+static int
+test_alloc_free(void)
+{
+    fastcache_t *fc = fastcache_new(OBJSZ,NOBJS);
+    obj *objs[NOBJS];
+    size_t i;
+    int ret = 0;
+    ret |= alloc_n(fc,objs,0,NOBJS,"alloc");
+    ret |= check_objs(objs,NOBJS,"alloc");
+    if (fastcache_alloc(fc) != NULL) {
+        fprintf(stderr,"alloc: full cache returned an object\n");
+        ret = 1;
+    }
+    if (fastcache_nfree(fc) != 0) {
+        fprintf(stderr,"alloc: nfree %zu of full cache\n",fastcache_nfree(fc));
+        ret = 1;
+    }
+    /* free every other one, then the rest */
+    for (i = 0; i < NOBJS; i += 2) { fastcache_free(fc,objs[i]); }
+    if (fastcache_nfree(fc) != NOBJS/2) {
+        fprintf(stderr,"free: nfree %zu, expected %d\n",fastcache_nfree(fc),
+                NOBJS/2);
+        ret = 1;
+    }
+    for (i = 1; i < NOBJS; i += 2) { fastcache_free(fc,objs[i]); }
+    ret |= alloc_n(fc,objs,0,NOBJS,"realloc");
+    ret |= check_objs(objs,NOBJS,"realloc");
+    if (fastcache_alloc(fc) != NULL) {
+        fprintf(stderr,"realloc: full cache returned an object\n");
+        ret = 1;
+    }
+    fastcache_destroy(fc);
+    return ret;
+}
+
+static int
+test_grow(void)
+{
+    fastcache_t *fc = fastcache_new(OBJSZ,NOBJS);
+    obj *objs[NOBJS + GROW_NOBJS];
+    int ret = 0;
+    ret |= alloc_n(fc,objs,0,NOBJS,"grow");
+    if (fastcache_grow(fc,GROW_NOBJS)) {
+        fprintf(stderr,"grow: failed\n");
+        ret = 1;
+    }
+    if (fastcache_nfree(fc) != GROW_NOBJS) {
+        fprintf(stderr,"grow: nfree %zu, expected %d\n",fastcache_nfree(fc),
+                GROW_NOBJS);
+        ret = 1;
+    }
+    ret |= alloc_n(fc,objs,NOBJS,NOBJS + GROW_NOBJS,"grow");
+    ret |= check_objs(objs,NOBJS + GROW_NOBJS,"grow");
+    if (fastcache_alloc(fc) != NULL) {
+        fprintf(stderr,"grow: full cache returned an object\n");
+        ret = 1;
+    }
+    fastcache_destroy(fc);
+    return ret;
+}
+
+typedef struct {
+    fastcache_t *fc;
+    volatile int keeprunning;
+    size_t ngrown;
+} grow_thread_data;
+
+/* Keep a few objects free like the non-realtime thread in midi_proc_jack */
+static void *
+grow_thread(void *aux)
+{
+    grow_thread_data *d = aux;
+    while (d->keeprunning) {
+        if (fastcache_nfree(d->fc) < GROW_NOBJS) {
+            fastcache_grow(d->fc,GROW_NOBJS);
+            d->ngrown += GROW_NOBJS;
         }
-        if (((tmp-addr)/OBJSZ) != i) {
-            fprintf(stderr,"2 objs offset: %zu, i: %d\n",(tmp-addr)/OBJSZ,i);
+        usleep(100);
+    }
+    return NULL;
+}
+
+/* Allocate and free at random while another thread grows the cache, checking
+   that no object is handed out twice */
+static int
+test_grow_concurrent(void)
+{
+    grow_thread_data d = {
+        .fc = fastcache_new(sizeof(obj),GROW_NOBJS),
+        .keeprunning = 1,
+    };
+    size_t nheld = 0, i, nfailed = 0, max_held = 8*NOBJS;
+    obj **held = malloc(max_held*sizeof(obj*));
+    pthread_t th;
+    int ret = 0;
+    pthread_create(&th,NULL,grow_thread,&d);
+    srand(1);
+    for (i = 0; i < BENCH_NITERS; i++) {
+        /* allocate more than are freed so the cache has to grow */
+        if ((nheld < max_held) && ((nheld == 0) || (rand() % 8 < 5))) {
+            obj *o = fastcache_alloc(d.fc);
+            if (!o) {
+                nfailed++;
+                continue;
+            }
+            if (o->magic == MAGIC) {
+                fprintf(stderr,"grow concurrent: object %p allocated twice\n",
+                        (void*)o);
+                ret = 1;
+                break;
+            }
+            o->magic = MAGIC;
+            held[nheld++] = o;
+        } else {
+            size_t j = rand() % nheld;
+            held[j]->magic = 0;
+            fastcache_free(d.fc,held[j]);
+            held[j] = held[--nheld];
         }
     }
+    d.keeprunning = 0;
+    pthread_join(th,NULL);
+    printf("grow concurrent: held %zu, grown by %zu, alloc failed %zu times\n",
+            nheld,d.ngrown,nfailed);
+    free(held);
+    fastcache_destroy(d.fc);
+    return ret;
+}
 
-    return 0;
+/* Allocate and free one object with the cache nearly full, which is where
+   searching for a free object took longest */
+static void
+bench_nearly_full(void)
+{
+    fastcache_t *fc = fastcache_new(OBJSZ,NOBJS);
+    obj *objs[NOBJS];
+    size_t i;
+    double t;
+    alloc_n(fc,objs,0,NOBJS-1,"bench");
+    t = now_ns();
+    for (i = 0; i < BENCH_NITERS; i++) {
+        void *o = fastcache_alloc(fc);
+        fastcache_free(fc,o);
+    }
+    t = now_ns() - t;
+    printf("nearly full: alloc + free %.1f ns\n",t/BENCH_NITERS);
+    fastcache_destroy(fc);
+}
+
+/* Allocate all the objects then free them all */
+static void
+bench_fill_empty(void)
+{
+    fastcache_t *fc = fastcache_new(OBJSZ,NOBJS);
+    obj *objs[NOBJS];
+    size_t i, j;
+    double t;
+    t = now_ns();
+    for (i = 0; i < BENCH_NITERS/NOBJS; i++) {
+        for (j = 0; j < NOBJS; j++) { objs[j] = fastcache_alloc(fc); }
+        for (j = 0; j < NOBJS; j++) { fastcache_free(fc,objs[j]); }
+    }
+    t = now_ns() - t;
+    printf("fill and empty: alloc + free %.1f ns\n",
+            t/((BENCH_NITERS/NOBJS)*NOBJS));
+    fastcache_destroy(fc);
 }
 
+int main (void)
+{
+    int nfailed = 0;
+    nfailed += test_alloc_free();
+    nfailed += test_grow();
+    nfailed += test_grow_concurrent();
+    bench_nearly_full();
+    bench_fill_empty();
+    if (nfailed) {
+        fprintf(stderr,"%d tests failed\n",nfailed);
+    }
+    return nfailed;
+}
@@ -0,0 +1,66 @@
+# Check that the ornament of run_midi_proc_dome.py written as domelang programs
+# gives the same events as the Python callback of run_midi_proc_jack.py.
+
+import midi_dome
+import midi_proc_jack
+import random
+
+from testutil import check
+
+def ornament(mev):
+    mev.set_pitch(mev.get_pitch()-24)
+    r=[mev]
+    pat=[2,2,3,2,3]
+    curp=0
+    curt=0
+    for i in range(len(pat)):
+        m=mev.copy()
+        curp+=pat[i]
+        sc = 8/(i+1)
+        if sc <= 0: sc = 1
+        curt+=48000/sc
+        m.tme_mon+=curt
+        m.set_velocity(max(m.get_velocity()-(sc*5),0))
+        m.set_pitch(m.get_pitch()+curp)
+        r.append(m)
+    return r
+
+dome_ornament=dict(
+    pitch='-24 -22 ( -20 ( -17 ( -15 ( -12 ( +',
+    velocity='0 -40 ( -20 ( -13.333333333333334 ( -10 ( -8 ( +',
+    time='0 6000 ( 18000 ( 36000 ( 60000 ( 90000 ( +',
+    copies=6)
+
+def make_events(n):
+    rng=random.Random(1)
+    return [midi_proc_jack.MIDIEvent(rng.randint(0,1<<20),
+        rng.choice(['NoteOn','NoteOff']),rng.randint(0,15),
+        bytes([0,rng.randint(24,127),rng.randint(0,127)])) for i in range(n)]
+
+def test_ornament():
+    mevs=make_events(100)
+    desired=[]
+    for mev in mevs:
+        desired+=ornament(mev.copy())
+    cb=midi_dome.DomeCallback(**dome_ornament)
+    observed=cb(midi_proc_jack.EventBatch.from_events(mevs))
+    check('ornament',observed.to_bytes(),
+            bytes(midi_proc_jack.events_to_bytes(desired)))
+
+def test_fields():
+    mevs=[midi_proc_jack.MIDIEvent(100,'NoteOn',0,bytes([0,60,100])),
+            midi_proc_jack.MIDIEvent(200,'ChanPress',1,bytes([0,90])),
+            midi_proc_jack.MIDIEvent(300,'ControlChange',2,bytes([0,7,64]))]
+    cb=midi_dome.DomeCallback(pitch='70 +',velocity='2 ×',time='1000 -',
+            channel='3 +')
+    b=cb(midi_proc_jack.EventBatch.from_events(mevs))
+    # pitch wraps, velocity is clamped, times stop at 0 and only pitched
+    # events have their pitch changed
+    check('status',b.status.tolist(),[0x93,0xd4,0xb5])
+    check('data1',b.data1.tolist(),[(60+70)&0x7f,127,7])
+    check('data2',b.data2.tolist(),[127,0,64])
+    check('tme_mon',b.tme_mon.tolist(),[0,0,0])
+
+if __name__ == '__main__':
+    test_ornament()
+    test_fields()
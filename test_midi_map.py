@@ -0,0 +1,151 @@
+# Check MidiMaps run as callbacks against the Python callbacks they replace,
+# the tables they are compiled to against the callbacks, and their upload.
+
+import midi_map
+import midi_proc_jack
+import random
+import struct
+import sysv_ipc as ipc
+import test_midi_dome
+import time
+import warnings
+
+from midi_proc_jack import MIDIEvent,events_to_bytes
+from testutil import check
+
+# out of the way of the key of midi_proc_jack
+KEY_MAP=2126
+
+# the ornament of test_midi_dome.py
+ornament=midi_map.MidiMap(transpose=-24,fan_out=[(0,0)]+[(p,t,
+    lambda v,sc=sc: max(v-sc*5,0)) for p,t,sc in [(2,6000,8),(4,18000,4),
+        (7,36000,8/3),(9,60000,2),(12,90000,1.6)]])
+
+pitch_tab={107:43,108:45,109:47,110:48}
+makenote=midi_map.MidiMap(remap=pitch_tab,typ='NoteOn',
+        fan_out=[(0,0),(4,12000),(7,24000),(9,42000)])
+
+def test_ornament():
+    mevs=test_midi_dome.make_events(100)
+    desired=[]
+    for mev in mevs:
+        desired+=test_midi_dome.ornament(mev.copy())
+    observed=[]
+    for mev in mevs:
+        observed+=ornament(mev.copy())
+    check('ornament',bytes(events_to_bytes(observed)),
+            bytes(events_to_bytes(desired)))
+
+def test_makenote():
+    m=makenote(MIDIEvent(100,'ControlChange',2,bytes([0,108,90])))
+    check('makenote',[(e.tme_mon,e.typ,e.chan,e.get_pitch(),e.get_velocity())
+        for e in m],[(100,'NoteOn',2,45,90),(12100,'NoteOn',2,49,90),
+            (24100,'NoteOn',2,52,90),(42100,'NoteOn',2,54,90)])
+    mev=MIDIEvent(100,'ControlChange',2,bytes([0,7,90]))
+    check('makenote unmapped',makenote(mev),[mev])
+
+def test_bad_delay():
+    # delays that can't be uploaded are refused when the map is made
+    for delay in (-1,1<<32):
+        try:
+            midi_map.MidiMap(fan_out=[(0,delay)])
+            raised=False
+        except ValueError:
+            raised=True
+        check('bad delay %d' % (delay,),raised,True)
+
+def apply_table(tab,mev):
+    """
+    What process() in midi_proc_jack.c makes of mev with the table tab, None
+    if it goes on to Python.
+    """
+    buf=mev.dat
+    m=tab[buf[0]]
+    if m == 0:
+        return None
+    first,n,mapped=midi_map._entry_struct.unpack_from(tab,
+            midi_map._MAPS_OFF+((m-1)*128+buf[1])*4)
+    if not mapped:
+        return None
+    data2=buf[2] if mev.size >= 3 else 0
+    ret=[]
+    for i in range(first,first+n):
+        typ,chan,d1,curve,delay=midi_map._out_struct.unpack_from(tab,
+                midi_map._OUTS_OFF+i*midi_map._out_struct.size)
+        typ=typ or buf[0]&0xf0
+        chan=buf[0]&0x0f if chan == midi_map.MAPTAB_KEEP else chan
+        size=2 if typ in (0xc0,0xd0) else 3
+        ret.append(bytes([typ|chan,d1,
+            tab[midi_map._CURVES_OFF+curve*128+data2]][:size]))
+    return ret
+
+def test_table():
+    midi_proc_jack.set_midi_cb(0,['NoteOn','NoteOff'],ornament)
+    midi_proc_jack.set_midi_cb(None,'ControlChange',makenote)
+    midi_proc_jack.set_midi_cb(3,'ProgramChange',
+            midi_map.MidiMap(remap=lambda p: 127-p if p < 10 else None))
+    tab=midi_map._compile()
+    rng=random.Random(1)
+    ok=True
+    for i in range(2000):
+        typ=rng.choice(['NoteOn','NoteOff','ControlChange','ProgramChange'])
+        mev=MIDIEvent(0,typ,rng.randint(0,3),
+                bytes([0,rng.randint(0,127),rng.randint(0,127)]))
+        observed=apply_table(tab,mev)
+        cb=midi_proc_jack.midi_cbs[mev.dat[0]]
+        if cb is midi_proc_jack._midi_cb_default:
+            ok=ok and observed is None
+        else:
+            ok=ok and observed == [bytes(m.dat) for m in cb(mev.copy())]
+    check('table',ok,True)
+    midi_proc_jack.reset_midi_cb(None,None)
+    check('empty table',midi_map._compile()[:256],bytes(256))
+
+def head(shm):
+    return midi_map._head_struct.unpack(shm.read(midi_map._head_struct.size,0))
+
+def table(shm,i):
+    return shm.read(midi_map._TABLE_SIZE,
+            midi_map._TABLES_OFF+i*midi_map._TABLE_SIZE)
+
+def test_upload():
+    shm=ipc.SharedMemory(midi_proc_jack.port_key(KEY_MAP,0),ipc.IPC_CREAT,
+            size=midi_map._TABLES_OFF+2*midi_map._TABLE_SIZE)
+    shm.write(bytes(shm.size))
+    midi_proc_jack.set_midi_cb(None,'ControlChange',makenote)
+    # without midi_proc_jack -a using the tables uploads don't wait
+    t=time.monotonic()
+    midi_map.enable(key=KEY_MAP)
+    midi_map.upload()
+    check('no wait',time.monotonic()-t < midi_map.UPLOAD_WAIT,True)
+    check('active',head(shm)[0],0)
+    check('uploaded',table(shm,0),bytes(midi_map._compile()))
+    # midi_proc_jack, here shm, still uses table 1, the one to write
+    shm.write(struct.pack("II",0,1|midi_map.MAPTAB_SEEN_USED),0)
+    with warnings.catch_warnings(record=True) as w:
+        warnings.simplefilter('always')
+        midi_proc_jack.reset_midi_cb(None,None)
+    check('busy',(len(w),head(shm)[0],table(shm,1)),(1,0,table(shm,0)))
+    # seen is left set when midi_proc_jack dies without closing its port
+    shm.detach()
+    t=time.monotonic()
+    check('stale',midi_map.upload(),True)
+    check('stale no wait',time.monotonic()-t < midi_map.UPLOAD_WAIT,True)
+    shm=ipc.SharedMemory(midi_proc_jack.port_key(KEY_MAP,0))
+    check('stale active',head(shm)[0],1)
+    midi_proc_jack.set_midi_cb(None,'ControlChange',makenote)
+    # it has moved to table 0
+    shm.write(struct.pack("II",0,0|midi_map.MAPTAB_SEEN_USED),0)
+    midi_map.disable()
+    midi_proc_jack.reset_midi_cb(None,None)
+    check('disabled',(head(shm)[0],table(shm,1)),
+            (1,bytes(midi_map._TABLE_SIZE)))
+    shm.detach()
+    shm.remove()
+
+if __name__ == '__main__':
+    test_ornament()
+    test_makenote()
+    test_bad_delay()
+    test_table()
+    test_upload()
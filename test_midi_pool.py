@@ -0,0 +1,106 @@
+# Check that a WorkerPool gives the events the callbacks give when run in one
+# process, merged by time, and that a started pool sends the results of a
+# worker without waiting for a slower one.
+
+import midi_pool
+import midi_proc_jack
+import numpy as np
+import random
+import threading
+import time
+
+from midi_proc_jack import EventBatch
+from testutil import check
+
+def echo(mev):
+    m=mev.copy()
+    m.tme_mon+=1000*(mev.chan+1)
+    m.set_pitch(m.get_pitch()+12)
+    return [mev,m]
+
+def setup(i):
+    midi_proc_jack.set_midi_cb(None,'NoteOn',echo)
+    midi_proc_jack.set_midi_batch_cb(None,'NoteOff',
+            lambda b: b.offset_time(500))
+
+def make_events(n):
+    rng=random.Random(1)
+    t=0
+    mevs=[]
+    for i in range(n):
+        t+=rng.randint(0,100)
+        mevs.append(midi_proc_jack.MIDIEvent(t,
+            rng.choice(['NoteOn','NoteOff']),rng.randint(0,15),
+            bytes([0,rng.randint(24,100),rng.randint(1,127)])))
+    return mevs
+
+def serial(b):
+    mevs,done=midi_proc_jack._cbs_proc_bytes(b)
+    return bytes(midi_proc_jack.events_to_bytes(mevs))+done
+
+def test_same_events():
+    b=bytes(midi_proc_jack.events_to_bytes(make_events(500)))
+    setup(0)
+    desired=EventBatch.from_bytes(serial(b))
+    midi_proc_jack.reset_midi_cb(None,None)
+    midi_proc_jack.reset_midi_batch_cb(None,None)
+    with midi_pool.WorkerPool(4,setup) as pool:
+        observed=EventBatch.from_bytes(pool.process(b))
+    check('sorted',bool(np.all(np.diff(observed.tme_mon.astype(np.int64))
+        >= 0)),True)
+    # the same events, in the same order on each channel once sorted by time
+    for c in range(16):
+        check('channel %d' % (c,),observed.filter(chan=c).to_bytes(),
+                desired.filter(chan=c).sort().to_bytes())
+
+def tag(i):
+    midi_proc_jack.set_midi_batch_cb(None,None,
+            lambda b: b.offset_time(i*1000000))
+
+def test_key():
+    b=bytes(midi_proc_jack.events_to_bytes(make_events(100)))
+    # all the events go to one worker, whose callback tags them with its index
+    with midi_pool.WorkerPool(3,tag,key=lambda b: np.full(len(b),5)) as pool:
+        observed=EventBatch.from_bytes(pool.process(b))
+    check('key',observed.to_bytes(),
+            EventBatch.from_bytes(b).offset_time(2000000).to_bytes())
+
+# the callback of channel 0 takes this long
+SLOW=1.
+
+def slow(mev):
+    if mev.chan == 0:
+        time.sleep(SLOW)
+    return [mev]
+
+def slow_setup(i):
+    midi_proc_jack.set_midi_cb(None,'NoteOn',slow)
+
+def test_slow_channel():
+    mevs=[midi_proc_jack.MIDIEvent(t,'NoteOn',c,bytes([0,60,100]))
+        for t,c in [(0,0),(10,1),(20,1)]]
+    received=[]
+    done=threading.Event()
+    size=len(mevs)*midi_proc_jack.midimsg_struct.size
+    def send(b,tags):
+        received.append((time.monotonic(),b,tags))
+        if sum(len(r[1]) for r in received) == size:
+            done.set()
+    with midi_pool.WorkerPool(2,slow_setup) as pool:
+        pool.start(send)
+        t=time.monotonic()
+        pool.submit(bytes(midi_proc_jack.events_to_bytes(mevs)),'tag')
+        check('all sent',done.wait(SLOW*5),True)
+        pool.stop()
+    chans=[[m.chan for m in midi_proc_jack.events_from_bytes(b)]
+        for _,b,_ in received]
+    check('workers',chans,[[1,1],[0]])
+    check('tags',[tags for _,_,tags in received],[['tag'],['tag']])
+    # channel 1 isn't held up by channel 0
+    check('fast',received[0][0]-t < SLOW/2,True)
+    check('slow',received[1][0]-t >= SLOW,True)
+
+if __name__ == '__main__':
+    test_same_events()
+    test_key()
+    test_slow_channel()
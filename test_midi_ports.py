@@ -0,0 +1,57 @@
+# Check that PortProcesses runs a MIDIProcThread on the keys of each port with
+# the callbacks set up for that port, standing in for midi_proc_jack -n on
+# keys of its own.
+
+import midi_ports
+import midi_proc_jack
+import sysv_ipc as ipc
+
+from midi_proc_jack import EventBatch
+from testutil import check
+
+# out of the way of the keys of midi_proc_jack
+KEY_C_TO_PY=2124
+KEY_PY_TO_C=2123
+NPORTS=3
+
+def setup(port):
+    midi_proc_jack.set_midi_batch_cb(None,None,
+            lambda b: b.offset_time(1000*(port+1)))
+
+def queues(port):
+    return [ipc.MessageQueue(midi_proc_jack.port_key(key,port),ipc.IPC_CREAT,
+        max_message_size=midi_proc_jack.MSGQ_MAX_MESSAGE_SIZE)
+        for key in [KEY_C_TO_PY,KEY_PY_TO_C]]
+
+def test_port_key():
+    check('port 0',midi_proc_jack.port_key(123,0),123)
+    check('port 2',midi_proc_jack.port_key(126,2),146)
+    try:
+        midi_proc_jack.port_key(123,midi_proc_jack.MAX_PORTS)
+        check('too many ports',False,True)
+    except ValueError:
+        check('too many ports',True,True)
+
+def test_ports():
+    qs=[queues(port) for port in range(NPORTS)]
+    for q_in,q_out in qs:
+        for q in [q_in,q_out]:
+            while q.current_messages > 0:
+                q.receive(block=False)
+    mevs=[midi_proc_jack.MIDIEvent(100*i,'NoteOn',i,bytes([0,60+i,100]))
+            for i in range(4)]
+    b=bytes(midi_proc_jack.events_to_bytes(mevs))
+    with midi_ports.PortProcesses(NPORTS,setup,key_in=KEY_C_TO_PY,
+            key_out=KEY_PY_TO_C,batch=True) as procs:
+        for q_to_py,q_to_c in qs:
+            q_to_py.send(b,type=midi_proc_jack.MSGTYPE)
+        for port,(q_to_py,q_to_c) in enumerate(qs):
+            observed=q_to_c.receive(type=midi_proc_jack.MSGTYPE)[0]
+            check('port %d' % (port,),observed,
+                    EventBatch.from_bytes(b).offset_time(1000*(port+1))
+                    .to_bytes())
+    check('stopped',procs.is_alive(),False)
+
+if __name__ == '__main__':
+    test_port_key()
+    test_ports()
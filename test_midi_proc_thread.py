@@ -0,0 +1,63 @@
+# Check that SIGINT stops a MIDIProcThread started with start(), which waits
+# for events in another thread than the one handling the signal, and that
+# stop() wakes a thread waiting for space in a full output ring.
+
+import midi_proc_jack
+import os
+import signal
+import threading
+import time
+
+from testutil import check
+
+# out of the way of the keys of midi_proc_jack
+KEY_C_TO_PY=5124
+KEY_PY_TO_C=5123
+
+def test_sigint(**kwargs):
+    th=midi_proc_jack.MIDIProcThread(key_in=KEY_C_TO_PY,key_out=KEY_PY_TO_C,
+            **kwargs)
+    th.start()
+    while th not in midi_proc_jack._running_threads:
+        time.sleep(0.001)
+    try:
+        os.kill(os.getpid(),signal.SIGINT)
+        # the handler runs in the main thread between bytecodes
+        time.sleep(1)
+        check('exit %r' % (kwargs,),False,True)
+    except SystemExit:
+        pass
+    th.join(1)
+    check('stopped %r' % (kwargs,),th.is_alive(),False)
+    if th.transport == 'shm':
+        th.ring_in.remove()
+        th.ring_out.remove()
+    else:
+        th.q_in.remove()
+        th.q_out.remove()
+
+def test_stop_ring_full():
+    th=midi_proc_jack.MIDIProcThread(key_in=KEY_C_TO_PY,key_out=KEY_PY_TO_C,
+            transport='shm')
+    size=midi_proc_jack.midimsg_struct.size
+    th.ring_out.write(bytes(midi_proc_jack.SHMRING_NMSGS*size))
+    th.running=1
+    # nothing reads the ring so this waits for space
+    sender=threading.Thread(target=th._send,args=(bytes(size),))
+    sender.start()
+    time.sleep(0.1)
+    check('waiting',sender.is_alive(),True)
+    th.stop()
+    sender.join(1)
+    check('woken',sender.is_alive(),False)
+    # a stop() whose wakeup was dropped with stale ones before sleeping
+    th.ring_out.wake_space()
+    th.ring_out.wait_space(lambda: th.running)
+    th.ring_in.remove()
+    th.ring_out.remove()
+
+if __name__ == '__main__':
+    test_sigint()
+    test_sigint(batch=True)
+    test_sigint(transport='shm')
+    test_stop_ring_full()
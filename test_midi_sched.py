@@ -0,0 +1,53 @@
+# Check that a LookaheadScheduler sends events when they come within its
+# horizon, in time order.
+
+import midi_sched
+import time
+
+from midi_proc_jack import MIDIEvent,events_to_bytes,events_from_bytes
+from testutil import check
+
+def note(t,p):
+    return MIDIEvent(t,'NoteOn',0,bytes([0,p,100]))
+
+def wait_for(f,timeout=1.):
+    t=time.monotonic()+timeout
+    while not f() and time.monotonic() < t:
+        time.sleep(0.001)
+
+def set_clock(s,frame):
+    # as if an event stamped frame had just been received
+    s.observe(events_to_bytes([note(frame,0)]))
+    with s.cond:
+        s.cond.notify()
+
+def test_horizon():
+    # a slow clock so it doesn't move during the test
+    s=midi_sched.LookaheadScheduler(horizon=1000,rate=1,bucket_frames=100)
+    sent=[]
+    s.start(lambda b: sent.extend(events_from_bytes(bytes(b))))
+    b=events_to_bytes([note(10500,1),note(10900,2),note(13050,3),
+        note(12000,4),note(11200,5)])
+    check('before clock',s.hold(b),b)
+    set_clock(s,10000)
+    due=events_from_bytes(bytes(s.hold(b)))
+    check('due',[m.get_pitch() for m in due],[1,2])
+    check('pending',s.pending(),3)
+    set_clock(s,11000)
+    wait_for(lambda: len(sent) == 2)
+    check('released',[m.get_pitch() for m in sent],[5,4])
+    set_clock(s,12050)
+    wait_for(lambda: len(sent) == 3)
+    check('released last',[m.get_pitch() for m in sent],[5,4,3])
+    check('empty',s.pending(),0)
+    s.stop()
+
+def test_all_due():
+    s=midi_sched.LookaheadScheduler(horizon=1000,rate=1)
+    set_clock(s,10000)
+    b=events_to_bytes([note(10000,1),note(10999,2)])
+    check('all due',s.hold(b) is b,True)
+
+if __name__ == '__main__':
+    test_horizon()
+    test_all_due()
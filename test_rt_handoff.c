@@ -0,0 +1,199 @@
+/* Stress test for handing the messages received by input_thread to process()
+   in midi_proc_jack. A thread stands in for the JACK process callback, waking
+   every period and outputting the events due, while another floods it with
+   events due a few periods ahead. Counts the events that are output in a
+   later period than the one they were due in, for the two handoffs:
+
+   mutex:      the input thread schedules the events itself holding a mutex,
+               process() skips the period if its trylock fails.
+   ringbuffer: the input thread writes the events to a jack_ringbuffer and
+               process() schedules them, no lock is shared.
+
+   Events that were already late when the input thread handed them over are
+   counted separately. Only needs libjack for the ringbuffer, no JACK
+   server. */
+#include "fastcache.h"
+#include "timewheel.h"
+#include <jack/ringbuffer.h>
+#include <pthread.h>
+#include <sched.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <string.h>
+#include <time.h>
+#include <unistd.h>
+
+#define SAMPLE_RATE 48000
+#define PERIOD 128
+#define NPERIODS 2000
+/* events are due this many periods after they are sent */
+#define LOOKAHEAD 2
+/* the input thread receives BURST events every BURST_INTERVAL_NS */
+#define BURST 32
+#define BURST_INTERVAL_NS 100000
+#define CACHE_NOBJS 8192
+
+typedef struct {
+    timewheel_node node;
+    uint64_t tme_mon;
+} event;
+
+typedef struct {
+    int use_ringbuffer;
+    volatile int keeprunning;
+    volatile uint64_t monotonic_cnt;
+    pthread_mutex_t lock;
+    jack_ringbuffer_t *rb;
+    timewheel_t *tw;
+    fastcache_t *cache;
+    size_t nsent;
+    size_t noutput;
+    size_t nlate;
+    size_t nlate_handed;
+    size_t ndropped;
+    size_t nskipped_periods;
+} handoff;
+
+static void
+timespec_add_ns(struct timespec *ts, long ns)
+{
+    ts->tv_nsec += ns;
+    while (ts->tv_nsec >= 1000000000) {
+        ts->tv_nsec -= 1000000000;
+        ts->tv_sec++;
+    }
+}
+
+static void
+schedule(handoff *h, event *e)
+{
+    e->node.time = e->tme_mon;
+    timewheel_insert(h->tw,&e->node);
+}
+
+static void *
+input_thread(void *aux)
+{
+    handoff *h = aux;
+    struct timespec next;
+    uint64_t tmes[BURST];
+    int i;
+    clock_gettime(CLOCK_MONOTONIC,&next);
+    while (h->keeprunning) {
+        uint64_t due = h->monotonic_cnt + LOOKAHEAD*PERIOD;
+        for (i = 0; i < BURST; i++) { tmes[i] = due + (i*PERIOD)/BURST; }
+        if (h->use_ringbuffer) {
+            size_t n = 0;
+            while ((n < BURST) && h->keeprunning) {
+                size_t space = jack_ringbuffer_write_space(h->rb) / sizeof(uint64_t);
+                if (space == 0) {
+                    usleep(1000);
+                    continue;
+                }
+                if (space > BURST - n) { space = BURST - n; }
+                jack_ringbuffer_write(h->rb,(char*)&tmes[n],space*sizeof(uint64_t));
+                n += space;
+            }
+        } else {
+            pthread_mutex_lock(&h->lock);
+            for (i = 0; i < BURST; i++) {
+                event *e = fastcache_alloc(h->cache);
+                if (!e) {
+                    h->ndropped++;
+                    continue;
+                }
+                e->tme_mon = tmes[i];
+                schedule(h,e);
+            }
+            pthread_mutex_unlock(&h->lock);
+        }
+        /* late because the input thread itself was held up, not because of
+           the handoff */
+        for (i = 0; i < BURST; i++) {
+            if (tmes[i] < h->monotonic_cnt) { h->nlate_handed++; }
+        }
+        h->nsent += BURST;
+        timespec_add_ns(&next,BURST_INTERVAL_NS);
+        clock_nanosleep(CLOCK_MONOTONIC,TIMER_ABSTIME,&next,NULL);
+    }
+    return NULL;
+}
+
+static void
+output_due(handoff *h, uint64_t beg, uint64_t end)
+{
+    timewheel_node *due = timewheel_advance(h->tw,end);
+    while (due) {
+        event *e = (event*)due;
+        due = due->next;
+        if (e->tme_mon < beg) { h->nlate++; }
+        h->noutput++;
+        fastcache_free(h->cache,e);
+    }
+}
+
+static void
+process(handoff *h)
+{
+    uint64_t beg = h->monotonic_cnt;
+    uint64_t end = beg + PERIOD;
+    h->monotonic_cnt = end;
+    if (h->use_ringbuffer) {
+        event *e;
+        while (jack_ringbuffer_read_space(h->rb) >= sizeof(uint64_t)) {
+            /* when the cache is full the rest wait in the ringbuffer */
+            if (!(e = fastcache_alloc(h->cache))) { break; }
+            jack_ringbuffer_read(h->rb,(char*)&e->tme_mon,sizeof(uint64_t));
+            schedule(h,e);
+        }
+        output_due(h,beg,end);
+    } else if (pthread_mutex_trylock(&h->lock) == 0) {
+        output_due(h,beg,end);
+        pthread_mutex_unlock(&h->lock);
+    } else {
+        h->nskipped_periods++;
+    }
+}
+
+static void
+run(int use_ringbuffer)
+{
+    handoff h;
+    pthread_t th;
+    struct timespec next;
+    int i;
+    memset(&h,0,sizeof(h));
+    h.use_ringbuffer = use_ringbuffer;
+    h.keeprunning = 1;
+    pthread_mutex_init(&h.lock,NULL);
+    h.rb = jack_ringbuffer_create(CACHE_NOBJS*sizeof(uint64_t));
+    h.tw = timewheel_new(PERIOD,0);
+    h.cache = fastcache_new(sizeof(event),CACHE_NOBJS);
+    pthread_create(&th,NULL,input_thread,&h);
+    /* like JACK, run process() with realtime priority if allowed */
+    struct sched_param param = { .sched_priority = 10 };
+    pthread_setschedparam(pthread_self(),SCHED_FIFO,&param);
+    clock_gettime(CLOCK_MONOTONIC,&next);
+    for (i = 0; i < NPERIODS; i++) {
+        timespec_add_ns(&next,(1000000000L*PERIOD)/SAMPLE_RATE);
+        clock_nanosleep(CLOCK_MONOTONIC,TIMER_ABSTIME,&next,NULL);
+        process(&h);
+    }
+    h.keeprunning = 0;
+    pthread_join(th,NULL);
+    printf("%-10s sent %7zu output %7zu late %6zu (handed over late %6zu)"
+            " dropped %6zu skipped periods %4zu\n",
+            use_ringbuffer ? "ringbuffer" : "mutex",
+            h.nsent,h.noutput,h.nlate,h.nlate_handed,h.ndropped,
+            h.nskipped_periods);
+    timewheel_free(h.tw);
+    fastcache_destroy(h.cache);
+    jack_ringbuffer_free(h.rb);
+}
+
+int main (void)
+{
+    run(0);
+    run(1);
+    return 0;
+}
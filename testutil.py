@@ -0,0 +1,5 @@
+# Helpers shared by the test_*.py scripts.
+
+def check(name,observed,desired):
+    assert observed == desired,name
+    print("passed")
@@ -0,0 +1,159 @@
+/* Hierarchical timing wheel, see timewheel.h */
+#include "timewheel.h"
+#include <stdlib.h>
+
+#define SLOT_MASK (TIMEWHEEL_NSLOTS - 1)
+/* number of ticks covered by levels 0 up to and including l */
+#define LEVEL_SPAN(l) ((uint64_t)1 << (TIMEWHEEL_LEVEL_BITS*((l) + 1)))
+
+struct timewheel_t {
+    uint64_t tick_frames;
+    /* The tick whose slot in level 0 has not been completely expired yet */
+    uint64_t tick;
+    size_t size;
+    /* Slot i of level l holds the nodes due in ticks whose bits
+       (TIMEWHEEL_LEVEL_BITS*l) up to (TIMEWHEEL_LEVEL_BITS*(l+1)) equal i. A
+       level l > 0 slot is moved to the lower levels when the wheel reaches the
+       first tick it covers. */
+    timewheel_node *slots[TIMEWHEEL_NLEVELS][TIMEWHEEL_NSLOTS];
+};
+
+timewheel_t *
+timewheel_new(uint64_t tick_frames, uint64_t start_time)
+{
+    if (tick_frames == 0) { return NULL; }
+    timewheel_t *ret = calloc(1,sizeof(timewheel_t));
+    if (!ret) { return ret; }
+    ret->tick_frames = tick_frames;
+    ret->tick = start_time / tick_frames;
+    return ret;
+}
+
+void
+timewheel_free(timewheel_t *tw)
+{
+    free(tw);
+}
+
+static void
+_insert(timewheel_t *tw, timewheel_node *node)
+{
+    uint64_t t = node->time / tw->tick_frames;
+    int l;
+    if (t < tw->tick) { t = tw->tick; }
+    /* Nodes too far in the future are put in the furthest slot and reinserted
+       when it is reached */
+    if (t - tw->tick >= LEVEL_SPAN(TIMEWHEEL_NLEVELS - 1)) {
+        t = tw->tick + LEVEL_SPAN(TIMEWHEEL_NLEVELS - 1) - 1;
+    }
+    for (l = 0; l < TIMEWHEEL_NLEVELS - 1; l++) {
+        if (t - tw->tick < LEVEL_SPAN(l)) { break; }
+    }
+    timewheel_node **slot =
+        &tw->slots[l][(t >> (TIMEWHEEL_LEVEL_BITS*l)) & SLOT_MASK];
+    node->next = *slot;
+    *slot = node;
+}
+
+void
+timewheel_insert(timewheel_t *tw, timewheel_node *node)
+{
+    _insert(tw,node);
+    tw->size++;
+}
+
+/* Move the nodes in the level l slot that starts at the current tick to the
+   lower levels, cascading the higher levels first if they also start here. */
+static void
+_cascade(timewheel_t *tw, int l)
+{
+    uint64_t idx = (tw->tick >> (TIMEWHEEL_LEVEL_BITS*l)) & SLOT_MASK;
+    if ((idx == 0) && (l + 1 < TIMEWHEEL_NLEVELS)) {
+        _cascade(tw,l + 1);
+    }
+    timewheel_node *node = tw->slots[l][idx];
+    tw->slots[l][idx] = NULL;
+    while (node) {
+        timewheel_node *next = node->next;
+        _insert(tw,node);
+        node = next;
+    }
+}
+
+/* Merge two lists sorted by time, taking from a first when times are equal */
+static timewheel_node *
+_merge(timewheel_node *a, timewheel_node *b)
+{
+    timewheel_node head, *tail = &head;
+    while (a && b) {
+        if (b->time < a->time) {
+            tail->next = b;
+            b = b->next;
+        } else {
+            tail->next = a;
+            a = a->next;
+        }
+        tail = tail->next;
+    }
+    tail->next = a ? a : b;
+    return head.next;
+}
+
+/* Stable merge sort of a list by time */
+static timewheel_node *
+_sort(timewheel_node *list)
+{
+    if (!list || !list->next) { return list; }
+    timewheel_node *slow = list, *fast = list->next;
+    while (fast && fast->next) {
+        slow = slow->next;
+        fast = fast->next->next;
+    }
+    timewheel_node *second = slow->next;
+    slow->next = NULL;
+    return _merge(_sort(list),_sort(second));
+}
+
+timewheel_node *
+timewheel_advance(timewheel_t *tw, uint64_t end)
+{
+    uint64_t end_tick = end / tw->tick_frames;
+    timewheel_node *due = NULL, **due_tail = &due;
+    timewheel_node **slot;
+    /* all the nodes in the ticks before end_tick are due */
+    while (tw->tick < end_tick) {
+        slot = &tw->slots[0][tw->tick & SLOT_MASK];
+        if (*slot) {
+            *due_tail = *slot;
+            while (*due_tail) {
+                due_tail = &(*due_tail)->next;
+                tw->size--;
+            }
+            *slot = NULL;
+        }
+        tw->tick++;
+        if ((tw->tick & SLOT_MASK) == 0) {
+            _cascade(tw,1);
+        }
+    }
+    /* in end_tick only those before end */
+    slot = &tw->slots[0][tw->tick & SLOT_MASK];
+    while (*slot) {
+        if ((*slot)->time < end) {
+            *due_tail = *slot;
+            *slot = (*slot)->next;
+            due_tail = &(*due_tail)->next;
+            tw->size--;
+        } else {
+            slot = &(*slot)->next;
+        }
+    }
+    *due_tail = NULL;
+    return _sort(due);
+}
+
+size_t
+timewheel_size(timewheel_t *tw)
+{
+    return tw->size;
+}
@@ -0,0 +1,46 @@
+#ifndef TIMEWHEEL_H
+#define TIMEWHEEL_H
+
+/* Hierarchical timing wheel for scheduling items at times in samples.
+   Time is divided into ticks of tick_frames samples (e.g., one JACK period).
+   Inserting is O(1) and taking the items due is O(1) amortized per tick plus
+   sorting the items that are due. There is no limit on the number of items,
+   they are linked through the timewheel_node that must start each item. */
+#include <stddef.h>
+#include <stdint.h>
+
+#define TIMEWHEEL_LEVEL_BITS 6
+#define TIMEWHEEL_NSLOTS (1 << TIMEWHEEL_LEVEL_BITS)
+#define TIMEWHEEL_NLEVELS 4
+
+typedef struct timewheel_node {
+    struct timewheel_node *next;
+    /* time at which the item is due */
+    uint64_t time;
+} timewheel_node;
+
+typedef struct timewheel_t timewheel_t;
+
+/* tick_frames: size of one tick in samples
+   start_time: time in samples the wheel starts at */
+timewheel_t *
+timewheel_new(uint64_t tick_frames, uint64_t start_time);
+
+void
+timewheel_free(timewheel_t *tw);
+
+/* Schedule node at node->time. Nodes due before the current time are returned
+   by the next call to timewheel_advance. */
+void
+timewheel_insert(timewheel_t *tw, timewheel_node *node);
+
+/* Remove all the nodes with time < end and return them as a list sorted by
+   time. Returns NULL if there are none. */
+timewheel_node *
+timewheel_advance(timewheel_t *tw, uint64_t end);
+
+/* Number of nodes in the wheel */
+size_t
+timewheel_size(timewheel_t *tw);
+
+#endif /* TIMEWHEEL_H */